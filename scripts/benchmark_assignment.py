@@ -0,0 +1,53 @@
+"""Benchmark of the assignment solvers of the tracker on random similarity matrices, versus the
+greedy loop looking for the max of the whole matrix after each match.
+
+python scripts/benchmark_assignment.py --sizes 10 50 200 1000 --repeat 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mot.tracker.assignment import SOLVERS
+
+
+def loop_greedy_assignment(sim_matrix, threshold):
+    # the greedy matching formerly done by ObjectTracking
+    sim_matrix = sim_matrix.copy()
+    matches = []
+    for _ in range(sim_matrix.shape[0]):
+        max_values = np.max(sim_matrix, axis=1)
+        if np.max(max_values) < threshold:
+            break
+        new_idx = np.argmax(max_values)
+        matching_idx = np.argmax(sim_matrix[new_idx])
+        sim_matrix[new_idx, :] = -1.0
+        sim_matrix[:, matching_idx] = -1.0
+        matches.append((int(new_idx), int(matching_idx)))
+    return matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 1000],
+                        help="numbers of rows, and of columns, of the matrices")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5, help="number of matrices timed")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    solvers = dict(loop=loop_greedy_assignment, **SOLVERS)
+    print(("{:>6}" + " {:>14}" * len(solvers)).format(
+        "size", *["{} (ms)".format(name) for name in solvers]
+    ))
+    for size in args.sizes:
+        sim_matrix = rng.uniform(-1, 1, (size, size))
+        durations = []
+        for solver in solvers.values():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                solver(sim_matrix, args.threshold)
+            durations.append((time.perf_counter() - start) / args.repeat * 1000)
+        assert SOLVERS["greedy"](sim_matrix, args.threshold) == \
+            loop_greedy_assignment(sim_matrix, args.threshold)
+        print(("{:>6}" + " {:>14.2f}" * len(solvers)).format(size, *durations))
@@ -0,0 +1,92 @@
+"""Benchmark of the frames per second analyzed when sending batches of K frames per predict request.
+
+A stub of tensorflow serving runs in another process. It waits for a fixed overhead per request
+plus a cost per frame, to mimic a model running the graph once per batch.
+
+python scripts/benchmark_batching.py --frames 64 --batch-sizes 1 2 4 8
+"""
+import argparse
+import json
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+from mot.object_detection.query_server import localizer_tensorflow_serving_inference_batch
+from mot.serving.inference import iter_batches
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run_stub_server(port, call_overhead, frame_cost):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            # counting the separators between images is much faster than decoding the json
+            batch_size = body.count(b"]]],[[[") + 1
+            time.sleep(call_overhead + frame_cost * batch_size)
+            outputs = {
+                "output/boxes:0": [[[0, 0, 120, 40], [0, 0, 120, 80]]] * batch_size,
+                "output/scores:0": [[[0.71, 0.1, 0.1], [0.2, 0.05, 0.71]]] * batch_size,
+                "output/labels:0": [[1, 3]] * batch_size,
+            }
+            data = json.dumps({"outputs": outputs}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=64, help="number of frames to analyze")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent requests")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1024, 768])
+    parser.add_argument("--call-overhead", type=float, default=0.03,
+                        help="time in seconds spent by the stub server on each request")
+    parser.add_argument("--frame-cost", type=float, default=0.01,
+                        help="time in seconds spent by the stub server on each frame")
+    parser.add_argument("--port", type=int, default=8599)
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(
+        target=run_stub_server,
+        args=(args.port, args.call_overhead, args.frame_cost),
+        daemon=True,
+    )
+    server.start()
+    time.sleep(1)
+    url = "http://127.0.0.1:{}".format(args.port)
+    width, height = args.resolution
+    frames = [
+        np.random.randint(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(args.frames)
+    ]
+
+    print("{:>10} {:>10} {:>12}".format("batch size", "requests", "frames/sec"))
+    for batch_size in args.batch_sizes:
+        batches = list(iter_batches(frames, batch_size))
+        start = time.time()
+        with ThreadPoolExecutor(args.workers) as executor:
+            list(
+                executor.map(
+                    lambda batch: localizer_tensorflow_serving_inference_batch(
+                        batch, url, batch_size=batch_size
+                    ), batches
+                )
+            )
+        duration = time.time() - start
+        print("{:>10} {:>10} {:>12.2f}".format(batch_size, len(batches), args.frames / duration))
+    server.terminate()
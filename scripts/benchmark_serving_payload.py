@@ -0,0 +1,61 @@
+"""Benchmark of the size and of the client CPU time of the body of a predict request for a frame.
+
+It compares the former path, `json.dumps` of the nested lists of the resized image, with
+`payload.encode_signature`, with and without gzip compression.
+
+python scripts/benchmark_serving_payload.py --frames 5 --resolution 1024 768
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from mot.object_detection.payload import encode_signature
+from mot.object_detection.preprocessing import preprocess_for_serving
+
+
+def encode_with_lists(signature):
+    return json.dumps({name: value.tolist() for name, value in signature.items()}).encode("utf-8")
+
+
+def measure(encode, frames):
+    sizes, durations = [], []
+    for frame in frames:
+        signature, _ = preprocess_for_serving(frame)
+        start = time.process_time()
+        body = encode(signature)
+        durations.append(time.process_time() - start)
+        sizes.append(len(body))
+    return np.mean(sizes) / 1e6, np.mean(durations) * 1e3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=5, help="number of frames to encode")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1024, 768])
+    args = parser.parse_args()
+
+    width, height = args.resolution
+    # a smooth image compresses like a real frame, unlike uniform noise
+    gradient = np.linspace(0, 255, width)[None, :, None] * np.linspace(0, 1, height)[:, None, None]
+    frames = [
+        np.clip(gradient + np.random.randint(0, 16, (height, width, 3)), 0, 255).astype(np.uint8)
+        for _ in range(args.frames)
+    ]
+
+    encoders = [
+        ("json lists", encode_with_lists),
+        ("lossless", lambda signature: encode_signature(signature)[0]),
+        ("decimals=1", lambda signature: encode_signature(signature, decimals=1)[0]),
+        ("decimals=0", lambda signature: encode_signature(signature, decimals=0)[0]),
+        ("lossless gzip", lambda signature: encode_signature(signature, compress=True)[0]),
+        (
+            "decimals=0 gzip",
+            lambda signature: encode_signature(signature, decimals=0, compress=True)[0],
+        ),
+    ]
+    print("{:>16} {:>14} {:>16}".format("encoding", "MB per frame", "CPU ms per frame"))
+    for name, encode in encoders:
+        size, duration = measure(encode, frames)
+        print("{:>16} {:>14.2f} {:>16.0f}".format(name, size, duration))
@@ -0,0 +1,69 @@
+"""Benchmark of the similarity matrix between the detections of a frame and the live tracklets,
+computed by broadcasting versus with a loop over each pair.
+
+python scripts/benchmark_similarity.py --sizes 5 20 50 100 --repeat 20
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mot.tracker.object_tracking import ObjectTracking, Track, similarity
+
+
+def loop_similarity_matrix(new_scores, new_boxes, idx, tracklets):
+    # the former implementation of ObjectTracking.build_similarity_matrix
+    m = np.zeros((len(new_boxes), len(tracklets)))
+    for i in range(len(new_boxes)):
+        new_detection = [np.array(new_scores[i]), np.array(new_boxes[i]), idx]
+        for j in range(len(tracklets)):
+            m[i, j] = similarity(
+                new_detection, tracklets[j].get_latest_detection(apply_speed=True, new_frame_id=idx)
+            )
+    return m
+
+
+def random_boxes(rng, size):
+    return np.sort(rng.uniform(0.05, 0.95, (size, 2, 2)), axis=1).reshape(size, 4).tolist()
+
+
+def random_tracklets(rng, size, idx):
+    tracklets = []
+    for i in range(size):
+        boxes = random_boxes(rng, 3)
+        scores = rng.dirichlet(np.ones(3), size=3).tolist()
+        track = Track(i, scores[0], boxes[0], idx - 4)
+        track.add_matching_detection(scores[1], boxes[1], idx - 3)
+        track.add_matching_detection(scores[2], boxes[2], idx - 2)
+        tracklets.append(track)
+    return tracklets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 50, 100],
+                        help="numbers of detections, and of tracklets, of a frame")
+    parser.add_argument("--repeat", type=int, default=20, help="number of frames timed")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    object_tracker = ObjectTracking("benchmark", [])
+    idx = 10
+    print("{:>6} {:>12} {:>15} {:>8}".format("N = M", "loop (ms)", "vectorized (ms)", "speedup"))
+    for size in args.sizes:
+        new_scores = rng.dirichlet(np.ones(3), size=size).tolist()
+        new_boxes = random_boxes(rng, size)
+        tracklets = random_tracklets(rng, size, idx)
+        durations = []
+        for build in [loop_similarity_matrix, object_tracker.build_similarity_matrix]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                build(new_scores, new_boxes, idx, tracklets)
+            durations.append((time.perf_counter() - start) / args.repeat)
+        np.testing.assert_array_equal(
+            object_tracker.build_similarity_matrix(new_scores, new_boxes, idx, tracklets),
+            loop_similarity_matrix(new_scores, new_boxes, idx, tracklets),
+        )
+        print("{:>6} {:>12.2f} {:>15.2f} {:>8.1f}".format(
+            size, durations[0] * 1000, durations[1] * 1000, durations[0] / durations[1]
+        ))
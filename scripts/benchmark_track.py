@@ -0,0 +1,64 @@
+"""Benchmark of the detections added one by one to a track, as for an object staying in view,
+versus the former track recomputing its speed and score from the lists of all its detections.
+
+python scripts/benchmark_track.py --lengths 100 500 2000 5000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mot.tracker.object_tracking import Track
+
+
+class ListTrack():
+    # the former storage of Track, enough to add detections
+    def __init__(self, id, class_scores, box, frame):
+        self.scores = [class_scores]
+        self.boxes = [box]
+        self.frames = [frame]
+        self.speed = None
+        self.track_score = max(class_scores)
+
+    def add_matching_detection(self, scores, box, frame):
+        self.scores.append(scores)
+        self.boxes.append(box)
+        self.frames.append(frame)
+        if len(self.boxes) > 2:
+            self.speed = self.compute_speed()
+        self.track_score = np.max(np.mean(np.array(self.scores), axis=0))
+
+    def compute_speed(self):
+        boxes_array = np.array(self.boxes)
+        time_differences = np.array([float(y-x) for x,y in zip(self.frames[1:], self.frames[0:-1])])
+        speeds = (boxes_array[1:, :] - boxes_array[0:-1, :]).T / time_differences
+        speed = np.mean(speeds, axis = -1)
+        vx = (speed[0]+speed[2])/2
+        vy = (speed[1]+speed[3])/2
+        return np.array([vx, vy, vx, vy])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 500, 2000, 5000],
+                        help="numbers of detections of the track")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print("{:>8} {:>12} {:>13} {:>8}".format("length", "lists (ms)", "buffers (ms)", "speedup"))
+    for length in args.lengths:
+        boxes = (np.array([0.5, 0.5, 0.6, 0.6]) + rng.normal(0, 0.002, (length, 4))).tolist()
+        scores = rng.dirichlet(np.ones(3), size=length).tolist()
+        durations, tracks = [], []
+        for track_class in [ListTrack, Track]:
+            start = time.perf_counter()
+            track = track_class(0, scores[0], boxes[0], 0)
+            for frame in range(1, length):
+                track.add_matching_detection(scores[frame], boxes[frame], frame)
+            durations.append(time.perf_counter() - start)
+            tracks.append(track)
+        np.testing.assert_array_equal(tracks[0].speed, tracks[1].speed)
+        assert tracks[0].track_score == tracks[1].track_score
+        print("{:>8} {:>12.2f} {:>13.2f} {:>8.1f}".format(
+            length, durations[0] * 1000, durations[1] * 1000, durations[0] / durations[1]
+        ))
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional
+
+import aiohttp
+import numpy as np
+from tensorpack import logger
+
+from mot.object_detection.concurrency import get_limiter
+from mot.object_detection.query_server import (
+    MAX_RETRIES, RETRY_BACKOFF, RETRYABLE_STATUS_CODES, SERVING_PATH, TIMEOUT, client_stats,
+    encode_request, format_predictions, parse_serving_response, preprocess
+)
+from mot.object_detection.replicas import get_replica_set
+from mot.utils.deadlines import Deadline, DeadlineExceeded
+from mot.utils.metrics import BACKEND_ERRORS, IN_FLIGHT, STAGE_SECONDS, time_stage
+
+MAX_IN_FLIGHT = 16  # default number of requests waiting for tensorflow serving at the same time
+
+
+async def _count_new_connection(session, context, params):
+    client_stats.increment("new_connections")
+
+
+async def query_tensorflow_server_async(
+    session: aiohttp.ClientSession,
+    signature: Dict,
+    url: str,
+    max_retries: int = MAX_RETRIES,
+    deadline: Optional[Deadline] = None,
+) -> Dict:
+    """Same as `query_server.query_tensorflow_server`, with an asyncio HTTP session. With
+    MOT_ADAPTIVE_CONCURRENCY, each attempt waits for a slot of the limiter of
+    `concurrency.get_limiter` without blocking the event loop.
+
+    Arguments:
+
+    - *session*: The session used to send the request
+    - *signature*: A dict with the signature required by your tensorflow server
+    - *url*: Where you can find the tensorflow server, or the urls of several replicas of it
+    - *max_retries*: The max number of retries after the first attempt
+    - *deadline*: The deadline of the request. The wait for the limiter and the timeouts of each
+        attempt are reduced to the time left, and there is no retry once it has passed.
+
+    Returns:
+
+    - *Dict*: A dict with the answer signature.
+
+    Raises:
+
+    - *DeadlineExceeded*: If the deadline passed before an answer
+    """
+    replica_set = get_replica_set(url)
+    limiter = get_limiter()
+    # writing the body of a large image takes some CPU, which would block the other requests
+    data, headers = await asyncio.get_event_loop().run_in_executor(None, encode_request, signature)
+    start = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        client_stats.increment("requests")
+        # the outcome stays unknown if the attempt is cancelled
+        epoch, replica, latency, failed = None, None, None, None
+        try:
+            if limiter is not None:
+                epoch = await limiter.acquire_async(deadline)
+            timeout = _attempt_timeout(deadline)
+            replica = replica_set.acquire()
+            url_serving = os.path.join(replica.url, SERVING_PATH)
+            replica_start = time.perf_counter()
+            with IN_FLIGHT.track_inprogress(kind="backend"):
+                async with session.post(
+                    url_serving, data=data, headers=headers, timeout=timeout
+                ) as response:
+                    latency = time.perf_counter() - replica_start
+                    failed = response.status in RETRYABLE_STATUS_CODES
+                    replica_set.release(replica, failed, latency)
+                    replica = None
+                    if failed:
+                        BACKEND_ERRORS.inc(reason="status_{}".format(response.status))
+                    if not failed or attempt == max_retries:
+                        if failed:
+                            client_stats.increment("failures")
+                        body = await response.read()
+                        STAGE_SECONDS.observe(time.perf_counter() - start, stage="backend")
+                        with time_stage("decode"):
+                            outputs = json.loads(body)
+                        return parse_serving_response(outputs)
+                    logger.warning(
+                        "{} answered {}, retrying.".format(url_serving, response.status)
+                    )
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            failed = True
+            BACKEND_ERRORS.inc(reason=type(e).__name__)
+            if deadline is not None and deadline.expired():
+                client_stats.increment("failures")
+                logger.warning("No answer from {} before the deadline.".format(url_serving))
+                raise DeadlineExceeded("The deadline of the request has passed.") from e
+            if attempt == max_retries:
+                client_stats.increment("failures")
+                raise
+            logger.warning("Request to {} failed, retrying: {}".format(url_serving, e))
+        finally:
+            if latency is None and deadline is not None and deadline.expired():
+                failed = None  # cut by the deadline, which says nothing about the backend
+            if replica is not None:
+                replica_set.release(replica, failed)
+            if epoch is not None:
+                limiter.release(epoch, latency, failed)
+        client_stats.increment("retries")
+        backoff = random.uniform(0, RETRY_BACKOFF * 2**attempt)
+        if deadline is not None and deadline.remaining() is not None:
+            backoff = min(backoff, deadline.remaining())
+        await asyncio.sleep(backoff)
+
+
+def _attempt_timeout(deadline: Optional[Deadline]) -> aiohttp.ClientTimeout:
+    # the timeouts of `query_server.TIMEOUT`, and the whole attempt, reduced to the time left
+    sock_connect, sock_read = TIMEOUT if deadline is None else deadline.timeout(TIMEOUT)
+    total = deadline.remaining() if deadline is not None else None
+    return aiohttp.ClientTimeout(total=total, sock_connect=sock_connect, sock_read=sock_read)
+
+
+async def localizer_tensorflow_serving_inference_async(
+    session: aiohttp.ClientSession,
+    image: np.ndarray,
+    url: str,
+    return_all_scores: bool = False,
+    deadline: Optional[Deadline] = None,
+) -> Dict:
+    """Same as `query_server.localizer_tensorflow_serving_inference`, with an asyncio HTTP session.
+
+    The preprocessing runs in the default executor of the loop so that it doesn't block the other
+    requests in flight.
+
+    Arguments:
+
+    - *session*: The session used to send the request
+    - *image*: A numpy array loaded in BGR.
+    - *url*: A string representing the url.
+    - *return_all_scores*: Wheter to return scores for all classes.
+    - *deadline*: The deadline of the request, see `query_tensorflow_server_async`
+
+    Return:
+
+    - *Dict*: A dict with the predictions, see `query_server.localizer_tensorflow_serving_inference`
+    """
+    loop = asyncio.get_event_loop()
+    signature, ratio = await loop.run_in_executor(None, preprocess, image)
+    predictions = await query_tensorflow_server_async(session, signature, url, deadline=deadline)
+    return format_predictions(predictions, ratio, image.shape, return_all_scores)
+
+
+async def iter_localizer_inferences_async(
+    images: Iterable[np.ndarray],
+    url: str,
+    return_all_scores: bool = False,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    deadline: Optional[Deadline] = None,
+) -> AsyncIterator[Dict]:
+    """Make inferences on images while keeping up to max_in_flight requests waiting for tensorflow
+    serving.
+
+    The images are consumed only as the predictions are, so that a streamed video isn't decoded in
+    memory all at once.
+
+    Arguments:
+
+    - *images*: An iterable of numpy arrays loaded in BGR.
+    - *url*: A string representing the url.
+    - *return_all_scores*: Wheter to return scores for all classes.
+    - *max_in_flight*: The max number of requests sent and not yet consumed
+    - *deadline*: The deadline of the requests, see `query_tensorflow_server_async`
+
+    Returns:
+
+    - *AsyncIterator[Dict]*: The predictions, in the same order as the images
+    """
+    max_in_flight = max(1, max_in_flight)
+    timeout = aiohttp.ClientTimeout(sock_connect=TIMEOUT[0], sock_read=TIMEOUT[1])
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_count_new_connection)
+    async with aiohttp.ClientSession(
+        timeout=timeout, connector=connector, trace_configs=[trace_config]
+    ) as session:
+        pending = deque()
+        try:
+            for image in images:
+                if len(pending) >= max_in_flight:
+                    yield await pending.popleft()
+                pending.append(
+                    asyncio.ensure_future(
+                        localizer_tensorflow_serving_inference_async(
+                            session, image, url, return_all_scores, deadline
+                        )
+                    )
+                )
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+
+def localizer_tensorflow_serving_inferences(
+    images: Iterable[np.ndarray],
+    url: str,
+    return_all_scores: bool = False,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    deadline: Optional[Deadline] = None,
+) -> Iterator[Dict]:
+    """Synchronous version of `iter_localizer_inferences_async`, running its own event loop.
+
+    A single thread keeps max_in_flight requests in flight, so the concurrency can be sized on the
+    capacity of tensorflow serving rather than on the number of local CPUs.
+
+    Arguments:
+
+    - *images*: An iterable of numpy arrays loaded in BGR.
+    - *url*: A string representing the url.
+    - *return_all_scores*: Wheter to return scores for all classes.
+    - *max_in_flight*: The max number of requests sent and not yet consumed
+    - *deadline*: The deadline of the requests, see `query_tensorflow_server_async`. Waiting for
+        a prediction after it raises too, and the requests in flight are then cancelled.
+
+    Returns:
+
+    - *Iterator[Dict]*: The predictions, in the same order as the images
+
+    Raises:
+
+    - *DeadlineExceeded*, *asyncio.TimeoutError*: If the deadline passes before a prediction
+    """
+    loop = asyncio.new_event_loop()
+    inferences = iter_localizer_inferences_async(
+        images, url, return_all_scores, max_in_flight, deadline
+    )
+    try:
+        while True:
+            try:
+                prediction = inferences.__anext__()
+                if deadline is not None and deadline.remaining() is not None:
+                    prediction = asyncio.wait_for(prediction, deadline.remaining())
+                yield loop.run_until_complete(prediction)
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(inferences.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
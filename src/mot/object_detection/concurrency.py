@@ -0,0 +1,192 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from mot.utils.deadlines import Deadline, DeadlineExceeded
+from mot.utils.metrics import registry
+
+# Bound the requests sent at the same time to tensorflow serving by a limit adapted to its latency,
+# instead of by the number of workers alone.
+ADAPTIVE_CONCURRENCY = os.environ.get("MOT_ADAPTIVE_CONCURRENCY", "0") == "1"
+CONCURRENCY_MIN_LIMIT = int(os.environ.get("MOT_CONCURRENCY_MIN_LIMIT", 1))
+CONCURRENCY_MAX_LIMIT = int(os.environ.get("MOT_CONCURRENCY_MAX_LIMIT", 64))
+# The latency over which tensorflow serving is considered overloaded, as a multiple of its latency
+# without load.
+LATENCY_TOLERANCE = float(os.environ.get("MOT_CONCURRENCY_LATENCY_TOLERANCE", 2.0))
+BASELINE_WINDOW = 1000  # number of recent latencies the latency without load is the min of
+
+CONCURRENCY_LIMIT = registry.gauge(
+    "mot_backend_concurrency_limit",
+    "Max number of requests sent at the same time to tensorflow serving, adapted to its latency.",
+)
+
+
+class AIMDLimiter():
+    '''Limits the requests in flight to a backend, with an additive increase and a multiplicative
+    decrease of the limit, like the congestion window of TCP.
+
+    Each answer with a latency under latency_tolerance times the latency without load increases
+    the limit by 1 / limit, so about 1 per round trip of limit requests. An error or a latency
+    over it means that the backend is queuing the requests: the limit is multiplied by decrease,
+    at most once per round trip, since the requests sent before the decrease are slow too.
+    '''
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        latency_tolerance: float = 2.0,
+        window: int = BASELINE_WINDOW,
+    ):
+        """
+        Arguments:
+
+        - *initial_limit*: The limit before any answer
+        - *min_limit*, *max_limit*: The bounds of the limit
+        - *decrease*: The factor applied to the limit when the backend is overloaded
+        - *latency_tolerance*: The max ratio between the latency of an answer and the latency
+            without load, over which the backend is considered overloaded
+        - *window*: The number of recent latencies the latency without load is the min of
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._epoch = 0  # incremented at each decrease
+        self._latencies = deque(maxlen=window)
+        self._counters = {"increases": 0, "decreases": 0}
+        self._condition = threading.Condition()
+        self._waiters = []  # the futures of the coroutines waiting in `acquire_async`, with loops
+        CONCURRENCY_LIMIT.set(int(self._limit))
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> int:
+        """Wait for the request to fit in the limit. Call `release` once it is answered or failed.
+
+        Arguments:
+
+        - *deadline*: The deadline of the request, which bounds the wait
+
+        Returns:
+
+        - *int*: The epoch of the request, to give back to `release`
+
+        Raises:
+
+        - *DeadlineExceeded*: If the deadline passes before the request fits in the limit
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                timeout = deadline.remaining() if deadline is not None else None
+                if timeout == 0:
+                    raise DeadlineExceeded("The deadline of the request has passed.")
+                self._condition.wait(timeout)
+            self._in_flight += 1
+            return self._epoch
+
+    async def acquire_async(self, deadline: Optional[Deadline] = None) -> int:
+        """Same as `acquire`, without blocking the event loop while waiting.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return self._epoch
+                timeout = deadline.remaining() if deadline is not None else None
+                if timeout == 0:
+                    raise DeadlineExceeded("The deadline of the request has passed.")
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass  # the deadline is checked again
+
+    def release(self, epoch: int, latency: Optional[float], failed: Optional[bool]):
+        """Free the slot of a request and adapt the limit to its outcome.
+
+        Arguments:
+
+        - *epoch*: The epoch returned by `acquire`
+        - *latency*: The time in seconds of the answer, None if there was none
+        - *failed*: Whether the request failed. None if the outcome says nothing about the load of
+            the backend, when the request was cut by its deadline for instance: the limit is then
+            left unchanged.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if failed is not None:
+                self._adapt(epoch, latency, failed)
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, waiter)
+
+    def _adapt(self, epoch: int, latency: Optional[float], failed: bool):
+        if latency is not None:
+            self._latencies.append(latency)
+        overloaded = failed or latency is None or \
+            latency > self.latency_tolerance * min(self._latencies)
+        if not overloaded:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._counters["increases"] += 1
+        elif epoch == self._epoch:
+            # the requests sent before this decrease don't decrease the limit again
+            self._limit = max(self.min_limit, self._limit * self.decrease)
+            self._epoch += 1
+            self._counters["decreases"] += 1
+        CONCURRENCY_LIMIT.set(int(self._limit))
+
+    def stats(self) -> Dict[str, object]:
+        """Returns the limit, the requests in flight, the latency without load, and the number of
+        increases and decreases of the limit.
+        """
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update(
+                limit=int(self._limit),
+                in_flight=self._in_flight,
+                baseline_latency_seconds=min(self._latencies) if self._latencies else None,
+            )
+        return stats
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> Optional[AIMDLimiter]:
+    """Returns the limiter of the requests to tensorflow serving of this process, and creates it on
+    the first call.
+
+    Returns:
+
+    - *Optional[AIMDLimiter]*: The limiter, or None if ADAPTIVE_CONCURRENCY isn't set
+    """
+    global _limiter
+    if not ADAPTIVE_CONCURRENCY:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AIMDLimiter(
+                min_limit=CONCURRENCY_MIN_LIMIT,
+                max_limit=CONCURRENCY_MAX_LIMIT,
+                latency_tolerance=LATENCY_TOLERANCE,
+            )
+    return _limiter
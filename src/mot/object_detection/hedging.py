@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, Set, TypeVar
+
+import numpy as np
+
+from mot.utils.metrics import registry
+
+# When over 0, a request to tensorflow serving still waiting after this percentile of the recent
+# latencies is sent again, to another replica if possible, and the first answer is used.
+HEDGE_PERCENTILE = float(os.environ.get("MOT_HEDGE_PERCENTILE", 0))
+# The max ratio of hedged requests over all the requests, which caps the extra load.
+HEDGE_BUDGET = float(os.environ.get("MOT_HEDGE_BUDGET", 0.05))
+HEDGE_WINDOW = 1000  # number of recent latencies the percentile is computed on
+HEDGE_MIN_SAMPLES = 50  # no request is hedged before this many latencies are known
+HEDGE_REFRESH = 100  # number of latencies observed between two computations of the percentile
+HEDGE_THREADS = 64  # threads sending the hedged requests and the requests they duplicate
+
+HEDGES = registry.counter(
+    "mot_backend_hedges_total",
+    "Number of hedged requests to tensorflow serving, by outcome: sent, won when the duplicate "
+    "answered first, or skipped when the budget was exhausted.",
+    labelnames=("outcome",),
+)
+
+T = TypeVar("T")
+
+
+class _Urls(set):
+    """The urls of the replicas used by a call, which the thread of another call may copy.
+    """
+
+    def __init__(self, urls=()):
+        super().__init__(urls)
+        self._lock = threading.Lock()
+
+    def add(self, url: str):
+        with self._lock:
+            super().add(url)
+
+    def copy(self) -> "_Urls":
+        with self._lock:
+            return _Urls(self)
+
+
+class Hedger():
+    '''Sends a duplicate of the requests which are slower than most recent requests, and returns
+    the first answer.
+
+    A single slow answer delays the whole video it belongs to. Duplicating the requests waiting
+    longer than the percentile of the recent latencies cuts this tail, at the cost of a few more
+    requests. Each request earns budget tokens and each duplicate spends one, so that the
+    duplicates are at most about budget times the requests.
+
+    The duplicate that answers last can't be interrupted once sent: its answer is dropped. For the
+    same reason, a request which may be hedged is sent from a thread of the hedger, so that the
+    caller can return the answer of the duplicate first. The requests which can't be hedged, when
+    too few latencies are known or the budget is spent, are sent from the thread of the caller.
+    '''
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        window: int = HEDGE_WINDOW,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        threads: int = HEDGE_THREADS,
+        refresh: int = HEDGE_REFRESH,
+    ):
+        """
+        Arguments:
+
+        - *percentile*: The percentile of the recent latencies after which a request is hedged
+        - *budget*: The max ratio of hedged requests
+        - *window*: The number of recent latencies kept
+        - *min_samples*: The number of latencies needed before hedging
+        - *threads*: The number of threads sending the hedged requests
+        - *refresh*: The number of latencies observed between two computations of the percentile
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self._latencies = deque(maxlen=window)
+        self._observed = 0
+        self._delay = None
+        self._tokens = 1.0
+        self._max_tokens = max(1.0, budget * 100)  # the hedges allowed in a burst
+        self._counters = {"requests": 0, "hedges": 0, "wins": 0, "skipped": 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(threads)
+
+    def call(self, function: Callable[[Set[str]], T]) -> T:
+        """Call a function sending a request, and call it again if it is too slow to return.
+
+        Arguments:
+
+        - *function*: The function sending the request. It is given a set of the urls of the
+            replicas already used by the request, which it should avoid and update.
+
+        Returns:
+
+        - The first value returned by one of the calls
+
+        Raises:
+
+        - The exception of the first call, if both calls failed
+        """
+        with self._lock:
+            self._counters["requests"] += 1
+            self._tokens = min(self._max_tokens, self._tokens + self.budget)
+            delay = self._delay
+            can_hedge = delay is not None and self._tokens >= 1
+        start = time.perf_counter()
+        if not can_hedge:
+            result = function(_Urls())
+            latency = time.perf_counter() - start
+            self.observe(latency)
+            if delay is not None and latency > delay:
+                self._skip()
+            return result
+
+        # each call has its own urls, the duplicate starts from a copy of those of the first call
+        avoid = _Urls()
+        primary = self._executor.submit(function, avoid)
+        primary.add_done_callback(lambda future: self._observe_future(future, start))
+        if wait([primary], timeout=delay).done or not self._spend_token():
+            return primary.result()
+        hedge = self._executor.submit(function, avoid.copy())
+        HEDGES.inc(outcome="sent")
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        with self._lock:
+                            self._counters["wins"] += 1
+                        HEDGES.inc(outcome="won")
+                    return future.result()
+        return primary.result()
+
+    def delay(self) -> Optional[float]:
+        """Returns the time after which a request is hedged, or None if too few latencies are known.
+        It is the percentile of the recent latencies, computed again every `refresh` latencies.
+        """
+        return self._delay
+
+    def observe(self, latency: float):
+        """Record the latency of a request, in seconds.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._observed += 1
+            if len(self._latencies) >= self.min_samples and (
+                self._delay is None or self._observed % self.refresh == 0
+            ):
+                self._delay = float(np.percentile(self._latencies, self.percentile))
+
+    def stats(self) -> Dict[str, object]:
+        """Returns the counters of the hedger, with the ratio of hedged requests and the current
+        delay before hedging.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["delay_seconds"] = self.delay()
+        stats["hedge_rate"] = stats["hedges"] / max(1, stats["requests"])
+        return stats
+
+    def _observe_future(self, future: Future, start: float):
+        if not future.cancelled() and future.exception() is None:
+            self.observe(time.perf_counter() - start)
+
+    def _spend_token(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                self._counters["skipped"] += 1
+            else:
+                self._tokens -= 1
+                self._counters["hedges"] += 1
+                return True
+        HEDGES.inc(outcome="skipped")
+        return False
+
+    def _skip(self):
+        with self._lock:
+            self._counters["skipped"] += 1
+        HEDGES.inc(outcome="skipped")
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Optional[Hedger]:
+    """Returns the hedger of the requests to tensorflow serving, and creates it on the first call.
+
+    Returns:
+
+    - *Optional[Hedger]*: The hedger, or None if HEDGE_PERCENTILE is 0
+    """
+    global _hedger
+    if HEDGE_PERCENTILE <= 0:
+        return None
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(HEDGE_PERCENTILE, HEDGE_BUDGET)
+    return _hedger
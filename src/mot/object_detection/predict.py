@@ -16,6 +16,7 @@ import tensorpack.utils.viz as tpviz
 from tensorpack.predict import MultiTowerOfflinePredictor, OfflinePredictor, PredictConfig
 from tensorpack.tfutils import SmartInit, get_tf_version_tuple
 from tensorpack.tfutils.export import ModelExporter
+from tensorpack.tfutils.tower import PredictTowerContext
 from tensorpack.utils import fs, logger
 
 from mot.object_detection.dataset import DatasetRegistry, register_mot
@@ -24,6 +25,7 @@ from mot.object_detection.config import finalize_configs
 from mot.object_detection.data import get_eval_dataflow, get_train_dataflow
 from mot.object_detection.eval import DetectionResult, multithread_predict_dataflow, predict_image
 from mot.object_detection.modeling.generalized_rcnn import ResNetC4Model, ResNetFPNModel
+from mot.object_detection.modeling.model_box import clip_boxes
 from mot.object_detection.viz import (
     draw_annotation, draw_final_outputs, draw_predictions,
     draw_proposal_recall, draw_final_outputs_blackwhite)
@@ -81,6 +83,78 @@ def do_visualize(model, model_path, nr_visualize=100, output_dir='output'):
             pbar.update()
 
 
+def resize_in_graph(image, short_edge_length, max_size):
+    """
+    Same as `CustomResize` with a fixed short edge length, with tensorflow operations.
+
+    Args:
+        image: a HxWx3 uint8 tensor
+        short_edge_length (int): the length of the shortest edge after resizing.
+        max_size (int): maximum allowed longest edge length.
+
+    Returns:
+        a float32 tensor of the resized image, and the float32 [newh, neww] shape it was resized to
+    """
+    shape = tf.cast(tf.shape(image)[:2], tf.float32)
+    scale = tf.minimum(short_edge_length / tf.reduce_min(shape), max_size / tf.reduce_max(shape))
+    new_shape = tf.floor(shape * scale + 0.5)
+    resized = tf.image.resize_bilinear(
+        tf.expand_dims(tf.cast(image, tf.float32), 0), tf.cast(new_shape, tf.int32),
+        half_pixel_centers=True)
+    return resized[0], new_shape
+
+
+def export_serving_from_bytes(model, model_path, output_dir):
+    """
+    Export a SavedModel taking an encoded JPEG or PNG image, to query with
+    `preprocessing.encode_for_serving`.
+
+    The decoding, the resizing of `predict_image` and the scaling of the boxes back to the
+    coordinates of the original image run in the graph, so that the clients send compressed images
+    instead of resized float pixels.
+
+    Args:
+        model: the model to export
+        model_path (str): the checkpoint to load
+        output_dir (str): where to save the SavedModel
+    """
+    with tf.Graph().as_default():
+        image_bytes = tf.placeholder(tf.string, shape=(), name='image_bytes')
+        image = tf.image.decode_image(image_bytes, channels=3, expand_animations=False)
+        image = tf.reverse(image, axis=[-1])  # RGB to BGR, as cv2 decodes images
+        orig_shape = tf.shape(image)[:2]
+        resized_image, new_shape = resize_in_graph(
+            image, cfg.PREPROC.TEST_SHORT_EDGE_SIZE, cfg.PREPROC.MAX_SIZE)
+
+        # the other inputs are only used for training, they are never fed
+        inputs = [resized_image if spec.name == 'image' else
+                  tf.placeholder(spec.dtype, spec.shape, spec.name)
+                  for spec in model.get_input_signature()]
+        with PredictTowerContext(''):
+            model.build_graph(*inputs)
+
+        graph = tf.get_default_graph()
+        output_names = model.get_inference_tensor_names()[1]
+        outputs = {name + ':0': graph.get_tensor_by_name(name + ':0') for name in output_names}
+        scale = tf.sqrt(tf.reduce_prod(new_shape / tf.cast(orig_shape, tf.float32)))
+        outputs['output/boxes:0'] = clip_boxes(outputs['output/boxes:0'] / scale, orig_shape)
+
+        saved_model = tf.saved_model.utils
+        signature = tf.saved_model.signature_def_utils.build_signature_def(
+            inputs={'image_bytes:0': saved_model.build_tensor_info(image_bytes)},
+            outputs={name: saved_model.build_tensor_info(tensor) for name, tensor in outputs.items()},
+            method_name=tf.saved_model.signature_constants.PREDICT_METHOD_NAME)
+
+        sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
+        SmartInit(model_path).init(sess)
+        builder = tf.saved_model.builder.SavedModelBuilder(output_dir)
+        builder.add_meta_graph_and_variables(
+            sess, [tf.saved_model.tag_constants.SERVING],
+            signature_def_map={'serving_default': signature})
+        builder.save()
+        logger.info("SavedModel taking encoded images created at {}.".format(output_dir))
+
+
 def do_evaluate(pred_config, output_file):
     num_tower = max(cfg.TRAIN.NUM_GPUS, 1)
     graph_funcs = MultiTowerOfflinePredictor(
@@ -124,6 +198,8 @@ if __name__ == '__main__':
                         nargs='+')
     parser.add_argument('--compact', help='Save a model to .pb')
     parser.add_argument('--serving', help='Save a model to serving file')
+    parser.add_argument('--serving-bytes', help='Save a model to serving file, taking encoded '
+                                                'JPEG or PNG images which are resized in the graph')
 
     args = parser.parse_args()
     if args.config:
@@ -144,6 +220,8 @@ if __name__ == '__main__':
 
     if args.visualize:
         do_visualize(MODEL, args.load)
+    elif args.serving_bytes:
+        export_serving_from_bytes(MODEL, args.load, args.serving_bytes)
     else:
         predcfg = PredictConfig(
             model=MODEL,
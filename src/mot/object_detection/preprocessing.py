@@ -1,6 +1,15 @@
+import base64
+import struct
+from typing import Optional
+
 import numpy as np
 import cv2
 
+JPEG_QUALITY = 95  # quality of the frames sent to a SavedModel decoding images in its graph
+# the first bytes of the formats which a SavedModel decoding images in its graph reads
+GRAPH_IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+EXIF_ORIENTATION_TAG = 0x0112
+
 
 def resize_to_min_dimension(image, min_dimension: int, max_dimension: int):
     """Resize an image given to the min size maintaining the aspect ratio.
@@ -52,8 +61,121 @@ def preprocess_for_serving(image, min_dimension=800, max_dimension=1300):
 
     Returns:
 
-    - *input_signature*: A dictionary which match the server signature
+    - *input_signature*: A dictionary which match the server signature. The image is kept as a
+        numpy array, see `payload.encode_signature` to write it in a request.
     - *scaling_ratio*: A float representing the scaling to resize the image.
     """
     resized_image, scale_ratio = resize_to_min_dimension(image, min_dimension, max_dimension)
-    return {"inputs": resized_image.tolist()}, scale_ratio
+    return {"inputs": resized_image}, scale_ratio
+
+
+def preprocess_batch_for_serving(images, min_dimension=800, max_dimension=1300):
+    """Same as `preprocess_for_serving`, for a batch of images sent in a single request.
+
+    Arguments:
+
+    - *images*: A list of np.array of shape [height, width, channels] in BGR. They must have the
+        same shape once resized, which is the case for the frames of a video.
+    - *min_dimension*: minimum image dimension.
+    - *max_dimension*: If the resized largest size is over max_dimension. Will use to max_dimension
+    to compute the resizing ratio.
+
+    Returns:
+
+    - *input_signature*: A dictionary which match the server signature, with a batch dimension
+    - *scaling_ratios*: A list with the float used to resize each image.
+
+    Raises:
+
+    - *ValueError*: If the images don't have the same shape once resized
+    """
+    resized_images, scale_ratios = zip(
+        *[resize_to_min_dimension(image, min_dimension, max_dimension) for image in images]
+    )
+    if len(set(resized_image.shape for resized_image in resized_images)) > 1:
+        raise ValueError("The images of a batch must have the same shape once resized.")
+    return {"inputs": np.stack(resized_images)}, list(scale_ratios)
+
+
+
+def encode_for_serving(image, quality=JPEG_QUALITY, encoded_image: Optional[bytes] = None):
+    """Same as `preprocess_for_serving`, for a SavedModel exported with `predict.py --serving-bytes`.
+
+    The image is sent as a JPEG, which the SavedModel decodes and resizes in its graph. The boxes it
+    answers are already in the coordinates of the original image. An uploaded JPEG or PNG is sent
+    as it is, without the CPU and the loss of a new encoding, unless it has an EXIF orientation:
+    OpenCV applies it when decoding, and the graph doesn't, so the boxes wouldn't match the image.
+
+    Arguments:
+
+    - *image*: A np.array of shape [height, width, channels] in BGR
+    - *quality*: The JPEG quality, from 0 to 100
+    - *encoded_image*: The bytes the image was decoded from, if any
+
+    Returns:
+
+    - *input_signature*: A dictionary which match the server signature
+    - *scaling_ratio*: 1.0, since the boxes don't need to be scaled back
+
+    Raises:
+
+    - *ValueError*: If the image cannot be encoded
+    """
+    if encoded_image is None or not encoded_image.startswith(GRAPH_IMAGE_SIGNATURES) or \
+            exif_orientation(encoded_image) not in [None, 1]:
+        if image.dtype != np.uint8:
+            image = np.clip(np.round(image), 0, 255).astype(np.uint8)
+        success, encoded_array = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not success:
+            raise ValueError("Could not encode the image of shape {} to JPEG.".format(image.shape))
+        encoded_image = encoded_array.tobytes()
+    return {"inputs": {"b64": base64.b64encode(encoded_image).decode("ascii")}}, 1.0
+
+
+def exif_orientation(encoded_image: bytes) -> Optional[int]:
+    """Returns the EXIF orientation of a JPEG or a PNG, from 1 for upright to 8.
+
+    Returns:
+
+    - *Optional[int]*: The orientation, or None if the image has none or can't be read
+    """
+    try:
+        if encoded_image.startswith(b"\x89PNG"):
+            # the eXIf chunk comes before the image data
+            position = 8
+            while position + 8 <= len(encoded_image):
+                length, kind = struct.unpack(">I4s", encoded_image[position:position + 8])
+                if kind in [b"eXIf", b"IDAT"]:
+                    if kind == b"IDAT":
+                        return None
+                    return _tiff_orientation(encoded_image[position + 8:position + 8 + length])
+                position += 12 + length
+            return None
+        # the segments of a JPEG up to the compressed data, looking for the APP1 one of EXIF
+        position = 2
+        while position + 4 <= len(encoded_image) and encoded_image[position] == 0xFF:
+            marker = encoded_image[position + 1]
+            if marker in [0xD9, 0xDA]:
+                return None
+            length = struct.unpack(">H", encoded_image[position + 2:position + 4])[0]
+            segment = encoded_image[position + 4:position + 2 + length]
+            if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+                return _tiff_orientation(segment[6:])
+            position += 2 + length
+    except struct.error:
+        pass
+    return None
+
+
+def _tiff_orientation(tiff: bytes) -> Optional[int]:
+    # the orientation is in the first image file directory of the EXIF data
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+    directory = struct.unpack(order + "I", tiff[4:8])[0]
+    entries = struct.unpack(order + "H", tiff[directory:directory + 2])[0]
+    for i in range(entries):
+        entry = tiff[directory + 2 + 12 * i:directory + 14 + 12 * i]
+        if struct.unpack(order + "H", entry[:2])[0] == EXIF_ORIENTATION_TAG:
+            return struct.unpack(order + "H", entry[8:10])[0]
+    return None
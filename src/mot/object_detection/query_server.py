@@ -1,15 +1,253 @@
-import json
 import os
-from typing import Dict
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
 
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from tensorpack import logger
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from mot.object_detection.preprocessing import preprocess_for_serving
+from mot.object_detection.concurrency import get_limiter
+from mot.object_detection.hedging import get_hedger
+from mot.object_detection.payload import encode_signature
+from mot.object_detection.preprocessing import (
+    encode_for_serving, preprocess_batch_for_serving, preprocess_for_serving
+)
+from mot.object_detection.replicas import get_replica_set
+from mot.utils.deadlines import Deadline, DeadlineExceeded, current_deadline
+from mot.utils.metrics import BACKEND_ERRORS, IN_FLIGHT, registry, time_stage
 
+SERVING_PATH = "v1/models/serving:predict"  # the predict endpoint of the model served
+POOL_MAXSIZE = 32  # max number of keep-alive connections per host in each session
+TIMEOUT = (10, 60)  # (connect, read) timeouts in seconds of a request to tensorflow serving
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.1  # in seconds, doubled at each retry, the actual wait is drawn in [0, backoff]
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+BATCH_SIZE = 8  # default max number of images sent in a single predict request
+# Compress the body of the predict requests with gzip. It saves bandwidth when tensorflow serving
+# runs on another host, at the cost of some CPU on both sides.
+COMPRESS_REQUESTS = os.environ.get("MOT_COMPRESS_REQUESTS", "0") == "1"
+# Send the images as JPEG to a SavedModel exported with `predict.py --serving-bytes`, which decodes
+# and resizes them in its graph. Such a SavedModel only takes one image per request.
+ENCODED_INPUTS = os.environ.get("MOT_ENCODED_INPUTS", "0") == "1"
 
-def query_tensorflow_server(signature: Dict, url: str) -> Dict:
+
+class ClientStats():
+    """Counters about the requests sent to tensorflow serving, shared by the threads of a process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "new_connections": 0, "retries": 0, "failures": 0}
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def as_dict(self) -> Dict[str, int]:
+        """Returns a copy of the counters, with the number of requests which reused a connection.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["reused_connections"] = max(0, counters["requests"] - counters["new_connections"])
+        return counters
+
+
+client_stats = ClientStats()
+_local = threading.local()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+
+    def _new_conn(self):
+        client_stats.increment("new_connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+
+    def _new_conn(self):
+        client_stats.increment("new_connections")
+        return super()._new_conn()
+
+
+def get_client_stats() -> Dict[str, int]:
+    """Returns the counters of the requests sent to tensorflow serving by this process.
+
+    Returns:
+
+    - *Dict[str, int]*: A dict such as
+
+    ```python
+    {
+        "requests": 1000,  # the number of HTTP requests sent, retries included
+        "new_connections": 8,
+        "reused_connections": 992,
+        "retries": 3,
+        "failures": 0,  # the queries which failed after all the retries
+    }
+    ```
+    """
+    return client_stats.as_dict()
+
+
+def render_client_stats():
+    """Returns the counters of `get_client_stats` in the Prometheus text format.
+    """
+    lines = []
+    for name, value in sorted(get_client_stats().items()):
+        lines.append("# TYPE mot_serving_client_{}_total counter".format(name))
+        lines.append("mot_serving_client_{}_total {}".format(name, value))
+    return lines
+
+
+registry.add_collector(render_client_stats)
+
+
+def get_session() -> requests.Session:
+    """Returns the HTTP session of the current thread, which keeps the connections to tensorflow
+    serving alive between the requests.
+
+    Each thread of each process has its own session, so connections are never shared between
+    threads or with a forked process.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session, _local.pid = session, os.getpid()
+    return _local.session
+
+
+def post_with_retries(
+    url: Union[str, Sequence[str]],
+    data: bytes,
+    headers: Dict,
+    timeout=TIMEOUT,
+    max_retries: int = MAX_RETRIES,
+    path: str = "",
+    avoid: Optional[Set[str]] = None,
+    deadline: Optional[Deadline] = None,
+) -> requests.Response:
+    """Send a POST request with the session of the current thread, and retry it on connection
+    errors, timeouts and retryable status codes.
+
+    Each attempt is routed to a replica by `replicas.get_replica_set`, so a retry usually goes to
+    another replica when there are several. With MOT_ADAPTIVE_CONCURRENCY, each attempt waits for
+    a slot of the limiter of `concurrency.get_limiter`. The wait between two retries is drawn
+    uniformly between 0 and an exponential backoff, so that the clients hitting the same error
+    don't retry all at once.
+
+    Arguments:
+
+    - *url*: The url to post to, or the urls of several replicas, see `replicas.parse_urls`
+    - *data*: The body of the request
+    - *headers*: The headers of the request
+    - *timeout*: A float or a (connect, read) tuple, in seconds
+    - *max_retries*: The max number of retries after the first attempt
+    - *path*: Joined to the url of the replica
+    - *avoid*: The urls of the replicas already used by this request, which the attempts avoid.
+        The urls of the replicas of the attempts are added to it.
+    - *deadline*: The deadline of the request. The wait for the limiter and the timeout of each
+        attempt are reduced to the time left, and there is no retry once it has passed.
+
+    Returns:
+
+    - *requests.Response*: The last response received
+
+    Raises:
+
+    - *requests.ConnectionError*, *requests.Timeout*: If the last attempt failed without response
+    - *DeadlineExceeded*: If the deadline passed before an answer
+    """
+    replica_set = get_replica_set(url)
+    limiter = get_limiter()
+    for attempt in range(max_retries + 1):
+        client_stats.increment("requests")
+        epoch, replica, latency, failed = None, None, None, True
+        try:
+            # the slot of the limiter is granted first, so that a request waiting for it isn't
+            # counted as outstanding on a replica, and its timeout doesn't include the wait
+            if limiter is not None:
+                epoch = limiter.acquire(deadline)
+            attempt_timeout = timeout if deadline is None else deadline.timeout(timeout)
+            replica = replica_set.acquire(avoid or ())
+            if avoid is not None:
+                avoid.add(replica.url)
+            url_replica = os.path.join(replica.url, path) if path else replica.url
+            start = time.perf_counter()
+            response = get_session().post(
+                url_replica, data=data, headers=headers, timeout=attempt_timeout
+            )
+            latency = time.perf_counter() - start
+            failed = response.status_code in RETRYABLE_STATUS_CODES
+        except (requests.ConnectionError, requests.Timeout) as e:
+            BACKEND_ERRORS.inc(reason=type(e).__name__)
+            if deadline is not None and deadline.expired():
+                client_stats.increment("failures")
+                logger.warning("No answer from {} before the deadline.".format(url_replica))
+                raise DeadlineExceeded("The deadline of the request has passed.") from e
+            if attempt == max_retries:
+                client_stats.increment("failures")
+                raise
+            logger.warning("Request to {} failed, retrying: {}".format(url_replica, e))
+        finally:
+            if latency is None and deadline is not None and deadline.expired():
+                failed = None  # cut by the deadline, which says nothing about the backend
+            if replica is not None:
+                replica_set.release(replica, failed, latency)
+            if epoch is not None:
+                limiter.release(epoch, latency, failed)
+        if latency is not None:
+            if not failed:
+                return response
+            BACKEND_ERRORS.inc(reason="status_{}".format(response.status_code))
+            if attempt == max_retries:
+                client_stats.increment("failures")
+                return response
+            logger.warning("{} answered {}, retrying.".format(url_replica, response.status_code))
+        client_stats.increment("retries")
+        backoff = random.uniform(0, RETRY_BACKOFF * 2**attempt)
+        if deadline is not None and deadline.remaining() is not None:
+            backoff = min(backoff, deadline.remaining())
+        time.sleep(backoff)
+
+
+def preprocess(image: np.ndarray, encoded_image: Optional[bytes] = None) -> Tuple[Dict, float]:
+    """Prepare the signature of an image for the SavedModel served, see `ENCODED_INPUTS`. With it,
+    the bytes the image was decoded from are sent if the SavedModel can read them, see
+    `preprocessing.encode_for_serving`.
+
+    Returns:
+
+    - *Dict*: The signature of the image
+    - *float*: The ratio used to resize the image
+    """
+    with time_stage("preprocess"):
+        if ENCODED_INPUTS:
+            return encode_for_serving(image, encoded_image=encoded_image)
+        return preprocess_for_serving(image)
+
+
+def encode_request(signature: Dict) -> Tuple[bytes, Dict[str, str]]:
+    """Write the body and the headers of a predict request, see `payload.encode_signature`.
+    """
+    with time_stage("encode"):
+        return encode_signature(signature, compress=COMPRESS_REQUESTS)
+
+
+def query_tensorflow_server(
+    signature: Dict, url: Union[str, Sequence[str]], timeout=TIMEOUT
+) -> Dict:
     """Will send a REST query to the tensorflow server.
 
     Arguments:
@@ -22,19 +260,60 @@ def query_tensorflow_server(signature: Dict, url: str) -> Dict:
     saved_model_cli show --dir directory_containing_the_saved_model.pb --all
     ```
 
-    - *url*: Where you can find the tensorflow server
+    The numpy arrays of the signature are written directly in the body of the request, see
+    `payload.encode_signature`. If MOT_HEDGE_PERCENTILE is set, a slow request is sent again, see
+    `hedging.Hedger`. The timeouts are reduced to the deadline of the current thread, see
+    `deadlines.use_deadline`.
+
+    - *url*: Where you can find the tensorflow server, or the urls of several replicas of it,
+        see `replicas.parse_urls`
+    - *timeout*: A float or a (connect, read) tuple, in seconds
+
+    Returns:
+
+    - *Dict*: A dict with the answer signature.
+    """
+    data, headers = encode_request(signature)
+    deadline = current_deadline()
+
+    def post(avoid: Set[str]) -> requests.Response:
+        return post_with_retries(
+            url,
+            data=data,
+            headers=headers,
+            timeout=timeout,
+            path=SERVING_PATH,
+            avoid=avoid,
+            deadline=deadline,
+        )
+
+    hedger = get_hedger()
+    with time_stage("backend"), IN_FLIGHT.track_inprogress(kind="backend"):
+        json_response = post(set()) if hedger is None else hedger.call(post)
+    with time_stage("decode"):
+        response = json_response.json()
+    return parse_serving_response(response)
+
+
+def parse_serving_response(response: Dict) -> Dict:
+    """Extract the outputs of the json answered by tensorflow serving.
+
+    Arguments:
+
+    - *response*: The decoded json answered by tensorflow serving
 
     Returns:
 
     - *Dict*: A dict with the answer signature.
+
+    Raises:
+
+    - *ValueError*: If tensorflow serving returned an error or an unknown response
     """
-    url_serving = os.path.join(url, "v1/models/serving:predict")
-    headers = {"content-type": "application/json"}
-    json_response = requests.post(url_serving, data=json.dumps(signature), headers=headers)
-    response = json_response.json()
     if "outputs" in response:
         return response["outputs"]
     if "error" in response:
+        BACKEND_ERRORS.inc(reason="error_response")
         message = "Tensorflow serving returned an error. It probably means that your SavedModel " \
         " doesn't have the correct signature_def, which must be 'serving_default'. You can inspect " \
         " that by doing `saved_model_cli show --dir /path/to/your/model --all`. If the signature_def" \
@@ -42,6 +321,7 @@ def query_tensorflow_server(signature: Dict, url: str) -> Dict:
         " in the main README, section `Export` Here is the original" \
         " error raised by tensorflow serving:\n " + str(response["error"])
         raise ValueError(message)
+    BACKEND_ERRORS.inc(reason="unknown_response")
     raise ValueError("Unknwon response from tensorflow serving: {}".format(response))
 
 
@@ -49,15 +329,18 @@ def localizer_tensorflow_serving_inference(
     image: np.ndarray,
     url: str,
     return_all_scores: bool = False,
+    encoded_image: Optional[bytes] = None,
 ) -> Dict:
     """Preprocess and query the tensorflow serving for the localizer
 
     Arguments:
 
     - *image*: A numpy array loaded in BGR.
-    - *url*: A string representing the url.
+    - *url*: A string representing the url, or the urls of several replicas.
     - *return_all_scores*: Wheter to return scores for all classes.
         The SavedModel you're querying must return all scores.
+    - *encoded_image*: The bytes the image was decoded from, sent instead of the image with
+        `ENCODED_INPUTS` when the SavedModel can read them
 
     Return:
 
@@ -82,15 +365,115 @@ def localizer_tensorflow_serving_inference(
         }
     ```
     """
-    signature, ratio = preprocess_for_serving(image)
+    signature, ratio = preprocess(image, encoded_image)
     predictions = query_tensorflow_server(signature, url)
+    return format_predictions(predictions, ratio, image.shape, return_all_scores)
+
+
+def localizer_tensorflow_serving_inference_batch(
+    images: List[np.ndarray],
+    url: str,
+    return_all_scores: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> List[Dict]:
+    """Same as `localizer_tensorflow_serving_inference`, but the images which have the same shape
+    once resized are sent by batches of batch_size in a single predict request.
+
+    Fewer and larger requests save on HTTP and JSON overheads, and let tensorflow serving run the
+    graph once per batch. The SavedModel must accept a batch dimension on its inputs. With
+    `ENCODED_INPUTS`, it doesn't, and the images are sent one by one.
+
+    Arguments:
+
+    - *images*: A list of numpy arrays loaded in BGR.
+    - *url*: A string representing the url.
+    - *return_all_scores*: Wheter to return scores for all classes.
+    - *batch_size*: The max number of images in a request.
+
+    Return:
+
+    - *List[Dict]*: The predictions for each image, in the same order as the images and with the
+        same format as `localizer_tensorflow_serving_inference`
+    """
+    if ENCODED_INPUTS:
+        return [
+            localizer_tensorflow_serving_inference(image, url, return_all_scores)
+            for image in images
+        ]
+    shape_to_indices = OrderedDict()
+    for i, image in enumerate(images):
+        # the resized shape only depends on the shape of the image
+        shape_to_indices.setdefault(image.shape, []).append(i)
+
+    predictions = [None] * len(images)
+    for indices in shape_to_indices.values():
+        for start in range(0, len(indices), max(1, batch_size)):
+            batch_indices = indices[start:start + max(1, batch_size)]
+            with time_stage("preprocess"):
+                signature, ratios = preprocess_batch_for_serving(
+                    [images[i] for i in batch_indices]
+                )
+            batch_predictions = split_batch_predictions(
+                query_tensorflow_server(signature, url), len(batch_indices)
+            )
+            for i, ratio, image_predictions in zip(batch_indices, ratios, batch_predictions):
+                predictions[i] = format_predictions(
+                    image_predictions, ratio, images[i].shape, return_all_scores
+                )
+    return predictions
+
+
+def split_batch_predictions(predictions: Dict, batch_size: int) -> List[Dict]:
+    """Split the outputs of a batched predict request into the outputs of each image.
+
+    The detections of the images of a batch are padded to the same number. The padding detections
+    have the label 0, which is the background and never the label of an actual detection.
+
+    Arguments:
+
+    - *predictions*: The outputs of tensorflow serving, with a batch dimension
+    - *batch_size*: The number of images in the batch
+
+    Returns:
+
+    - *List[Dict]*: The outputs for each image, without the padding detections
+    """
+    images_predictions = []
+    for i in range(batch_size):
+        keep = [j for j, label in enumerate(predictions["output/labels:0"][i]) if label != 0]
+        images_predictions.append(
+            {name: [outputs[i][j] for j in keep] for name, outputs in predictions.items()}
+        )
+    return images_predictions
+
+
+def format_predictions(
+    predictions: Dict, ratio: float, image_shape: Tuple[int, int], return_all_scores: bool = False
+) -> Dict:
+    """Scale the boxes predicted by tensorflow serving to [0, 1] and format the scores.
+
+    Arguments:
+
+    - *predictions*: The outputs of tensorflow serving for an image
+    - *ratio*: The ratio used to resize the image before the inference
+    - *image_shape*: The shape of the image before resizing
+    - *return_all_scores*: Wheter to return scores for all classes.
+
+    Returns:
+
+    - *Dict*: The predictions, see `localizer_tensorflow_serving_inference`
+
+    Raises:
+
+    - *ValueError*: If return_all_scores is True but the model only returns the predicted score
+    """
     scores = np.array(predictions['output/scores:0'])
     if len(predictions["output/boxes:0"]) > 0:
         predictions['output/boxes:0'] = np.array(predictions['output/boxes:0'], np.int32) / ratio
-        predictions["output/boxes:0"][:, 0] /= image.shape[0] # scaling coords to [0, 1]
-        predictions["output/boxes:0"][:, 1] /= image.shape[1] # scaling coords to [0, 1]
-        predictions["output/boxes:0"][:, 2] /= image.shape[0] # scaling coords to [0, 1]
-        predictions["output/boxes:0"][:, 3] /= image.shape[1] # scaling coords to [0, 1]
+        predictions["output/boxes:0"][:, 0] /= image_shape[0] # scaling coords to [0, 1]
+        predictions["output/boxes:0"][:, 1] /= image_shape[1] # scaling coords to [0, 1]
+        predictions["output/boxes:0"][:, 2] /= image_shape[0] # scaling coords to [0, 1]
+        predictions["output/boxes:0"][:, 3] /= image_shape[1] # scaling coords to [0, 1]
         predictions['output/boxes:0'] = predictions['output/boxes:0'].tolist()
         if return_all_scores and len(scores.shape) == 1:
             raise ValueError(
@@ -0,0 +1,209 @@
+import os
+import random
+import threading
+import time
+from typing import Collection, Dict, List, Optional, Sequence, Union
+
+from tensorpack import logger
+
+from mot.utils.metrics import registry
+
+ROUTING_POLICIES = ["least_outstanding", "power_of_two"]
+ROUTING_POLICY = os.environ.get("MOT_ROUTING_POLICY", "least_outstanding")
+EJECT_AFTER_FAILURES = 3  # consecutive failures after which a replica stops getting traffic
+EJECT_SECONDS = 30  # time a failing replica is ejected, before it gets traffic again
+
+REPLICA_SECONDS = registry.histogram(
+    "mot_replica_request_duration_seconds",
+    "Time spent by each replica of tensorflow serving on the requests it answered.",
+    labelnames=("replica",),
+)
+REPLICA_OUTSTANDING = registry.gauge(
+    "mot_replica_outstanding_requests",
+    "Number of requests sent to each replica of tensorflow serving and not answered yet.",
+    labelnames=("replica",),
+)
+REPLICA_EJECTIONS = registry.counter(
+    "mot_replica_ejections_total",
+    "Number of times each replica of tensorflow serving was ejected after failing.",
+    labelnames=("replica",),
+)
+
+
+class Replica():
+    '''The state of a replica of tensorflow serving, as seen by the client of this process.
+    '''
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.mean_latency = None  # moving average of the answered requests, in seconds
+
+    def as_dict(self, now: float) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until > now,
+            "mean_latency_seconds": self.mean_latency,
+        }
+
+
+class ReplicaSet():
+    '''Routes the requests between several replicas of tensorflow serving.
+
+    Each request goes to the healthy replica with the fewest requests outstanding, or with the
+    "power_of_two" policy, to the least loaded of two healthy replicas drawn at random. A replica
+    failing eject_after times in a row is ejected for eject_seconds, then gets traffic again and
+    is ejected at its next failure until it answers a request. When all the replicas are ejected,
+    the one coming back first is used anyway.
+    '''
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        policy: str = "least_outstanding",
+        eject_after: int = EJECT_AFTER_FAILURES,
+        eject_seconds: float = EJECT_SECONDS,
+    ):
+        """
+        Arguments:
+
+        - *urls*: The urls of the replicas
+        - *policy*: One of ROUTING_POLICIES
+        - *eject_after*: The number of consecutive failures after which a replica is ejected
+        - *eject_seconds*: The time a replica is ejected
+
+        Raises:
+
+        - *ValueError*: If there is no url, or if the policy isn't handled
+        """
+        if len(urls) == 0:
+            raise ValueError("At least one url of tensorflow serving is needed.")
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(
+                "Unknown routing policy {}, should be in {}.".format(policy, ROUTING_POLICIES)
+            )
+        self.replicas = [Replica(url) for url in urls]
+        self.policy = policy
+        self.eject_after = max(1, eject_after)
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self, avoid: Collection[str] = ()) -> Replica:
+        """Choose the replica of the next request, and count the request as outstanding on it.
+        Call `release` once the request is answered or has failed.
+
+        Arguments:
+
+        - *avoid*: The urls of replicas not to choose, unless they are the only healthy ones
+        """
+        with self._lock:
+            now = time.monotonic()
+            healthy = [replica for replica in self.replicas if replica.ejected_until <= now]
+            healthy = [replica for replica in healthy if replica.url not in avoid] or healthy
+            if not healthy:
+                replica = min(self.replicas, key=lambda replica: replica.ejected_until)
+            elif self.policy == "power_of_two" and len(healthy) > 2:
+                replica = min(
+                    random.sample(healthy, 2), key=lambda replica: replica.outstanding
+                )
+            else:
+                fewest = min(replica.outstanding for replica in healthy)
+                replica = random.choice(
+                    [replica for replica in healthy if replica.outstanding == fewest]
+                )
+            replica.outstanding += 1
+            replica.requests += 1
+        REPLICA_OUTSTANDING.inc(replica=replica.url)
+        return replica
+
+    def release(self, replica: Replica, failed: Optional[bool], duration: float = None):
+        """Record the outcome of a request sent to a replica by `acquire`.
+
+        Arguments:
+
+        - *replica*: The replica returned by `acquire`
+        - *failed*: Whether the replica failed to answer, or answered a retryable error. None if
+            the outcome says nothing about the replica, when the request was cut by its deadline
+            or cancelled for instance: the request is then only no longer outstanding.
+        - *duration*: The time in seconds the replica took to answer, if it answered
+        """
+        with self._lock:
+            replica.outstanding -= 1
+            if failed is None:
+                ejected = False
+            elif failed:
+                replica.failures += 1
+                replica.consecutive_failures += 1
+                ejected = replica.consecutive_failures >= self.eject_after
+                if ejected:
+                    replica.ejected_until = time.monotonic() + self.eject_seconds
+                    replica.ejections += 1
+            else:
+                ejected = False
+                replica.consecutive_failures = 0
+                if duration is not None:
+                    replica.mean_latency = duration if replica.mean_latency is None else \
+                        0.9 * replica.mean_latency + 0.1 * duration
+        REPLICA_OUTSTANDING.dec(replica=replica.url)
+        if duration is not None:
+            REPLICA_SECONDS.observe(duration, replica=replica.url)
+        if ejected:
+            REPLICA_EJECTIONS.inc(replica=replica.url)
+            logger.warning(
+                "{} failed {} times in a row, ejected for {}s.".format(
+                    replica.url, replica.consecutive_failures, self.eject_seconds
+                )
+            )
+
+    def stats(self) -> List[Dict[str, object]]:
+        """Returns the state of each replica.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [replica.as_dict(now) for replica in self.replicas]
+
+
+_replica_sets = {}
+_replica_sets_lock = threading.Lock()
+
+
+def parse_urls(url: Union[str, Sequence[str]]) -> List[str]:
+    """Returns the urls of the replicas from a url, a comma separated list of urls, or a list.
+    """
+    urls = url.split(",") if isinstance(url, str) else url
+    return [url.strip() for url in urls if url.strip()]
+
+
+def get_replica_set(url: Union[str, Sequence[str]], policy: str = None) -> ReplicaSet:
+    """Returns the replica set of some urls, shared by the threads of the process so that they
+    see the same outstanding requests and failures.
+
+    Arguments:
+
+    - *url*: The urls of the replicas, see `parse_urls`
+    - *policy*: The routing policy of the replica set when it is created, ROUTING_POLICY by
+        default
+    """
+    urls = tuple(parse_urls(url))
+    with _replica_sets_lock:
+        if urls not in _replica_sets:
+            _replica_sets[urls] = ReplicaSet(urls, policy or ROUTING_POLICY)
+        return _replica_sets[urls]
+
+
+def get_replicas_stats() -> List[Dict[str, object]]:
+    """Returns the state of all the replicas this process sent requests to, see `ReplicaSet.stats`.
+    """
+    with _replica_sets_lock:
+        replica_sets = list(_replica_sets.values())
+    return [replica for replica_set in replica_sets for replica in replica_set.stats()]
+
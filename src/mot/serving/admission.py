@@ -0,0 +1,181 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+from mot.utils.metrics import registry
+
+ADMITTED_UNITS = registry.gauge(
+    "mot_admission_in_flight",
+    "Number of requests, and of frames they keep in flight, admitted by the app.",
+    labelnames=("unit",),
+)
+QUEUE_DEPTH = registry.gauge(
+    "mot_admission_queue_depth", "Number of requests waiting to be admitted."
+)
+REJECTIONS = registry.counter(
+    "mot_admission_rejections_total",
+    "Number of requests answered with 429, because the queue was full or the wait too long.",
+    labelnames=("reason",),
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted, and should be retried after retry_after seconds.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController():
+    '''Bounds the requests handled at the same time, and the frames they keep in flight.
+
+    The requests over the budgets wait in a bounded queue, in order of arrival. Beyond the depth of
+    the queue, or after waiting queue_timeout seconds, they are rejected, so that a burst of uploads
+    is answered quickly with a 429 instead of slowing down all the requests until they time out.
+    '''
+
+    def __init__(
+        self,
+        max_requests: int = 64,
+        max_frames: int = 64,
+        max_queued: int = 16,
+        queue_timeout: float = 30,
+    ):
+        """
+        Arguments:
+
+        - *max_requests*: The max number of requests admitted at the same time
+        - *max_frames*: The max number of frames in flight for the admitted requests. A request
+            costing more frames is admitted when no other request is.
+        - *max_queued*: The max number of requests waiting to be admitted
+        - *queue_timeout*: The max time in seconds a request waits to be admitted
+        """
+        self.max_requests = max(1, max_requests)
+        self.max_frames = max(1, max_frames)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self._requests = 0
+        self._frames = 0
+        self._queue = deque()  # tickets of the waiting requests, in order of arrival
+        self._mean_duration = 1.0  # moving average of the time the admitted requests take
+        self._condition = threading.Condition()
+        self._counters = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    @contextmanager
+    def admit(self, frames: int = 1):
+        """Hold a part of the budgets for the duration of a with block.
+
+        Arguments:
+
+        - *frames*: The number of frames the request keeps in flight
+
+        Raises:
+
+        - *AdmissionRejected*: If the request can't be admitted
+        """
+        frames = self.acquire(frames)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(frames, time.perf_counter() - start)
+
+    def acquire(self, frames: int = 1) -> int:
+        """Wait until the request fits in the budgets. Prefer `admit`, which calls `release`.
+
+        Arguments:
+
+        - *frames*: The number of frames the request keeps in flight
+
+        Returns:
+
+        - *int*: The number of frames to give back to `release`
+
+        Raises:
+
+        - *AdmissionRejected*: If the request can't be admitted
+        """
+        frames = min(max(1, frames), self.max_frames)
+        with self._condition:
+            if not self._queue and self._fits(frames):
+                self._take(frames)
+                return frames
+            if len(self._queue) >= self.max_queued:
+                self._reject("queue_full")
+            ticket = object()
+            self._queue.append(ticket)
+            QUEUE_DEPTH.inc()
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not (self._queue[0] is ticket and self._fits(frames)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject("timeout")
+                    self._condition.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                QUEUE_DEPTH.dec()
+                self._condition.notify_all()  # the next request in the queue may fit
+            self._take(frames)
+            return frames
+
+    def release(self, frames: int, duration: float = None):
+        """Give back the budgets held by an admitted request.
+
+        Arguments:
+
+        - *frames*: The number of frames returned by `acquire`
+        - *duration*: The time in seconds the request took, to estimate the Retry-After of the
+            rejected requests
+        """
+        with self._condition:
+            self._requests -= 1
+            self._frames -= frames
+            if duration is not None:
+                self._mean_duration = 0.9 * self._mean_duration + 0.1 * duration
+            self._condition.notify_all()
+        ADMITTED_UNITS.dec(unit="requests")
+        ADMITTED_UNITS.dec(frames, unit="frames")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the requests and frames admitted, the depth of the queue, and the counters of
+        admissions and rejections.
+        """
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update(requests=self._requests, frames=self._frames, queued=len(self._queue))
+        return stats
+
+    def retry_after(self) -> int:
+        """Returns an estimate, in seconds, of the time before the queue has room again.
+        """
+        # the queue drains at about max_requests requests per mean duration
+        waiting = len(self._queue) + 1
+        return max(1, math.ceil(self._mean_duration * waiting / self.max_requests))
+
+    def _fits(self, frames: int) -> bool:
+        if self._requests == 0:
+            return True
+        return self._requests < self.max_requests and self._frames + frames <= self.max_frames
+
+    def _take(self, frames: int):
+        self._requests += 1
+        self._frames += frames
+        self._counters["admitted"] += 1
+        ADMITTED_UNITS.inc(unit="requests")
+        ADMITTED_UNITS.inc(frames, unit="frames")
+
+    def _reject(self, reason: str):
+        self._counters["rejected_" + reason] += 1
+        REJECTIONS.inc(reason=reason)
+        raise AdmissionRejected(
+            "The serving is overloaded ({} requests waiting), retry later.".format(
+                len(self._queue)
+            ),
+            self.retry_after(),
+        )
@@ -1,16 +1,181 @@
-from flask import Flask, render_template, request
+import json
+import threading
+import time
+from typing import Callable
 
-from mot.serving.inference import handle_post_request
+from flask import (
+    Flask, Response, g, jsonify, render_template, request, stream_with_context, url_for
+)
+
+from mot.object_detection.concurrency import get_limiter
+from mot.object_detection.hedging import get_hedger
+from mot.object_detection.replicas import get_replicas_stats
+from mot.serving.admission import AdmissionRejected
+from mot.serving.inference import (
+    frames_in_flight, get_admission_controller, get_frame_store_stats, get_job_queue,
+    get_result_cache_stats, get_worker_pool, handle_post_request, parse_form, stream_file,
+    submit_job
+)
+from mot.serving.jobs import JobQueueFull
+from mot.serving.profiling import profile_request
+from mot.utils.metrics import IN_FLIGHT, REQUEST_SECONDS, registry, time_stage
 
 app = Flask(__name__)
+get_worker_pool()  # the workers are started once, and shared by all the requests
+
+
+@app.before_request
+def start_request():
+    g.start = time.perf_counter()
+    IN_FLIGHT.inc(kind="http")
+
+
+@app.teardown_request
+def end_request(exception=None):
+    IN_FLIGHT.dec(kind="http")
+    REQUEST_SECONDS.observe(time.perf_counter() - g.start, endpoint=request.endpoint or "unknown")
+
+
+@app.errorhandler(AdmissionRejected)
+def reject_request(error):
+    return jsonify({"error": str(error)}), 429, {"Retry-After": str(error.retry_after)}
+
+
+def admit_request() -> Callable[[], None]:
+    """Wait for the admission control to admit the request.
+
+    Returns:
+
+    - *Callable[[], None]*: The function releasing the budgets held by the request, which can be
+        called several times
+
+    Raises:
+
+    - *AdmissionRejected*: If the request isn't admitted. It is answered with a 429.
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return lambda: None
+    file = request.files.get("file")
+    frames = controller.acquire(frames_in_flight(file.mimetype if file is not None else None))
+    start = time.perf_counter()
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            controller.release(frames, time.perf_counter() - start)
+
+    return release
+
+
+def profile_requested() -> bool:
+    """Whether the request asks to be profiled, with `?profile=1` or the header `X-Profile: 1`.
+    """
+    return request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1"
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        return handle_post_request()
+        release = admit_request()
+        if request.args.get("stream") == "1" and "file" in request.files and \
+                request.files["file"].mimetype.split("/")[0] in ["video", "application"]:
+            # one json per line, sent as soon as the frames are analyzed
+            events = stream_file(request.files["file"], **parse_form(request.form))
+            lines = (json.dumps(event) + "\n" for event in events)
+            response = Response(stream_with_context(lines), mimetype="application/x-ndjson")
+            response.call_on_close(release)  # the request is handled until the stream is closed
+            return response
+        try:
+            if profile_requested():
+                with profile_request() as session:
+                    result = handle_post_request()
+                result = dict(result, profile=session.report())
+            else:
+                result = handle_post_request()
+        finally:
+            release()
+        with time_stage("serialization"):
+            return jsonify(result)
     return render_template("upload.html")
 
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start the analysis of an uploaded file in the background, and answer with the id of its job.
+    """
+    if "file" not in request.files:
+        return jsonify({"error": "Send the file to analyze as 'file'."}), 400
+    try:
+        # the form only gives the parameters of the analysis, a "profile" field is left out
+        parameters = parse_form(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        job = submit_job(request.files['file'], profile=profile_requested(), **parameters)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.as_dict()), 202, {"Location": url_for("get_job", job_id=job.id)}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job {}.".format(job_id)}), 404
+    return jsonify(job.as_dict())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job {}.".format(job_id)}), 404
+    if job.status == "done":
+        return jsonify(job.result)
+    if job.status == "failed":
+        return jsonify(job.as_dict()), 500
+    return jsonify(job.as_dict()), 202
+
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    controller = get_admission_controller()
+    return jsonify({} if controller is None else controller.stats())
+
+
+@app.route('/stats/replicas', methods=['GET'])
+def replicas_stats():
+    return jsonify(get_replicas_stats())
+
+
+@app.route('/stats/hedging', methods=['GET'])
+def hedging_stats():
+    hedger = get_hedger()
+    return jsonify({} if hedger is None else hedger.stats())
+
+
+@app.route('/stats/concurrency', methods=['GET'])
+def concurrency_stats():
+    limiter = get_limiter()
+    return jsonify({} if limiter is None else limiter.stats())
+
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(get_result_cache_stats())
+
+
+@app.route('/stats/frames', methods=['GET'])
+def frame_store_stats():
+    return jsonify(get_frame_store_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run(threaded=True, port=5000, debug=False, host="0.0.0.0")
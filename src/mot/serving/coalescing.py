@@ -0,0 +1,129 @@
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+from mot.utils.deadlines import Deadline, DeadlineExceeded, current_deadline, use_deadline
+
+
+class RequestCoalescer():
+    '''Groups the items submitted within a small time window, and processes them with one call.
+
+    It is used to send the images posted at the same time by different clients to tensorflow
+    serving in a single batched request, instead of queueing one request per image on the backend.
+
+    A batch is processed as soon as it has max_batch_size items, or when its oldest item has waited
+    max_wait seconds.
+
+    The deadline of the thread submitting an item, see `deadlines.use_deadline`, comes with it: a
+    batch is processed under the earliest deadline of its items, and the items whose deadline has
+    passed are dropped from their batch.
+    '''
+
+    def __init__(
+        self,
+        batch_function: Callable[[List], List],
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        max_concurrent_batches: int = 4,
+    ):
+        """
+        Arguments:
+
+        - *batch_function*: A function taking a list of items and returning the list of their
+            results, in the same order
+        - *max_batch_size*: The max number of items processed in a call
+        - *max_wait*: The max time in seconds an item waits for other items to join its batch
+        - *max_concurrent_batches*: The max number of calls to batch_function running at once
+        """
+        self.batch_function = batch_function
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_concurrent_batches)
+        self._queue = deque()  # of (item, future, arrival time, deadline)
+        self._condition = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, item) -> Future:
+        """Add an item to the next batch.
+
+        Returns:
+
+        - *Future*: The future result of the item
+        """
+        future = Future()
+        with self._condition:
+            self._queue.append((item, future, time.monotonic(), current_deadline()))
+            self._condition.notify_all()
+        return future
+
+    def __call__(self, item):
+        """Process an item with the next batch, and wait for its result.
+
+        Raises:
+
+        - *DeadlineExceeded*: If the deadline of the current thread passes before the result
+        """
+        future = self.submit(item)
+        deadline = current_deadline()
+        try:
+            return future.result(deadline.remaining() if deadline is not None else None)
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()  # removed from its batch if it isn't processed yet
+            raise DeadlineExceeded("The deadline of the request has passed.") from e
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                closes_at = self._queue[0][2] + self.max_wait
+                while len(self._queue) < self.max_batch_size:
+                    remaining = closes_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(len(self._queue), self.max_batch_size))
+                ]
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch):
+        # the items cancelled or whose deadline has passed while they were waiting are dropped
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        for _, future, _, deadline in batch:
+            if deadline is not None and deadline.expired():
+                future.set_exception(DeadlineExceeded("The deadline of the request has passed."))
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        items = [item for item, _, _, _ in batch]
+        futures = [future for _, future, _, _ in batch]
+        expiries = [
+            deadline.expires_at for _, _, _, deadline in batch
+            if deadline is not None and deadline.expires_at is not None
+        ]
+        try:
+            with use_deadline(Deadline(expires_at=min(expiries)) if expiries else None):
+                results = list(self.batch_function(items))
+            if len(results) != len(items):
+                raise ValueError(
+                    "The batch function returned {} results for {} items.".format(
+                        len(results), len(items)
+                    )
+                )
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # no caller waits forever for its item, whatever happened to the batch
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError("The batch of the item was interrupted."))
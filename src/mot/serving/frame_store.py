@@ -0,0 +1,109 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+SQLITE_TIMEOUT = 30  # in seconds, the time a write waits for the other processes to release the file
+
+
+class FrameStore():
+    '''A durable store of the inferences made on each frame of the videos, in a SQLite file.
+
+    The inferences are keyed by the key of their video, which depends on its content and on the
+    parameters changing its frames, and by the index of the frame. A video analyzed again, after a
+    failure or with other thresholds, only needs the inferences of the frames missing from the
+    store. The file can be shared by the processes of the serving.
+    '''
+
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        """
+        Arguments:
+
+        - *path*: The path of the SQLite file, created if needed
+        - *ttl*: If set, the inferences stored more than ttl seconds ago are removed when the store
+            is opened
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0}
+        with self._lock, self._connection:
+            # readers don't block the writer of another process
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS frames ("
+                "video TEXT NOT NULL, frame INTEGER NOT NULL, output BLOB NOT NULL, "
+                "stored_at REAL NOT NULL, PRIMARY KEY (video, frame)) WITHOUT ROWID"
+            )
+        if ttl is not None:
+            self.prune(ttl)
+
+    def get(self, video: str) -> Dict[int, object]:
+        """Returns the inferences stored for a video.
+
+        Arguments:
+
+        - *video*: The key of the video
+
+        Returns:
+
+        - *Dict[int, object]*: The inference of each stored frame, by index of the frame
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT frame, output FROM frames WHERE video = ?", (video,)
+            ).fetchall()
+            self._counters["hits" if rows else "misses"] += 1
+        return {frame: pickle.loads(output) for frame, output in rows}
+
+    def put(self, video: str, frame: int, output: object):
+        """Store the inference of a frame, as soon as it is made.
+
+        Arguments:
+
+        - *video*: The key of the video
+        - *frame*: The index of the frame in the video
+        - *output*: The inference, which must be picklable
+        """
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?)",
+                (video, frame, data, time.time()),
+            )
+            self._counters["writes"] += 1
+
+    def prune(self, ttl: float) -> int:
+        """Remove the inferences stored more than ttl seconds ago.
+
+        Returns:
+
+        - *int*: The number of inferences removed
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM frames WHERE stored_at < ?", (time.time() - ttl,)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the videos found in the store or not, the frames written, and the number of
+        videos and frames stored.
+        """
+        with self._lock:
+            videos, frames = self._connection.execute(
+                "SELECT COUNT(DISTINCT video), COUNT(*) FROM frames"
+            ).fetchone()
+            stats = dict(self._counters)
+        stats.update(videos=videos, frames=frames)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
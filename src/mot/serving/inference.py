@@ -1,8 +1,18 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
 import json
 import multiprocessing
 import os
 import shutil
-from typing import Dict, List, Tuple
+import tempfile
+import threading
+from typing import (
+    IO, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+)
 
 import cv2
 import numpy as np
@@ -13,20 +23,351 @@ from werkzeug import FileStorage
 from werkzeug.utils import secure_filename
 from zipfile import ZipFile
 
-from mot.object_detection.query_server import \
-    localizer_tensorflow_serving_inference
+from mot.object_detection import query_server
+from mot.object_detection.async_query_server import localizer_tensorflow_serving_inferences
+from mot.object_detection.query_server import (
+    localizer_tensorflow_serving_inference, localizer_tensorflow_serving_inference_batch
+)
 from mot.tracker.object_tracking import ObjectTracking
-from mot.tracker.video_utils import read_folder, split_video
+from mot.serving.admission import AdmissionController
+from mot.serving.coalescing import RequestCoalescer
+from mot.serving.frame_store import FrameStore
+from mot.serving.jobs import Job, JobQueue
+from mot.serving.profiling import current_session, profile_request
+from mot.serving.result_cache import ResultCache, cache_key, hash_stream
+from mot.serving.worker_pool import WorkerPool
+from mot.tracker.video_utils import estimate_frame_count, read_folder, split_video, stream_video
+from mot.utils.deadlines import Deadline, DeadlineExceeded, call_with_deadline, use_deadline
+from mot.utils.metrics import FRAMES_PROCESSED, time_stage
 
-SERVING_URL = "http://localhost:8501"  # the url where the tf-serving container exposes the model
-UPLOAD_FOLDER = 'tmp'  # folder used to store images or videos when sending files
+# The url where the tf-serving container exposes the model. With several replicas of tensorflow
+# serving, a comma separated list of their urls, between which the requests are balanced.
+SERVING_URL = os.environ.get("MOT_SERVING_URL", "http://localhost:8501")
+# folder where each request sending a video or a zip gets its own temporary folder. Point it to a
+# tmpfs such as /dev/shm/mot to keep the files in memory.
+UPLOAD_FOLDER = os.environ.get("MOT_UPLOAD_FOLDER", "tmp")
 FPS = 4
 RESOLUTION = (1024, 768)
 CLASS_NAMES = ["bottles", "others", "fragments"]
 SUM_THRESHOLD = 0.6  # the sum of scores for all classes must be greater than this value
 # for the prediction to be kept
 CLASS_TO_THRESHOLD = {"bottles": 0.4, "others": 0.3, "fragments": 0.3}
-CPU_COUNT = min(int(multiprocessing.cpu_count() / 2), 32)
+CPU_COUNT = max(1, min(int(multiprocessing.cpu_count() / 2), 32))
+STREAM_VIDEO_FRAMES = True  # decode video frames in memory instead of splitting them on disk
+# The workers making inferences are shared by all requests. Threads suit the REST calls to
+# tensorflow serving, processes suit CPU bound work like decoding and preprocessing.
+WORKER_POOL_KIND = os.environ.get("MOT_WORKER_POOL_KIND", "thread")
+WORKER_POOL_SIZE = int(os.environ.get("MOT_WORKER_POOL_SIZE", CPU_COUNT))
+FRAMES_IN_FLIGHT = 2 * WORKER_POOL_SIZE  # max number of decoded frames waiting for an inference
+# The frames of videos are sent to tensorflow serving by batches of this size. Over 1, the
+# SavedModel must accept batched inputs.
+BATCH_SIZE = int(os.environ.get("MOT_BATCH_SIZE", 1))
+# When over 0, the frames of videos are sent by an asyncio client keeping this many requests to
+# tensorflow serving in flight, instead of by the worker pool.
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("MOT_ASYNC_MAX_IN_FLIGHT", 0))
+# When over 1, the images posted at the same time are sent to tensorflow serving in a single batched
+# request of at most this size, after waiting at most COALESCE_MAX_WAIT seconds for each other.
+COALESCE_MAX_BATCH_SIZE = int(os.environ.get("MOT_COALESCE_MAX_BATCH_SIZE", 1))
+COALESCE_MAX_WAIT = float(os.environ.get("MOT_COALESCE_MAX_WAIT", 0.01))
+# When over 0, the results of this many uploads are kept in memory, keyed on the hash of their
+# content and on the parameters of the request, and the same uploads are answered from this cache.
+RESULT_CACHE_SIZE = int(os.environ.get("MOT_RESULT_CACHE_SIZE", 0))
+# When set, the results are also cached in this folder, up to RESULT_CACHE_MAX_BYTES.
+RESULT_CACHE_FOLDER = os.environ.get("MOT_RESULT_CACHE_FOLDER")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("MOT_RESULT_CACHE_MAX_BYTES", 1 << 30))
+# Part of the keys of the cached results. Change it when serving another model.
+MODEL_VERSION = os.environ.get("MOT_MODEL_VERSION", "1")
+# When set, the inference of each frame of a video is stored in this SQLite file as soon as it is
+# made, so that a video analyzed again only sends the frames missing from the store. The inferences
+# older than FRAME_STORE_TTL seconds are removed when the serving starts.
+FRAME_STORE_PATH = os.environ.get("MOT_FRAME_STORE")
+FRAME_STORE_TTL = float(os.environ.get("MOT_FRAME_STORE_TTL", 7 * 24 * 3600))
+# Files posted to /jobs are analyzed in the background by this many workers, and at most
+# JOB_MAX_PENDING jobs can be queued or running. The results are kept JOB_TTL seconds.
+JOB_WORKERS = int(os.environ.get("MOT_JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.environ.get("MOT_JOB_MAX_PENDING", 32))
+JOB_TTL = float(os.environ.get("MOT_JOB_TTL", 3600))
+# When over 0, the max time in seconds a request on a file is worked on. Clients can ask for less
+# with the deadline parameter of their request.
+DEADLINE = float(os.environ.get("MOT_DEADLINE", 0))
+# Whether a video whose deadline passed is tracked on the frames analyzed so far. The result is
+# then flagged as partial.
+PARTIAL_RESULTS = os.environ.get("MOT_PARTIAL_RESULTS", "1") == "1"
+# The app admits at most ADMISSION_MAX_REQUESTS requests at the same time, keeping at most
+# ADMISSION_MAX_FRAMES frames in flight. ADMISSION_MAX_QUEUED requests over these budgets wait at
+# most ADMISSION_QUEUE_TIMEOUT seconds, the others are answered with a 429. 0 requests disables it.
+ADMISSION_MAX_REQUESTS = int(os.environ.get("MOT_ADMISSION_MAX_REQUESTS", 32))
+ADMISSION_MAX_FRAMES = int(os.environ.get("MOT_ADMISSION_MAX_FRAMES", 4 * FRAMES_IN_FLIGHT))
+ADMISSION_MAX_QUEUED = int(os.environ.get("MOT_ADMISSION_MAX_QUEUED", 16))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("MOT_ADMISSION_QUEUE_TIMEOUT", 30))
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+_coalescer = None
+_coalescer_lock = threading.Lock()
+_result_cache = None
+_result_cache_lock = threading.Lock()
+_frame_store = None
+_frame_store_lock = threading.Lock()
+_job_queue = None
+_job_queue_lock = threading.Lock()
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """Returns the pool of workers shared by all requests, and creates it on the first call.
+    """
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool(WORKER_POOL_SIZE, WORKER_POOL_KIND)
+    return _worker_pool
+
+
+def get_coalescer() -> RequestCoalescer:
+    """Returns the coalescer grouping the images posted at the same time, and creates it on the
+    first call.
+    """
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = RequestCoalescer(
+                predict_images, max_batch_size=COALESCE_MAX_BATCH_SIZE, max_wait=COALESCE_MAX_WAIT
+            )
+    return _coalescer
+
+
+def get_job_queue() -> JobQueue:
+    """Returns the queue of the jobs analyzing files in the background, and creates it on the first
+    call.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl=JOB_TTL)
+    return _job_queue
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Returns the admission control of the requests of the app, and creates it on the first call.
+
+    Returns:
+
+    - *Optional[AdmissionController]*: The admission control, or None if ADMISSION_MAX_REQUESTS
+        is 0
+    """
+    global _admission_controller
+    if ADMISSION_MAX_REQUESTS == 0:
+        return None
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController(
+                ADMISSION_MAX_REQUESTS,
+                max_frames=ADMISSION_MAX_FRAMES,
+                max_queued=ADMISSION_MAX_QUEUED,
+                queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+            )
+    return _admission_controller
+
+
+def frames_in_flight(mimetype: Optional[str]) -> int:
+    """Returns the number of frames a request keeps in flight, from the mimetype of its file.
+
+    Arguments:
+
+    - *mimetype*: The mimetype of the uploaded file, or None for a request sending json
+
+    Returns:
+
+    - *int*: 1 for an image, and the frames sent at the same time to tensorflow serving for a video
+        or a zipped folder
+    """
+    if mimetype is None or mimetype.split("/")[0] not in ["video", "application"]:
+        return 1
+    return ASYNC_MAX_IN_FLIGHT if ASYNC_MAX_IN_FLIGHT > 0 else FRAMES_IN_FLIGHT
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Returns the cache of the results of the uploads, and creates it on the first call.
+
+    Returns:
+
+    - *Optional[ResultCache]*: The cache, or None if neither RESULT_CACHE_SIZE nor
+        RESULT_CACHE_FOLDER is set
+    """
+    global _result_cache
+    if RESULT_CACHE_SIZE == 0 and RESULT_CACHE_FOLDER is None:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                RESULT_CACHE_SIZE, RESULT_CACHE_FOLDER, max_disk_bytes=RESULT_CACHE_MAX_BYTES
+            )
+    return _result_cache
+
+
+def get_result_cache_stats() -> Dict[str, int]:
+    """Returns the counters of the cache of results, see `ResultCache.stats`, or an empty dict if
+    the cache is disabled.
+    """
+    result_cache = get_result_cache()
+    return {} if result_cache is None else result_cache.stats()
+
+
+def get_frame_store() -> Optional[FrameStore]:
+    """Returns the store of the inferences of the frames of videos, and opens it on the first call.
+
+    Returns:
+
+    - *Optional[FrameStore]*: The store, or None if FRAME_STORE_PATH isn't set
+    """
+    global _frame_store
+    if FRAME_STORE_PATH is None:
+        return None
+    with _frame_store_lock:
+        if _frame_store is None:
+            _frame_store = FrameStore(FRAME_STORE_PATH, ttl=FRAME_STORE_TTL)
+    return _frame_store
+
+
+def get_frame_store_stats() -> Dict[str, int]:
+    """Returns the counters of the store of frames, see `FrameStore.stats`, or an empty dict if the
+    store is disabled.
+    """
+    frame_store = get_frame_store()
+    return {} if frame_store is None else frame_store.stats()
+
+
+def frame_store_key(
+    file: FileStorage,
+    fps: int,
+    resolution: Tuple[int, int],
+    stream_frames: bool,
+    content_hash: Optional[str] = None,
+) -> Optional[str]:
+    """Returns the key of the frames of an uploaded video in the store of frames.
+
+    The key depends on the content of the video, on the parameters changing its frames and on the
+    model, but not on the thresholds, which are applied after the inference. The content is hashed
+    unless content_hash is given.
+
+    Returns:
+
+    - *Optional[str]*: The key, or None if the store is disabled
+    """
+    if get_frame_store() is None:
+        return None
+    return cache_key(
+        content_hash or hash_stream(file.stream),
+        model_version=MODEL_VERSION,
+        fps=fps,
+        resolution=resolution,
+        stream_frames=stream_frames,
+    )
+
+
+FORM_BOOLEANS = {"1": True, "true": True, "0": False, "false": False}
+
+
+def parse_form(form: Mapping[str, str]) -> Dict[str, object]:
+    """Returns the parameters of `handle_file` sent as the fields of a form, which are strings.
+
+    A number of frames per second which is a whole number is an int, so that `"2"` and `2` give
+    the same keys in the result cache and the store of frames.
+
+    Arguments:
+
+    - *form*: The fields of the form, `request.form` for instance
+
+    Returns:
+
+    - *Dict[str, object]*: fps and deadline as numbers, and stream_frames as a bool, from "0",
+        "1", "true" or "false". The empty and the other fields are left out.
+
+    Raises:
+
+    - *ValueError*: If a field can't be parsed
+    """
+    parameters = {}
+    for name, value in form.items():
+        if value == "":
+            continue
+        if name == "fps":
+            fps = float(value)
+            parameters[name] = int(fps) if fps.is_integer() else fps
+        elif name == "deadline":
+            parameters[name] = float(value)
+        elif name == "stream_frames":
+            if str(value).lower() not in FORM_BOOLEANS:
+                raise ValueError("{} isn't a boolean, send 0 or 1.".format(name))
+            parameters[name] = FORM_BOOLEANS[str(value).lower()]
+        else:
+            logger.warning("Unused form field: {}".format(name))
+    return parameters
+
+
+def request_deadline(seconds: Union[None, str, float] = None) -> Deadline:
+    """Returns the deadline of a request, from the deadline asked by the client and DEADLINE.
+
+    Arguments:
+
+    - *seconds*: The time in seconds asked by the client, or None. It can't exceed DEADLINE.
+
+    Returns:
+
+    - *Deadline*: The deadline, without time limit if neither the client nor DEADLINE set one
+    """
+    limits = [float(seconds)] if seconds not in [None, ""] else []
+    if DEADLINE > 0:
+        limits.append(DEADLINE)
+    return Deadline(min(limits) if limits else None)
+
+
+def cached_result(
+    content: Union[bytes, IO[bytes]],
+    compute: Callable[[], object],
+    content_hash: Optional[str] = None,
+    **parameters
+):
+    """Returns the result cached for an upload, or computes and caches it.
+
+    The key of the result depends on the content, on the given parameters, and on the model and the
+    thresholds of the serving. Errors and partial results aren't cached.
+
+    Arguments:
+
+    - *content*: The uploaded content, as bytes or as a seekable stream. It is only hashed if the
+        cache is enabled.
+    - *compute*: The function computing the result if it isn't cached
+    - *content_hash*: The sha256 of the content, if already computed
+    - *parameters*: The parameters of the request changing the result
+
+    Returns:
+
+    - The result
+    """
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return compute()
+    if content_hash is None and isinstance(content, bytes):
+        content_hash = hashlib.sha256(content).hexdigest()
+    elif content_hash is None:
+        content_hash = hash_stream(content)
+    key = cache_key(
+        content_hash,
+        model_version=MODEL_VERSION,
+        class_names=CLASS_NAMES,
+        class_to_threshold=CLASS_TO_THRESHOLD,
+        sum_threshold=SUM_THRESHOLD,
+        **parameters,
+    )
+    result = result_cache.get(key)
+    if result is None:
+        result = compute()
+        if not (isinstance(result, dict) and ("error" in result or result.get("partial"))):
+            result_cache.put(key, result)
+    return result
 
 
 def handle_post_request(upload_folder: str = UPLOAD_FOLDER) -> Dict[str, np.array]:
@@ -46,7 +387,8 @@ def handle_post_request(upload_folder: str = UPLOAD_FOLDER) -> Dict[str, np.arra
     ```
     Arguments:
 
-    - *upload_folder*: Where the files are temporarly stored
+    - *upload_folder*: Where the videos and zipped folders are temporarly stored, each request
+        in its own folder. The images are decoded in memory.
 
     Returns:
 
@@ -57,11 +399,17 @@ def handle_post_request(upload_folder: str = UPLOAD_FOLDER) -> Dict[str, np.arra
     - *NotImplementedError*: If the format of data isn't handled yet
     """
     if "file" in request.files:
-        return handle_file(request.files['file'], upload_folder, **request.form)
+        return handle_file(request.files['file'], upload_folder, **parse_form(request.form))
     data = json.loads(request.data.decode("utf-8"))
     if "image" in data:
         image = np.array(data["image"])
-        return {"detected_trash": predict_and_format_image(image)}
+        detected_trash = cached_result(
+            image.tobytes(),
+            lambda: predict_and_format_image(image),
+            shape=image.shape,
+            dtype=image.dtype,
+        )
+        return {"detected_trash": detected_trash}
     if "video" in data:
         raise NotImplementedError("video")
     raise ValueError(
@@ -76,6 +424,9 @@ def handle_file(
     upload_folder: str = UPLOAD_FOLDER,
     fps: int = FPS,
     resolution: Tuple[int, int] = RESOLUTION,
+    stream_frames: bool = STREAM_VIDEO_FRAMES,
+    progress: Callable[[int, Optional[int]], None] = None,
+    deadline: Union[None, str, float] = None,
     **kwargs
 ) -> Dict[str, np.array]:
     """Make the prediction if the data is coming from an uploaded file.
@@ -83,7 +434,15 @@ def handle_file(
     Arguments:
 
     - *file*: The file, can be either an image or a video, or a zipped folder
-    - *upload_folder*: Where the files are temporarly stored
+    - *upload_folder*: Where the videos and zipped folders are temporarly stored, each request
+        in its own folder. The images are decoded in memory.
+    - *fps*: The number of frames per second extracted from a video
+    - *resolution*: The resolution of the frames extracted from a video
+    - *stream_frames*: Whether to decode the frames of a video in memory and send them directly to
+        the inference, or to split the video into JPEG files first
+    - *progress*: A function called with the number of frames analyzed and the number of frames to
+        analyze, or None if it isn't known, each time a frame is analyzed
+    - *deadline*: The max time in seconds to work on the request, see `request_deadline`
 
     Returns:
 
@@ -134,84 +493,542 @@ def handle_file(
     }
     ```
 
+    If the deadline passes, a video is tracked on the frames analyzed so far, and the json also has
+    `"partial": true`.
+
     Raises:
 
     - *NotImplementedError*: If the format of data isn't handled yet
     """
     if kwargs:
         logger.warning("Unused kwargs: {}".format(kwargs))
+    deadline = request_deadline(deadline)
     filename = secure_filename(file.filename)
-    full_filepath = os.path.join(upload_folder, filename)
-    if not os.path.isdir(upload_folder):
-        os.mkdir(upload_folder)
-    if os.path.isfile(full_filepath):
-        os.remove(full_filepath)
-    file.save(full_filepath)
+    os.makedirs(upload_folder, exist_ok=True)
     file_type = file.mimetype.split("/")[0]
     # mimetype is for example 'image/png' and we only want the image
 
     if file_type == "image":
-        image = cv2.imread(full_filepath)  # cv2 opens in BGR
-        os.remove(full_filepath)  # remove it as we don't need it anymore
+        # decoded from memory, the image is never written on disk
+        data = file.read()
+        with time_stage("image_decode"):
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)  # in BGR
+        if image is None:
+            return {"error": "Could not decode the image {}.".format(filename)}
         try:
-            detected_trash = predict_and_format_image(image)
-        except ValueError as e:
+            with use_deadline(deadline):
+                detected_trash = cached_result(
+                    data, lambda: predict_and_format_image(image, encoded_image=data)
+                )
+        except (ValueError, DeadlineExceeded) as e:
             return {"error": str(e)}
+        if progress is not None:
+            progress(1, 1)
         return {"image": filename, "detected_trash": detected_trash}
 
     elif file_type in ["video", "application"]:
-        folder = None
-
-        if file.mimetype == "application/zip":
-            # zip case
-            ZipFile(full_filepath).extractall(upload_folder)
-            dirname = None
-            with ZipFile(full_filepath, 'r') as zipObj:
-                listOfFileNames = zipObj.namelist()
-                for fileName in listOfFileNames:
-                    dirname = os.path.dirname(fileName)
-                    zipObj.extract(fileName, upload_folder)
-
-            folder = os.path.join(upload_folder, dirname)
-        else:
-            # video case: splitting video and saving frames
-            folder = os.path.join(upload_folder, "{}_split".format(filename))
-            if os.path.isdir(folder):
-                shutil.rmtree(folder)
-            os.mkdir(folder)
-            logger.info("Splitting video {} to {}.".format(full_filepath, folder))
-            split_video(full_filepath, folder, fps=fps, resolution=resolution)
-        print("folder:", folder, "uplaod_folder:", upload_folder, "file.filename:", file.filename)
-        image_paths = read_folder(folder)
-        if len(image_paths) == 0:
-            raise ValueError("No output image")
+        # hashed once for the result cache and the store of frames
+        content_hash = None
+        if get_result_cache() is not None and get_frame_store() is not None:
+            content_hash = hash_stream(file.stream)
 
-        # making inference on frames
-        logger.info("{} images to analyze on {} CPUs.".format(len(image_paths), CPU_COUNT))
-        try:
-            with multiprocessing.Pool(CPU_COUNT) as p:
-                inference_outputs = list(
-                    tqdm(
-                        p.imap(process_image, image_paths),
-                        total=len(image_paths),
-                    )
+        def compute():
+            # each request gets its own folder, so that uploads with the same filename don't collide
+            request_folder = tempfile.mkdtemp(dir=upload_folder)
+            try:
+                return handle_video_file(
+                    file, filename, request_folder, fps, resolution, stream_frames, progress,
+                    deadline, content_hash
                 )
-        except ValueError as e:
-            return {"error": str(e)}
-        logger.info("Finish analyzing video {}.".format(full_filepath))
+            finally:
+                shutil.rmtree(request_folder, ignore_errors=True)
 
-        # tracking objects
-        logger.info("Starting tracking.")
-        object_tracker = ObjectTracking(filename, image_paths, inference_outputs, fps=fps)
-        tracks = object_tracker.compute_tracks()
-        logger.info("Tracking finished.")
-        return object_tracker.json_result(tracks)
+        result = cached_result(
+            file.stream,
+            compute,
+            content_hash=content_hash,
+            mimetype=file.mimetype,
+            fps=fps,
+            resolution=resolution,
+            stream_frames=stream_frames,
+        )
+        if "video_id" in result:
+            # the same video may have been uploaded under another name
+            result = dict(result, video_id=filename)
+        return result
     else:
         raise NotImplementedError(file_type)
 
 
+def submit_job(file: FileStorage, upload_folder: str = UPLOAD_FOLDER, **kwargs) -> Job:
+    """Save an uploaded file, and analyze it in the background with `handle_file`.
+
+    The file is saved in a folder of its own, since the upload stream is closed when the request
+    ends.
+
+    Arguments:
+
+    - *file*: The file, can be either an image or a video, or a zipped folder
+    - *upload_folder*: Where the files are temporarly stored
+    - *kwargs*: The parameters of `handle_file`, such as fps and resolution
+
+    Returns:
+
+    - *Job*: The job analyzing the file. Its result is the output of `handle_file`.
+
+    Raises:
+
+    - *JobQueueFull*: If too many jobs are already queued or running
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    job_folder = tempfile.mkdtemp(dir=upload_folder)
+    path = os.path.join(job_folder, secure_filename(file.filename) or "upload")
+    with time_stage("upload_save"):
+        file.save(path)
+    try:
+        return get_job_queue().submit(
+            run_job, path, file.filename, file.mimetype, upload_folder, **kwargs
+        )
+    except Exception:
+        shutil.rmtree(job_folder, ignore_errors=True)
+        raise
+
+
+def run_job(
+    path: str,
+    filename: str,
+    mimetype: str,
+    upload_folder: str = UPLOAD_FOLDER,
+    progress: Callable[[int, Optional[int]], None] = None,
+    profile: bool = False,
+    **kwargs
+) -> Dict[str, np.array]:
+    """The function of the jobs created by `submit_job`. It removes the saved file once analyzed.
+
+    Arguments:
+
+    - *path*: Where the uploaded file was saved
+    - *filename*: The name of the uploaded file
+    - *mimetype*: The mimetype of the uploaded file
+    - *upload_folder*: Where the files are temporarly stored
+    - *progress*: The progress callback of the job, see `handle_file`
+    - *profile*: Whether to profile the job. The report of `ProfileSession.report` is then added
+        to the output under the "profile" key.
+    - *kwargs*: The parameters of `handle_file`
+
+    Returns:
+
+    - *Dict[str, np.array]*: The output of `handle_file`
+    """
+    try:
+        with open(path, "rb") as stream:
+            file = FileStorage(stream, filename, content_type=mimetype)
+            if not profile:
+                return handle_file(file, upload_folder, progress=progress, **kwargs)
+            with profile_request() as session:
+                result = handle_file(file, upload_folder, progress=progress, **kwargs)
+            return dict(result, profile=session.report())
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def handle_video_file(
+    file: FileStorage,
+    filename: str,
+    request_folder: str,
+    fps: int = FPS,
+    resolution: Tuple[int, int] = RESOLUTION,
+    stream_frames: bool = STREAM_VIDEO_FRAMES,
+    progress: Callable[[int, Optional[int]], None] = None,
+    deadline: Optional[Deadline] = None,
+    content_hash: Optional[str] = None,
+) -> Dict[str, np.array]:
+    """Make the prediction on an uploaded video or zipped folder of images, see `handle_file`.
+
+    Arguments:
+
+    - *file*: The video or the zipped folder
+    - *filename*: The secured name of the file
+    - *request_folder*: The temporary folder of the request, where the file and its frames are
+        stored
+    - *fps*: The number of frames per second extracted from a video
+    - *resolution*: The resolution of the frames extracted from a video
+    - *stream_frames*: Whether to decode the frames of a video in memory
+    - *progress*: A function called each time a frame is analyzed, see `handle_file`
+    - *deadline*: The deadline of the request. When it passes, the frames waiting for a worker are
+        cancelled.
+    - *content_hash*: The sha256 of the file, if already computed
+
+    Returns:
+
+    - *Dict[str, np.array]*: The tracks, see `handle_file`
+    """
+    video = frame_store_key(file, fps, resolution, stream_frames, content_hash)
+    inputs, total, image_paths = prepare_video_inputs(
+        file, filename, request_folder, fps, resolution, stream_frames
+    )
+
+    # making inference on frames
+    logger.info("Analyzing {}.".format(filename))
+    inference_outputs = []
+    outputs = infer_stored_frames(
+        inputs, from_paths=image_paths is not None, deadline=deadline, video=video
+    )
+    try:
+        for output in tqdm(outputs, total=total):
+            inference_outputs.append(output)
+            FRAMES_PROCESSED.inc()
+            if progress is not None:
+                progress(len(inference_outputs), total)
+    except ValueError as e:
+        return {"error": str(e)}
+    except DeadlineExceeded as e:
+        logger.warning("Deadline of {} passed after {} frames.".format(
+            filename, len(inference_outputs)))
+        if not PARTIAL_RESULTS or len(inference_outputs) == 0:
+            return {"error": str(e)}
+        return track_partial_frames(filename, image_paths, inference_outputs, fps)
+    logger.info("Finish analyzing video {}.".format(filename))
+    return track_frames(filename, image_paths, inference_outputs, fps)
+
+
+def stream_file(
+    file: FileStorage,
+    upload_folder: str = UPLOAD_FOLDER,
+    fps: int = FPS,
+    resolution: Tuple[int, int] = RESOLUTION,
+    stream_frames: bool = STREAM_VIDEO_FRAMES,
+    deadline: Union[None, str, float] = None,
+    **kwargs
+) -> Iterator[Dict[str, object]]:
+    """Same as `handle_file` for a video or a zipped folder, but the detections of each frame are
+    yielded as soon as they are predicted, and then the tracks.
+
+    The events are dicts with a "type" key:
+
+    ```python
+    {"type": "frame", "frame": 0, "detected_trash": [...]}  # see `format_detections`
+    {"type": "track", "label": "bottles", "id": 0, "frame_to_box": {...}}  # for each track
+    {"type": "result", "video_length": 132, "fps": 2, "video_id": "GOPRO1234.mp4"}  # at the end
+    {"type": "error", "error": "No output image"}  # instead of the result if the analysis failed
+    ```
+
+    If the deadline passes, the frames analyzed so far are tracked and the result has
+    `"partial": true`. The temporary folder of the request is removed when the iteration stops,
+    even early, for instance when the client disconnects. The work left is then cancelled.
+
+    Arguments:
+
+    - See `handle_file`
+
+    Returns:
+
+    - *Iterator[Dict[str, object]]*: The events
+    """
+    if kwargs:
+        logger.warning("Unused kwargs: {}".format(kwargs))
+    deadline = request_deadline(deadline)
+    filename = secure_filename(file.filename)
+    os.makedirs(upload_folder, exist_ok=True)
+    request_folder = tempfile.mkdtemp(dir=upload_folder)
+    try:
+        video = frame_store_key(file, fps, resolution, stream_frames)
+        inputs, _, image_paths = prepare_video_inputs(
+            file, filename, request_folder, fps, resolution, stream_frames
+        )
+        inference_outputs = []
+        try:
+            for output in infer_stored_frames(
+                inputs, from_paths=image_paths is not None, deadline=deadline, video=video
+            ):
+                yield {
+                    "type": "frame",
+                    "frame": len(inference_outputs),
+                    "detected_trash": format_detections(output),
+                }
+                inference_outputs.append(output)
+                FRAMES_PROCESSED.inc()
+            result = track_frames(filename, image_paths, inference_outputs, fps)
+        except DeadlineExceeded:
+            if not PARTIAL_RESULTS or len(inference_outputs) == 0:
+                raise
+            result = track_partial_frames(filename, image_paths, inference_outputs, fps)
+        for track in result.pop("detected_trash"):
+            yield dict(track, type="track")
+        yield dict(result, type="result")
+    except (ValueError, DeadlineExceeded) as e:
+        yield {"type": "error", "error": str(e)}
+    finally:
+        deadline.cancel()  # the tasks of the request still running stop at their next attempt
+        shutil.rmtree(request_folder, ignore_errors=True)
+
+
+def prepare_video_inputs(
+    file: FileStorage,
+    filename: str,
+    request_folder: str,
+    fps: int = FPS,
+    resolution: Tuple[int, int] = RESOLUTION,
+    stream_frames: bool = STREAM_VIDEO_FRAMES,
+) -> Tuple[Iterable, Optional[int], Optional[List[str]]]:
+    """Save an uploaded video or zipped folder in the folder of the request, and prepare its frames.
+
+    Arguments:
+
+    - See `handle_video_file`
+
+    Returns:
+
+    - *Iterable*: The frames of the video in BGR, or the paths of the images of the folder
+    - *Optional[int]*: The number of frames, or its estimation for a streamed video
+    - *Optional[List[str]]*: The paths of the images, or None if the frames are streamed
+
+    Raises:
+
+    - *ValueError*: If the folder has no image
+    """
+    full_filepath = os.path.join(request_folder, filename)
+    with time_stage("upload_save"):
+        file.save(full_filepath)
+    folder = None
+
+    if file.mimetype == "application/zip":
+        # zip case
+        with time_stage("unzip"), ZipFile(full_filepath, 'r') as zipObj:
+            listOfFileNames = zipObj.namelist()
+            zipObj.extractall(request_folder)
+        dirname = os.path.dirname(listOfFileNames[-1]) if listOfFileNames else ""
+        folder = os.path.join(request_folder, dirname)
+    elif not stream_frames:
+        # video case: splitting video and saving frames
+        folder = os.path.join(request_folder, "{}_split".format(filename))
+        os.mkdir(folder)
+        logger.info("Splitting video {} to {}.".format(full_filepath, folder))
+        with time_stage("split_video"):
+            split_video(full_filepath, folder, fps=fps, resolution=resolution)
+
+    if folder is None:
+        # video case: streaming frames from ffmpeg
+        logger.info("Streaming frames of video {}.".format(full_filepath))
+        inputs = stream_video(full_filepath, fps=fps, resolution=resolution)
+        return inputs, estimate_frame_count(full_filepath, fps=float(fps)), None
+    image_paths = read_folder(folder)
+    if len(image_paths) == 0:
+        raise ValueError("No output image")
+    return image_paths, len(image_paths), image_paths
+
+
+def track_frames(
+    filename: str,
+    image_paths: Optional[List[str]],
+    inference_outputs: List[Dict[str, object]],
+    fps: int = FPS,
+) -> Dict[str, object]:
+    """Track the objects detected on the frames of a video.
+
+    Arguments:
+
+    - *filename*: The name of the video
+    - *image_paths*: The paths of the frames, or None if they were streamed
+    - *inference_outputs*: The predictions for each frame, see `process_frame`
+    - *fps*: The number of frames per second extracted from the video
+
+    Returns:
+
+    - *Dict[str, object]*: The tracks, see `handle_file`
+
+    Raises:
+
+    - *ValueError*: If there are no frames
+    """
+    if len(inference_outputs) == 0:
+        raise ValueError("No output image")
+    logger.info("Starting tracking.")
+    if image_paths is None:
+        # the frames were never written on disk, the tracker only needs to know how many there are
+        image_paths = list(range(len(inference_outputs)))
+    object_tracker = ObjectTracking(filename, image_paths, inference_outputs, fps=fps)
+    with time_stage("tracking"):
+        tracks = object_tracker.compute_tracks()
+    logger.info("Tracking finished.")
+    return object_tracker.json_result(tracks)
+
+
+def track_partial_frames(
+    filename: str,
+    image_paths: Optional[List[str]],
+    inference_outputs: List[Dict[str, object]],
+    fps: int = FPS,
+) -> Dict[str, object]:
+    """Same as `track_frames`, for the first frames of a video whose deadline passed. The result
+    has `"partial": True`.
+    """
+    if image_paths is not None:
+        image_paths = image_paths[:len(inference_outputs)]
+    return dict(track_frames(filename, image_paths, inference_outputs, fps), partial=True)
+
+
+def infer_frames(
+    inputs: Iterable,
+    from_paths: bool = False,
+    deadline: Optional[Deadline] = None,
+) -> Iterator[Dict[str, object]]:
+    """Make inferences on the frames of a video, with the worker pool or, if ASYNC_MAX_IN_FLIGHT is
+    set, with an asyncio client.
+
+    Arguments:
+
+    - *inputs*: An iterable of frames in BGR, or of paths to images if from_paths is True
+    - *from_paths*: Whether the inputs are paths to images
+    - *deadline*: The deadline of the request. The requests to tensorflow serving are bounded by
+        it, and the frames waiting for a worker are cancelled when it passes.
+
+    Returns:
+
+    - *Iterator[Dict[str, object]]*: The predictions for each frame, in the same order as the
+        inputs. See `process_frame`.
+
+    Raises:
+
+    - *DeadlineExceeded*: When the deadline passes
+    """
+    expires_at = deadline.expires_at if deadline is not None else None
+    if ASYNC_MAX_IN_FLIGHT > 0:
+        logger.info("Keeping {} requests in flight.".format(ASYNC_MAX_IN_FLIGHT))
+        frames = (read_image(path) for path in inputs) if from_paths else inputs
+        return _until_deadline(
+            localizer_tensorflow_serving_inferences(
+                frames,
+                SERVING_URL,
+                return_all_scores=True,
+                max_in_flight=ASYNC_MAX_IN_FLIGHT,
+                deadline=deadline,
+            )
+        )
+    worker_pool = get_worker_pool()
+    logger.info("Using {} {} workers.".format(worker_pool.size, worker_pool.kind))
+    if BATCH_SIZE > 1:
+        batches_outputs = worker_pool.imap(
+            _task(functools.partial(process_batch, from_paths=from_paths), worker_pool, deadline),
+            iter_batches(inputs, BATCH_SIZE),
+            max(1, FRAMES_IN_FLIGHT // BATCH_SIZE),
+            deadline=expires_at,
+        )
+        return _until_deadline(
+            outputs for batch_outputs in batches_outputs for outputs in batch_outputs
+        )
+    return _until_deadline(
+        worker_pool.imap(
+            _task(process_image if from_paths else process_frame, worker_pool, deadline),
+            inputs,
+            FRAMES_IN_FLIGHT,
+            deadline=expires_at,
+        )
+    )
+
+
+def infer_stored_frames(
+    inputs: Iterable,
+    from_paths: bool = False,
+    deadline: Optional[Deadline] = None,
+    video: Optional[str] = None,
+) -> Iterator[Dict[str, object]]:
+    """Same as `infer_frames`, but the inferences of the frames found in the store of frames are
+    reused, and the other ones are stored as soon as they are made. A video whose analysis failed
+    or was cut by its deadline resumes where it stopped.
+
+    Arguments:
+
+    - See `infer_frames`
+    - *video*: The key of the video in the store of frames, see `frame_store_key`. If None, or if
+        the store is disabled, all the frames are inferred.
+
+    Returns:
+
+    - *Iterator[Dict[str, object]]*: The predictions for each frame, in the same order as the
+        inputs
+    """
+    frame_store = get_frame_store()
+    if frame_store is None or video is None:
+        return infer_frames(inputs, from_paths, deadline)
+    return _merge_stored_frames(frame_store, video, inputs, from_paths, deadline)
+
+
+def _merge_stored_frames(
+    frame_store: FrameStore,
+    video: str,
+    inputs: Iterable,
+    from_paths: bool,
+    deadline: Optional[Deadline],
+) -> Iterator[Dict[str, object]]:
+    stored = frame_store.get(video)
+    if stored:
+        logger.info("Reusing the inferences of {} stored frames.".format(len(stored)))
+    missing = collections.deque()  # indexes of the frames sent to tensorflow serving, in order
+
+    def missing_inputs():
+        for index, frame in enumerate(inputs):
+            if index not in stored:
+                missing.append(index)
+                yield frame
+
+    index = 0
+    for output in infer_frames(missing_inputs(), from_paths, deadline):
+        frame = missing.popleft()
+        while index < frame:
+            yield stored[index]
+            index += 1
+        frame_store.put(video, frame, output)
+        yield output
+        index += 1
+    while index in stored:
+        yield stored[index]
+        index += 1
+
+
+def _task(function: Callable, worker_pool: WorkerPool, deadline: Optional[Deadline]) -> Callable:
+    # the tasks run with the deadline of the request, and are profiled with it
+    if deadline is not None:
+        function = functools.partial(call_with_deadline, deadline, function)
+    return _profiled(function, worker_pool)
+
+
+def _until_deadline(outputs: Iterator) -> Iterator:
+    # the iterators of the pools raise their own timeout errors when the deadline passes
+    try:
+        yield from outputs
+    except (concurrent.futures.TimeoutError, asyncio.TimeoutError) as e:
+        raise DeadlineExceeded("The deadline of the request has passed.") from e
+
+
+def _profiled(function: Callable, worker_pool: WorkerPool) -> Callable:
+    # the tasks of a profiled request are profiled too, unless they run in other processes
+    session = current_session()
+    if session is None or worker_pool.kind != "thread":
+        return function
+    return session.wrap(function)
+
+
+def iter_batches(inputs: Iterable, batch_size: int) -> Iterator[List]:
+    """Group the inputs in lists of batch_size elements, the last one being possibly smaller.
+    """
+    iterator = iter(inputs)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def read_image(image_path: str) -> np.ndarray:
+    """Read an image in BGR, as cv2 does, and time it.
+    """
+    with time_stage("image_read"):
+        return cv2.imread(image_path)
+
+
 def process_image(image_path: str) -> Dict[str, object]:
-    """Function used to open and predict on an image. It is suposed to be used in multiprocessing.
+    """Function used to open and predict on an image. It is suposed to be run by the worker pool.
 
     Arguments:
 
@@ -219,7 +1036,21 @@ def process_image(image_path: str) -> Dict[str, object]:
 
     Returns:
 
-    - *Dict[str, object]*: Predictions for this image path
+    - *Dict[str, object]*: Predictions for this image path, see `process_frame`
+    """
+    return process_frame(read_image(image_path))
+
+
+def process_frame(frame: np.ndarray) -> Dict[str, object]:
+    """Function used to predict on a frame. It is suposed to be run by the worker pool.
+
+    Arguments:
+
+    - *frame*: A numpy array in BGR
+
+    Returns:
+
+    - *Dict[str, object]*: Predictions for this frame
 
     ```python
     predictions = {
@@ -229,14 +1060,51 @@ def process_image(image_path: str) -> Dict[str, object]:
     }
     ```
     """
-    image = cv2.imread(image_path)  # cv2 opens in BGR
-    return localizer_tensorflow_serving_inference(image, SERVING_URL, return_all_scores=True)
+    return localizer_tensorflow_serving_inference(frame, SERVING_URL, return_all_scores=True)
+
+
+def process_batch(inputs: List, from_paths: bool = False) -> List[Dict[str, object]]:
+    """Function used to predict on a batch of frames with a single request. It is suposed to be run
+    by the worker pool.
+
+    Arguments:
+
+    - *inputs*: A list of frames in BGR, or of paths to images if from_paths is True
+    - *from_paths*: Whether the inputs are paths to images
+
+    Returns:
+
+    - *List[Dict[str, object]]*: Predictions for each frame, see `process_frame`
+    """
+    frames = [read_image(path) for path in inputs] if from_paths else inputs
+    return localizer_tensorflow_serving_inference_batch(
+        frames, SERVING_URL, return_all_scores=True, batch_size=len(frames)
+    )
+
+
+def predict_images(images: List[np.ndarray]) -> List[Dict[str, object]]:
+    """Make predictions on images with a single batched request. It is used to coalesce the
+    images posted at the same time.
+
+    Arguments:
+
+    - *images*: A list of numpy arrays in BGR
+
+    Returns:
+
+    - *List[Dict[str, object]]*: Predictions for each image, with only the score of the predicted
+        class
+    """
+    return localizer_tensorflow_serving_inference_batch(
+        images, SERVING_URL, return_all_scores=False, batch_size=len(images)
+    )
 
 
 def predict_and_format_image(
     image: np.ndarray,
     class_names: List[str] = CLASS_NAMES,
-    class_to_threshold: Dict[str, float] = CLASS_TO_THRESHOLD
+    class_to_threshold: Dict[str, float] = CLASS_TO_THRESHOLD,
+    encoded_image: Optional[bytes] = None,
 ) -> List[Dict[str, object]]:
     """Make prediction on an image and return them in a human readable format.
 
@@ -247,6 +1115,8 @@ def predict_and_format_image(
     - *class_to_threshold*: A dict assigning class names to threshold. If a class name isn't in
         this dict, no threshold will be applied, which means that all predictions for this class
         will be kept.
+    - *encoded_image*: The bytes the image was decoded from. With MOT_ENCODED_INPUTS, they are
+        sent as they are, and the image isn't coalesced with others since it can't be batched.
 
     Returns:
 
@@ -260,8 +1130,37 @@ def predict_and_format_image(
     }
     ```
     """
+    send_encoded = encoded_image is not None and query_server.ENCODED_INPUTS
+    if COALESCE_MAX_BATCH_SIZE > 1 and not send_encoded:
+        outputs = get_coalescer()(image)
+    else:
+        outputs = localizer_tensorflow_serving_inference(
+            image, SERVING_URL, return_all_scores=False, encoded_image=encoded_image
+        )
+    FRAMES_PROCESSED.inc()
+    return format_detections(outputs, class_names, class_to_threshold)
+
+
+def format_detections(
+    outputs: Dict[str, object],
+    class_names: List[str] = CLASS_NAMES,
+    class_to_threshold: Dict[str, float] = CLASS_TO_THRESHOLD
+) -> List[Dict[str, object]]:
+    """Filter the predictions for an image and put them in a human readable format.
+
+    Arguments:
+
+    - *outputs*: The predictions for the image, see `process_frame`
+    - *class_names*: The list of class names without background
+    - *class_to_threshold*: A dict assigning class names to threshold, see
+        `predict_and_format_image`
+
+    Returns:
+
+    - *List[Dict[str, object]]*: The kept predictions, see `predict_and_format_image`. When the
+        scores of all classes are predicted, the score is the highest one.
+    """
     class_names = ["BG"] + class_names
-    outputs = localizer_tensorflow_serving_inference(image, SERVING_URL, return_all_scores=False)
     detected_trash = []
     for box, label, score in zip(
         outputs["output/boxes:0"], outputs["output/labels:0"], outputs["output/scores:0"]
@@ -270,7 +1169,7 @@ def predict_and_format_image(
             trash_json = {
                 "box": [round(coord, 2) for coord in box],
                 "label": class_names[label],
-                "score": score,
+                "score": max(score) if isinstance(score, list) else score,
             }
             detected_trash.append(trash_json)
     return detected_trash
@@ -0,0 +1,158 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from tensorpack.utils import logger
+
+JOB_STATUSES = ["queued", "running", "done", "failed"]
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue already has its max number of pending jobs.
+    """
+
+
+class Job():
+    '''The state of a request processed in the background, such as the analysis of a long video.
+    '''
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = "queued"
+        self.frames_done = 0
+        self.frames_total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def update_progress(self, frames_done: int, frames_total: Optional[int] = None):
+        """The progress callback given to the function of the job.
+
+        Arguments:
+
+        - *frames_done*: The number of frames analyzed
+        - *frames_total*: The number of frames to analyze, or None if it isn't known
+        """
+        self.frames_done = frames_done
+        self.frames_total = frames_total
+
+    def as_dict(self) -> Dict[str, object]:
+        """Returns the status of the job, without its result.
+
+        Returns:
+
+        - *Dict[str, object]*: A dict such as
+
+        ```python
+        {
+            "job_id": "5f0c...",
+            "status": "running",  # one of JOB_STATUSES
+            "frames_done": 120,
+            "frames_total": 300,  # None if it isn't known yet
+        }
+        ```
+
+        and an "error" message if the job failed.
+        """
+        status = {
+            "job_id": self.id,
+            "status": self.status,
+            "frames_done": self.frames_done,
+            "frames_total": self.frames_total,
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobQueue():
+    '''Runs jobs on a fixed number of background workers, and keeps their results to be fetched.
+
+    The number of jobs queued or running is bounded, so that the uploads waiting for a worker don't
+    fill the disk. The finished jobs are forgotten after ttl seconds.
+    '''
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, ttl: float = 3600):
+        """
+        Arguments:
+
+        - *workers*: The number of jobs running at the same time
+        - *max_pending*: The max number of jobs queued or running
+        - *ttl*: The time in seconds a finished job is kept
+        """
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(self.workers)
+        self._jobs = OrderedDict()  # job id -> Job, in order of submission
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function: Callable[..., Dict], *args, **kwargs) -> Job:
+        """Schedule a job.
+
+        Arguments:
+
+        - *function*: The function of the job. It is called with the arguments, and with the
+            progress callback of the job as the `progress` keyword argument.
+        - *args*, *kwargs*: The arguments of the function
+
+        Returns:
+
+        - *Job*: The job, which is queued
+
+        Raises:
+
+        - *JobQueueFull*: If there are already max_pending jobs queued or running
+        """
+        with self._lock:
+            self._forget_expired_jobs()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(
+                    "{} jobs are already waiting, retry later.".format(self._pending)
+                )
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+            self._pending += 1
+        self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job with this id, or None if it doesn't exist or has expired.
+        """
+        with self._lock:
+            self._forget_expired_jobs()
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, function: Callable[..., Dict], args, kwargs):
+        job.status = "running"
+        try:
+            job.result = function(*args, progress=job.update_progress, **kwargs)
+            if isinstance(job.result, dict) and "error" in job.result:
+                # the analysis reports some failures, such as an unreadable file, in its result
+                job.error = job.result["error"]
+                job.status = "failed"
+            else:
+                job.status = "done"
+        except Exception as e:
+            logger.error("Job {} failed:\n{}".format(job.id, traceback.format_exc()))
+            job.error = "{}: {}".format(type(e).__name__, e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def _forget_expired_jobs(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,133 @@
+import cProfile
+import functools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+PROFILE_TOP = 40  # number of functions in the report of a profiled request
+
+_local = threading.local()
+
+
+class ProfileSession():
+    '''Collects the profiles of a single request, from the thread handling it and from the workers
+    running its tasks.
+
+    The profiles of all the threads are merged, so the cumulative time of a function is summed over
+    the threads which ran it.
+    '''
+
+    def __init__(self):
+        self._stats = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._duration = None
+
+    def add(self, profile: cProfile.Profile):
+        """Merge the profile of a thread into the session.
+        """
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def wrap(self, function: Callable) -> Callable:
+        """Returns the function, profiled into this session each time it is called. It is meant for
+        the tasks of a pool of threads, since the profiles can't be sent back by other processes.
+        """
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+                self.add(profile)
+
+        return profiled
+
+    def stop(self):
+        self._duration = time.perf_counter() - self._start
+
+    def report(self, top: int = PROFILE_TOP) -> Dict[str, object]:
+        """Returns the functions where the request spent the most time.
+
+        Arguments:
+
+        - *top*: The number of functions reported
+
+        Returns:
+
+        - *Dict[str, object]*: A dict such as
+
+        ```python
+        {
+            "duration_seconds": 12.3,  # the wall time of the request
+            "functions": [
+                {
+                    "function": "mot/serving/inference.py:512(process_frame)",
+                    "calls": 40,
+                    "own_seconds": 0.01,  # without the time spent in the functions it calls
+                    "cumulative_seconds": 45.2,  # summed over the threads
+                },
+                ...
+            ],  # in decreasing order of cumulative time
+        }
+        ```
+        """
+        with self._lock:
+            stats = {} if self._stats is None else dict(self._stats.stats)
+        functions = []
+        for (filename, line, name), (_, calls, own_time, cumulative_time, _) in stats.items():
+            functions.append(
+                {
+                    "function": "{}:{}({})".format(_short_path(filename), line, name),
+                    "calls": calls,
+                    "own_seconds": round(own_time, 6),
+                    "cumulative_seconds": round(cumulative_time, 6),
+                }
+            )
+        functions.sort(key=lambda function: function["cumulative_seconds"], reverse=True)
+        return {"duration_seconds": self._duration, "functions": functions[:top]}
+
+
+def _short_path(filename: str) -> str:
+    # the paths of the installed packages are too long to read, only their end is kept
+    parts = filename.split(os.sep)
+    return os.sep.join(parts[-3:]) if len(parts) > 3 else filename
+
+
+def current_session() -> Optional[ProfileSession]:
+    """Returns the profiling session of the request handled by this thread, if it is profiled.
+    """
+    return getattr(_local, "session", None)
+
+
+@contextmanager
+def profile_request() -> Iterator[ProfileSession]:
+    """Profile the thread handling a request, and the tasks wrapped with `ProfileSession.wrap` for
+    this request, until the end of the with block.
+
+    ```python
+    with profile_request() as session:
+        result = handle_file(file)
+    result["profile"] = session.report()
+    ```
+    """
+    session = ProfileSession()
+    _local.session = session
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield session
+    finally:
+        profile.disable()
+        _local.session = None
+        session.add(profile)
+        session.stop()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, IO, Optional
+
+HASH_CHUNK_SIZE = 1 << 20  # in bytes, the size of the chunks read to hash an uploaded file
+
+
+def hash_stream(stream: IO[bytes]) -> str:
+    """Hash the content of a file object, and rewind it so that it can be read again.
+
+    Arguments:
+
+    - *stream*: A seekable binary file object, such as the stream of an uploaded file
+
+    Returns:
+
+    - *str*: The sha256 of the content, in hexadecimal
+    """
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        sha.update(chunk)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def cache_key(content_hash: str, **parameters) -> str:
+    """Compute the key of a result from the hash of its input and the parameters it depends on.
+
+    Arguments:
+
+    - *content_hash*: The hash of the uploaded content
+    - *parameters*: The parameters changing the result, such as the fps or the model version. They
+        must be serializable to json.
+
+    Returns:
+
+    - *str*: The key of the result
+    """
+    parameters = json.dumps(parameters, sort_keys=True, default=str)
+    return hashlib.sha256((content_hash + parameters).encode("utf-8")).hexdigest()
+
+
+class ResultCache():
+    '''A cache of the results of the requests, with a LRU tier in memory and a tier on disk.
+
+    The results evicted from memory stay on disk, until the files of the disk tier exceed
+    max_disk_bytes and the least recently used ones are removed. The disk tier survives restarts and
+    can be shared by several processes of the serving.
+
+    The sizes of the files are scanned once at startup, then kept up to date in memory, so that a
+    write doesn't list the folder. Each process only bounds the files it knows of: those found at
+    startup, those it wrote, and those it read.
+    '''
+
+    def __init__(self, max_items: int = 128, folder: str = None, max_disk_bytes: int = 1 << 30):
+        """
+        Arguments:
+
+        - *max_items*: The max number of results kept in memory
+        - *folder*: The folder of the disk tier. If None, there is no disk tier.
+        - *max_disk_bytes*: The max size of the files of the disk tier
+        """
+        self.max_items = max(0, max_items)
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        self._disk = OrderedDict()  # key -> size of the file, from the least recently used
+        self._disk_bytes = 0
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Returns the result of a key, or None if it isn't cached.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._increment("hits", "memory_hits")
+                return self._memory[key]
+        result = self._read(key)
+        with self._lock:
+            if result is None:
+                self._increment("misses")
+                return None
+            self._increment("hits", "disk_hits")
+            self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: Dict):
+        """Cache the result of a key, in memory and on disk.
+        """
+        with self._lock:
+            self._remember(key, result)
+        if self.folder is not None:
+            size = self._write(key, result)
+            with self._lock:
+                self._track_file(key, size)
+            self._evict_from_disk()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns a copy of the counters of the cache, with the number of results in memory.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_items"] = len(self._memory)
+        return counters
+
+    def _increment(self, *names):
+        for name in names:
+            self._counters[name] += 1
+
+    def _remember(self, key: str, result: Dict):
+        if self.max_items == 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self._increment("memory_evictions")
+
+    def _track_file(self, key: str, size: int):
+        self._disk_bytes += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+
+    def _scan_disk(self):
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed by another process
+                files.append((stat.st_mtime, entry.name[:-len(".pkl")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._track_file(key, size)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".pkl")
+
+    def _read(self, key: str) -> Optional[Dict]:
+        if self.folder is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                result = pickle.load(f)
+            os.utime(self._path(key))  # the modification time orders the files at startup
+            size = os.path.getsize(self._path(key))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        with self._lock:
+            self._track_file(key, size)
+        return result
+
+    def _write(self, key: str, result: Dict) -> int:
+        # written to a temporary file first, so that no reader sees a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(temporary_path, self._path(key))
+        return size
+
+    def _evict_from_disk(self):
+        while True:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes or not self._disk:
+                    return
+                key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                continue  # removed by another process
+            with self._lock:
+                self._increment("disk_evictions")
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Hashable, Iterable, Iterator, Optional
+
+POOL_KINDS = ["thread", "process"]
+
+
+class WorkerPool():
+    '''A long lived pool of workers, shared by all the requests of the serving.
+
+    Each request submits its tasks under its own key. The tasks are handed to the workers in a
+    round robin between the keys, so a long video doesn't delay the other requests until all of its
+    frames are processed.
+
+    Use threads for tasks waiting on the network (the REST calls to tensorflow serving), and
+    processes for CPU bound tasks (decoding and preprocessing).
+    '''
+
+    def __init__(self, size: int, kind: str = "thread"):
+        """
+        Arguments:
+
+        - *size*: The number of workers
+        - *kind*: Either "thread" or "process"
+
+        Raises:
+
+        - *ValueError*: If the kind of pool isn't handled
+        """
+        if kind not in POOL_KINDS:
+            raise ValueError("Unknown kind of pool {}, should be in {}.".format(kind, POOL_KINDS))
+        self.size = max(1, size)
+        self.kind = kind
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(self.size)
+        else:
+            self._executor = ProcessPoolExecutor(self.size)
+
+        self._queues = OrderedDict()  # key of the request -> deque of tasks waiting for a worker
+        self._running = 0
+        self._shutdown = False
+        self._condition = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, key: Hashable, function: Callable, *args) -> Future:
+        """Schedule a task for a request.
+
+        Arguments:
+
+        - *key*: Identifies the request the task belongs to
+        - *function*: The function to call. It must be picklable for a pool of processes.
+        - *args*: The arguments of the function
+
+        Returns:
+
+        - *Future*: The future result of the task. It can be cancelled as long as the task is
+            waiting for a worker.
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit tasks after shutdown.")
+            self._queues.setdefault(key, deque()).append((future, function, args))
+            self._condition.notify_all()
+        return future
+
+    def imap(self,
+             function: Callable,
+             inputs: Iterable,
+             max_in_flight: int = None,
+             key: Hashable = None,
+             deadline: Optional[float] = None) -> Iterator:
+        """Same as `multiprocessing.Pool.imap`, but the inputs are consumed only as the outputs are.
+
+        Reading the whole iterable upfront would decode a whole video in memory when the inputs
+        are streamed frames. If the iteration stops early, or when the deadline passes, the tasks
+        still waiting for a worker are cancelled.
+
+        Arguments:
+
+        - *function*: The function to apply on each input
+        - *inputs*: An iterable of inputs
+        - *max_in_flight*: The max number of inputs submitted and not yet consumed as outputs.
+            By default, twice the size of the pool.
+        - *key*: Identifies the request. By default, a new key is used for each call.
+        - *deadline*: The time, as given by `time.time`, after which waiting for an output raises
+
+        Returns:
+
+        - *Iterator*: The outputs, in the same order as the inputs
+
+        Raises:
+
+        - *concurrent.futures.TimeoutError*: If the deadline passes before an output
+        """
+        key = object() if key is None else key
+        max_in_flight = max(1, max_in_flight or 2 * self.size)
+        pending = deque()
+        try:
+            for element in inputs:
+                if len(pending) >= max_in_flight:
+                    yield _result(pending.popleft(), deadline)
+                pending.append(self.submit(key, function, element))
+            while pending:
+                yield _result(pending.popleft(), deadline)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers. The tasks waiting for a worker are cancelled.
+        """
+        with self._condition:
+            self._shutdown = True
+            for queue in self._queues.values():
+                for future, _, _ in queue:
+                    future.cancel()
+            self._queues.clear()
+            self._condition.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._shutdown and (self._running >= self.size or not self._queues):
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+                # round robin: the request goes to the back of the line after each task
+                key, queue = self._queues.popitem(last=False)
+                future, function, args = queue.popleft()
+                if queue:
+                    self._queues[key] = queue
+                if not future.set_running_or_notify_cancel():
+                    continue  # cancelled while waiting
+                self._running += 1
+            try:
+                executor_future = self._executor.submit(function, *args)
+            except Exception as e:
+                self._release_worker()
+                future.set_exception(e)
+                continue
+            executor_future.add_done_callback(
+                lambda f, future=future: self._task_done(future, f)
+            )
+
+    def _release_worker(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def _task_done(self, future: Future, executor_future: Future):
+        self._release_worker()
+        if executor_future.cancelled():
+            future.set_exception(CancelledError())
+        elif executor_future.exception() is not None:
+            future.set_exception(executor_future.exception())
+        else:
+            future.set_result(executor_future.result())
+
+
+def _result(future: Future, deadline: Optional[float]):
+    if deadline is None:
+        return future.result()
+    return future.result(timeout=max(0.0, deadline - time.time()))
@@ -0,0 +1,146 @@
+from typing import Callable, List, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.csgraph import connected_components
+
+SimMatrix = Union[np.ndarray, sparse.spmatrix]
+
+
+def candidate_pairs(
+    sim_matrix: SimMatrix, threshold: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the pairs of a similarity matrix over the threshold.
+
+    Arguments:
+
+    - sim_matrix: a similarity matrix of shape (N, M), as a numpy array or as a scipy sparse
+    matrix, whose missing pairs can't be matched
+    - threshold: float threshold for accepting a match
+
+    Returns:
+
+    - the rows, the columns and the similarities of the pairs, sorted by decreasing similarity,
+    then by row and column
+
+    """
+    if sparse.issparse(sim_matrix):
+        sim_matrix = sim_matrix.tocoo()
+        keep = sim_matrix.data >= threshold  # nan similarities are never matched
+        rows, cols, values = sim_matrix.row[keep], sim_matrix.col[keep], sim_matrix.data[keep]
+    else:
+        rows, cols = np.nonzero(sim_matrix >= threshold)
+        values = sim_matrix[rows, cols]
+    order = np.lexsort((cols, rows, -values))
+    return rows[order], cols[order], values[order]
+
+
+def greedy_assignment(sim_matrix: SimMatrix, threshold: float) -> List[Tuple[int, int]]:
+    """Greedily matches the rows and the columns of a similarity matrix: the most similar pair is
+    matched first, then the most similar pair among the rows and columns left, and so on while the
+    similarity is over the threshold.
+
+    The pairs are sorted once, instead of looking for the max of the matrix after each match. Equal
+    similarities are matched by increasing row, then column, as np.argmax would.
+
+    Arguments:
+
+    - sim_matrix: a similarity matrix of shape (N, M), see `candidate_pairs`
+    - threshold: float threshold for accepting a match
+
+    Returns:
+
+    - a list of (row, column) matches, by decreasing similarity
+
+    """
+    rows, cols, _ = candidate_pairs(sim_matrix, threshold)
+    used_rows, used_cols = set(), set()
+    max_matches = min(sim_matrix.shape)
+    matches = []
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        matches.append((row, col))
+        if len(matches) == max_matches:
+            break
+        used_rows.add(row)
+        used_cols.add(col)
+    return matches
+
+
+def hungarian_assignment(sim_matrix: SimMatrix, threshold: float) -> List[Tuple[int, int]]:
+    """Matches the rows and the columns of a similarity matrix so that the sum of the similarities
+    over the threshold of the matched pairs is maximal, with scipy.optimize.linear_sum_assignment.
+
+    The rows and columns which can't be matched with each other, even through other rows and
+    columns, are independent problems, solved separately. A sparse matrix of tracklets linked only
+    within a window of frames gives many small problems.
+
+    Arguments:
+
+    - sim_matrix: a similarity matrix of shape (N, M), see `candidate_pairs`
+    - threshold: float threshold for accepting a match
+
+    Returns:
+
+    - a list of (row, column) matches, by decreasing similarity
+
+    """
+    rows, cols, values = candidate_pairs(sim_matrix, threshold)
+    if len(values) == 0:
+        return []
+    nb_rows, nb_cols = sim_matrix.shape
+    graph = sparse.coo_matrix(
+        (np.ones(len(values)), (rows, nb_rows + cols)), shape=(nb_rows + nb_cols,) * 2
+    )
+    _, labels = connected_components(graph, directed=False)
+    pair_labels = labels[rows]
+    by_label = np.argsort(pair_labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(pair_labels[by_label])) + 1
+    matches = []
+    for pairs in np.split(by_label, bounds):
+        sub_rows, local_rows = np.unique(rows[pairs], return_inverse=True)
+        sub_cols, local_cols = np.unique(cols[pairs], return_inverse=True)
+        # the pairs under the threshold don't count, and are dropped from the assignment
+        weights = np.zeros((len(sub_rows), len(sub_cols)))
+        valid = np.zeros(weights.shape, dtype=bool)
+        weights[local_rows, local_cols] = values[pairs]
+        valid[local_rows, local_cols] = True
+        matched_rows, matched_cols = linear_sum_assignment(-weights)
+        keep = valid[matched_rows, matched_cols]
+        matches.extend(
+            (weights[row, col], sub_rows[row], sub_cols[col])
+            for row, col in zip(matched_rows[keep], matched_cols[keep])
+        )
+    matches.sort(key=lambda match: (-match[0], match[1], match[2]))
+    return [(int(row), int(col)) for _, row, col in matches]
+
+
+SOLVERS = {"greedy": greedy_assignment, "hungarian": hungarian_assignment}
+
+Solver = Callable[[SimMatrix, float], List[Tuple[int, int]]]
+
+
+def assign(
+    sim_matrix: SimMatrix, threshold: float, solver: Union[str, Solver] = "greedy"
+) -> List[Tuple[int, int]]:
+    """Matches the rows and the columns of a similarity matrix, each at most once.
+
+    Arguments:
+
+    - sim_matrix: a similarity matrix of shape (N, M), see `candidate_pairs`
+    - threshold: float threshold for accepting a match
+    - solver: the name of a solver in SOLVERS, or a function with the same arguments as
+    `greedy_assignment` returning a list of (row, column) matches
+
+    Returns:
+
+    - a list of (row, column) matches, by decreasing similarity for the solvers of SOLVERS
+
+    """
+    if callable(solver):
+        return solver(sim_matrix, threshold)
+    if solver not in SOLVERS:
+        raise ValueError("Unknown solver {}, should be in {}.".format(solver, list(SOLVERS)))
+    return SOLVERS[solver](sim_matrix, threshold)
@@ -1,13 +1,17 @@
 import copy
-from typing import List
+from typing import List, Optional
 
 import math
 import numpy as np
 from cached_property import cached_property
+from scipy.sparse import coo_matrix
 
 from mot.object_detection.utils import np_box_ops
+from mot.tracker.assignment import assign
 from mot.tracker.tracker_utils import ratio, area, center, center_dist
 
+MAX_LINK_GAP = 30  # max number of frames between two tracklets which can be linked
+SPEED_FILTER_THRESHOLD = 0.05  # over this average speed, the tracklets going backwards are dropped
 
 def similarity(new_detection, old_detection):
     new_scores, new_box, new_idx = new_detection
@@ -20,6 +24,81 @@ def similarity(new_detection, old_detection):
     framediff = min(1.0, (new_idx-1-old_idx)/3)
     return 1.0 - 0.5 * scorediff - 0.2 * ratiodiff - 0.2 * sizediff - 0.5 * centerdiffx - 0.2 * centerdiffy - 0.2*framediff
 
+
+def _min(a, b):
+    # same as the builtin min, nan included: b is returned only if it is lower than a
+    return np.where(b < a, b, a)
+
+
+def _max(a, b):
+    return np.where(b > a, b, a)
+
+
+def similarity_matrix(new_scores, new_boxes, new_idx, old_scores, old_boxes, old_idxs):
+    """Computes `similarity` between each new detection and each old detection at once.
+
+    Arguments:
+
+    - new_scores: array of [classes scores] of shape (N, C)
+    - new_boxes: array of [4 coordinates] of shape (N, 4)
+    - new_idx: integer frame idx of the new detections
+    - old_scores: array of [classes scores] of shape (M, C)
+    - old_boxes: array of [4 coordinates] of shape (M, 4)
+    - old_idxs: array of integer frame idx of shape (M,)
+
+    Returns:
+
+    - a similarity matrix (numpy array) of shape (N, M), equal to the one computed with
+    `similarity` on each pair of detections
+    """
+    return similarities(
+        np.asarray(new_scores, dtype=float)[:, None, :],
+        np.asarray(new_boxes, dtype=float)[:, None, :],
+        new_idx,
+        np.asarray(old_scores, dtype=float)[None, :, :],
+        np.asarray(old_boxes, dtype=float)[None, :, :],
+        np.asarray(old_idxs)[None, :],
+    )
+
+
+def similarities(new_scores, new_boxes, new_idxs, old_scores, old_boxes, old_idxs):
+    """Computes `similarity` between new detections and old detections given as arrays, which are
+    broadcast together: the scores and boxes along their last axis, the frame idxs along all axes.
+
+    Returns:
+
+    - an array of similarities of the broadcast shape, without the last axis
+    """
+    def box_features(boxes):
+        widths = boxes[..., 2] - boxes[..., 0]
+        heights = boxes[..., 3] - boxes[..., 1]
+        centers_x = (boxes[..., 2] + boxes[..., 0]) / 2
+        centers_y = (boxes[..., 3] + boxes[..., 1]) / 2
+        return widths / heights, np.sqrt(widths * heights), centers_x, centers_y
+
+    new_ratios, new_areas, new_centers_x, new_centers_y = box_features(new_boxes)
+    old_ratios, old_areas, old_centers_x, old_centers_y = box_features(old_boxes)
+    scorediff = np.mean(np.abs(new_scores - old_scores), axis=-1)
+    ratiodiff = _min(1.0, np.abs(new_ratios - old_ratios))
+    sizediff = _min(1.0, np.abs(new_areas - old_areas) / _max(new_areas, old_areas))
+    centerdiffx = _min(1.0, np.abs(new_centers_x - old_centers_x))
+    centerdiffy = _min(1.0, np.abs(new_centers_y - old_centers_y))
+    framediff = _min(1.0, (new_idxs - 1 - old_idxs) / 3)
+    return 1.0 - 0.5 * scorediff - 0.2 * ratiodiff - 0.2 * sizediff - 0.5 * centerdiffx - 0.2 * centerdiffy - 0.2*framediff
+
+def detections_similarity_matrix(new_scores, new_boxes, idx, tracklets):
+    """Builds a similarity matrix between new scores and boxes and existing tracklets, see
+    `ObjectTracking.build_similarity_matrix`
+    """
+    nb_new = len(new_boxes)
+    nb_old = len(tracklets)
+    if nb_old == 0 or nb_new == 0:
+        return None
+    old_detections = [tracklet.get_latest_detection(apply_speed=True, new_frame_id=idx) for tracklet in tracklets]
+    old_scores, old_boxes, old_idxs = zip(*old_detections)
+    return similarity_matrix(new_scores, new_boxes, idx, np.array(old_scores), np.array(old_boxes), np.array(old_idxs))
+
+
 class Track():
     '''Track (or trajectory) class mainly defined by a sequence of frames and the corresponding detections
 
@@ -27,63 +106,124 @@ class Track():
     - The output of the detector are called "detections"
     - The matching of successive boxes are called "tracklets" which are small tracks
     - The final trajectories are called "tracks"
+
+    The detections are stored in numpy buffers, doubled when full, along with the running sums of
+    the scores and of the speeds between successive boxes: adding a detection takes the same time
+    whatever the length of the track. The scores, boxes and frames attributes are lists copied from
+    the buffers, the first and last ones are available without copy.
     '''
 
+    __slots__ = (
+        "id", "speed", "track_score",
+        "_scores", "_boxes", "_frames", "_length", "_score_sum", "_speed_sum",
+    )
+
+    THR_SPEED = 0.0
+    THR_BOX_CENTER = 0.05
+    THR_BOX_RATIO = 0.1
+    INITIAL_CAPACITY = 4
+
     def __init__(self, id: int, class_scores: List[float], box: List[float], frame: int):
         self.id = id
-        self.scores = [class_scores]
-        self.boxes = [box]
-        self.frames = [frame]
+        self._scores = np.empty((self.INITIAL_CAPACITY, len(class_scores)))
+        self._boxes = np.empty((self.INITIAL_CAPACITY, 4))
+        self._frames = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        self._scores[0] = class_scores
+        self._boxes[0] = box
+        self._frames[0] = frame
+        self._length = 1
+        self._score_sum = self._scores[0].copy()
+        self._speed_sum = np.zeros(4)  # sum of the speeds between successive boxes
         self.speed = None
         self.track_score = max(class_scores)
 
-        self.THR_SPEED = 0.0
-        self.THR_BOX_CENTER = 0.05
-        self.THR_BOX_RATIO = 0.1
+    @property
+    def scores(self):
+        return self._scores[:self._length].tolist()
+
+    @property
+    def boxes(self):
+        return self._boxes[:self._length].tolist()
+
+    @property
+    def frames(self):
+        return self._frames[:self._length].tolist()
+
+    @property
+    def first_frame(self):
+        return int(self._frames[0])
+
+    @property
+    def last_frame(self):
+        return int(self._frames[self._length - 1])
+
+    def _reserve(self, length):
+        # grows the buffers to hold at least length detections
+        capacity = len(self._frames)
+        if length <= capacity:
+            return
+        while capacity < length:
+            capacity *= 2
+        for name in ("_scores", "_boxes", "_frames"):
+            buffer = getattr(self, name)
+            grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:self._length] = buffer[:self._length]
+            setattr(self, name, grown)
+
+    def _update_statistics(self):
+        if self._length > 2:
+            self.speed = self.compute_speed()
+        self.track_score = np.max(self.get_average_scores())
 
     def add_matching_detection(self, scores, box, frame):
-        self.scores.append(scores)
-        self.boxes.append(box)
-        self.frames.append(frame)
-        if len(self.boxes) > 2:
-            self.speed = self.compute_speed()
-        self.track_score = np.max(np.mean(np.array(self.scores), axis=0))
+        self._reserve(self._length + 1)
+        last = self._length - 1
+        self._scores[self._length] = scores
+        self._boxes[self._length] = box
+        self._frames[self._length] = frame
+        self._length += 1
+        self._score_sum += self._scores[last + 1]
+        self._speed_sum += (self._boxes[last + 1] - self._boxes[last]) / \
+            float(self._frames[last] - self._frames[last + 1])
+        self._update_statistics()
 
     def get_latest_np_box(self):
-        return np.array(self.boxes[-1])
+        return self._boxes[self._length - 1].copy()
+
+    def get_first_np_box(self):
+        return self._boxes[0].copy()
 
     def get_latest_detection(self, apply_speed, new_frame_id):
-        last_box = np.array(self.boxes[-1])
-        frame_offset = new_frame_id - self.frames[-1]
+        last_box = self.get_latest_np_box()
+        frame_offset = new_frame_id - self.last_frame
         if apply_speed and self.speed is not None:
             last_box = np.clip(last_box + self.speed * frame_offset, 0.0, 1.0)
-        return [np.array(self.scores[-1]), last_box, self.frames[-1]]
+        return [self._scores[self._length - 1].copy(), last_box, self.last_frame]
 
     def is_in_range(self, frame_idx, time_window):
-        return (frame_idx - self.frames[-1]) <= time_window
+        return (frame_idx - self.last_frame) <= time_window
 
     def is_valid(self, min_length):
-        return len(self.frames) >= min_length
+        return self._length >= min_length
 
     def has_valid_speed(self, speed):
+        if self.speed is None:
+            return True  # too short to know its direction
         speed_dot = np.dot(speed, self.speed[0:2])
         return np.sum(speed_dot) > self.THR_SPEED
 
     def get_center(self):
-        x1, y1, x2, y2 = self.boxes[-1]
+        x1, y1, x2, y2 = self._boxes[self._length - 1].tolist()
         return (x2 + x1) / 2, (y2 + y1) / 2
 
     def get_average_scores(self):
-        return np.mean(np.array(self.scores), axis=0)
+        return self._score_sum / self._length
 
     def get_label(self):
-        return np.argmax(np.array(self.scores).sum(axis=0)) + 1
+        return np.argmax(self._score_sum) + 1
 
     def compute_speed(self):
-        boxes_array = np.array(self.boxes)
-        time_differences = np.array([float(y-x) for x,y in zip(self.frames[1:], self.frames[0:-1])])
-        speeds = (boxes_array[1:, :] - boxes_array[0:-1, :]).T / time_differences
-        speed = np.mean(speeds, axis = -1)
+        speed = self._speed_sum / (self._length - 1)
         vx = (speed[0]+speed[2])/2
         vy = (speed[1]+speed[3])/2
         return np.array([vx, vy, vx, vy])
@@ -99,13 +239,13 @@ class Track():
 
         - A floating point value corresponding to the compatibility. -1 is not compatible
         """
-        if self.frames[-1] >= track.frames[0]:
+        if self.last_frame >= track.first_frame:
             return -1.0
 
-        projected_box = self.get_latest_detection(apply_speed=True, new_frame_id=track.frames[0])
-        old_detection = [self.get_average_scores(), projected_box, self.frames[-1]]
-        new_detection = [track.get_average_scores(), track.boxes[0], track.frames[0]]
-        return similarity(old_detection, new_detection)
+        _, projected_box, _ = self.get_latest_detection(apply_speed=True, new_frame_id=track.first_frame)
+        old_detection = [self.get_average_scores(), projected_box, self.last_frame]
+        new_detection = [track.get_average_scores(), track.get_first_np_box(), track.first_frame]
+        return similarity(new_detection, old_detection)
 
     def contains_subtrack(self, track):
         """Compare two tracks and verify if the track is a subpart of this one
@@ -120,26 +260,34 @@ class Track():
         """
         if self.get_label() != track.get_label():
             return False
-        common_frames = set(self.frames).intersection(set(track.frames))
+        frames, track_frames = self.frames, track.frames
+        common_frames = set(frames).intersection(set(track_frames))
         match_box = 0.
         for frame in common_frames:
-            box1 = self.boxes[self.frames.index(frame)]
-            box2 = track.boxes[track.frames.index(frame)]
+            box1 = self._boxes[frames.index(frame)]
+            box2 = track._boxes[track_frames.index(frame)]
             if center_dist(box1, box2) < self.THR_BOX_CENTER and \
                abs(ratio(box1) - ratio(box2)) < self.THR_BOX_RATIO:
                match_box += 1.
-        match_ratio = match_box / len(track.frames)
+        match_ratio = match_box / len(track_frames)
         if match_ratio > 0.2:
             return True
         return False
 
     def append_track(self, track):
-        self.scores.extend(track.scores)
-        self.boxes.extend(track.boxes)
-        self.frames.extend(track.frames)
-        if len(self.boxes) > 2:
-            self.speed = self.compute_speed()
-        self.track_score = np.max(np.mean(np.array(self.scores), axis=0))
+        length = self._length + track._length
+        self._reserve(length)
+        start = self._length
+        self._scores[start:length] = track._scores[:track._length]
+        self._boxes[start:length] = track._boxes[:track._length]
+        self._frames[start:length] = track._frames[:track._length]
+        self._length = length
+        # the sums go on in the order of the detections, as if they were added one by one
+        self._score_sum = np.sum(np.vstack([self._score_sum, self._scores[start:length]]), axis=0)
+        speeds = (self._boxes[start:length] - self._boxes[start - 1:length - 1]) / \
+            (self._frames[start - 1:length - 1] - self._frames[start:length]).astype(float)[:, None]
+        self._speed_sum = np.sum(np.vstack([self._speed_sum, speeds]), axis=0)
+        self._update_statistics()
 
 
     def __repr__(self):
@@ -160,13 +308,92 @@ class Track():
         }
 
 
+class TrackletBuilder():
+    '''Builds tracklets frame by frame: the detections of a frame are matched to the tracklets
+    extended in the last time_window frames, and the remaining detections start new tracklets.
+
+    Only the tracklets which can still be extended are kept. The others are returned by
+    `add_frame` as soon as they are out of the time window.
+    '''
+
+    def __init__(self, time_window=2, matching_threshold=0.5, solver="greedy"):
+        """
+        Arguments:
+
+        - time_window: integer corresponding to the number of previous frames considered
+        - matching_threshold: float threshold for accepting a match
+        - solver: the assignment solver, see `mot.tracker.assignment.assign`
+        """
+        self.time_window = time_window
+        self.matching_threshold = matching_threshold
+        self.solver = solver
+        self.live_tracklets = []  # by order of creation
+        self.nb_tracklets = 0
+
+    def add_frame(self, frame_idx, json_object):
+        """Adds the detections of a frame. The frames must be added by increasing index, the
+        frames without detection can be skipped.
+
+        Arguments:
+
+        - frame_idx: integer frame idx
+        - json_object: the inference output of the frame, with its boxes and scores
+
+        Returns:
+
+        - the list of tracklets which can't be extended anymore, by order of creation
+        """
+        new_scores = json_object.get("output/scores:0", [])
+        new_boxes = json_object.get("output/boxes:0", [])
+        # Expects boxes with Non maximum suppression ?
+
+        # Build the list of previous trash that could be matched and similarity with the new
+        closed_tracklets = [t for t in self.live_tracklets if not t.is_in_range(frame_idx, self.time_window)]
+        self.live_tracklets = [t for t in self.live_tracklets if t.is_in_range(frame_idx, self.time_window)]
+        potential_matching_tracklets = self.live_tracklets
+        sim_matrix = detections_similarity_matrix(new_scores, new_boxes, frame_idx, potential_matching_tracklets)
+
+        # match the new boxes:
+        new_tracklets_idxs = list(range(len(new_boxes)))
+        if sim_matrix is not None:
+            for new_idx, matching_idx in assign(sim_matrix, self.matching_threshold, self.solver):
+                # append to the corresponding tracklet
+                potential_matching_tracklets[matching_idx].add_matching_detection(new_scores[new_idx], new_boxes[new_idx], frame_idx)
+                new_tracklets_idxs.remove(new_idx)
+
+        #remaining boxes become new tracklets
+        for i in new_tracklets_idxs:
+            self.live_tracklets.append(Track(self.nb_tracklets, new_scores[i], new_boxes[i], frame_idx))
+            self.nb_tracklets += 1
+        return closed_tracklets
+
+    def close(self):
+        """Stops all the tracklets, at the end of the video.
+
+        Returns:
+
+        - the list of tracklets which were still extended, by order of creation
+        """
+        closed_tracklets, self.live_tracklets = self.live_tracklets, []
+        return closed_tracklets
+
+
 class ObjectTracking():
     '''Wrapper class to tracking trash objects in video output frames
     '''
 
     def __init__(
-        self, video_id, list_path_images, list_inference_output=None, fps=2, list_geoloc=None
+        self, video_id, list_path_images, list_inference_output=None, fps=2, list_geoloc=None,
+        tracklet_solver="greedy", track_solver="greedy", max_link_gap=MAX_LINK_GAP
     ):
+        """
+        Arguments:
+
+        - tracklet_solver, track_solver: the assignment solvers matching the detections to the
+        tracklets, and the tracklets between them. See `mot.tracker.assignment.assign`.
+        - max_link_gap: the max number of frames between the end of a tracklet and the start of
+        the tracklet continuing it, or None for no limit
+        """
         self.video_id = video_id
 
         self.list_path_images = list_path_images
@@ -180,29 +407,62 @@ class ObjectTracking():
 
         self.iou_threshold = 0.3
         self.rewind_window_match = 2
+        self.tracklet_solver = tracklet_solver
+        self.track_solver = track_solver
+        self.max_link_gap = max_link_gap
 
-    def build_tracklet_similarity_matrix(self, tracklets:List):
-        """Builds a compatibility matrix between tracklets
+    def build_tracklet_similarity_matrix(self, tracklets:List, max_gap:Optional[int]=None):
+        """Builds a sparse compatibility matrix between tracklets. Only the pairs where the
+        second tracklet starts at most max_gap frames after the end of the first one are compared,
+        found with the tracklets sorted by start frame, so that the cost grows with the number of
+        tracklets close in time rather than with the square of the number of tracklets.
 
         Arguments:
 
-        - new_scores: list of [classes scores] of length N
-        - new_boxes: list of [4 coordinates] of length N
-        - idx: integer frame idx
-        - potential_matching_tracklets: list of tracklets of length M
+        - tracklets: list of tracklets of length T
+        - max_gap: the max number of frames between two compared tracklets, or None for no limit
 
         Returns:
-        - a similarity matrix (numpy array) of shape (N, M)
+        - a compatibility matrix (scipy.sparse.coo_matrix) of shape (T, T), equal to
+        `Track.compatibility` for the compared pairs. The other pairs aren't compatible.
 
         """
         nb_tracklets = len(tracklets)
         if nb_tracklets == 0:
             return None
-        m = np.zeros((nb_tracklets, nb_tracklets))
-        for i in range(nb_tracklets):
-            for j in range(i, nb_tracklets):
-                m[i,j] = tracklets[i].compatibility(tracklets[j])
-        return m
+        first_frames = np.array([tracklet.first_frame for tracklet in tracklets])
+        last_frames = np.array([tracklet.last_frame for tracklet in tracklets])
+
+        # the tracklets starting in (last frame, last frame + max_gap] of each tracklet
+        by_start = np.argsort(first_frames, kind="stable")
+        starts = first_frames[by_start]
+        lows = np.searchsorted(starts, last_frames, side="right")
+        if max_gap is None:
+            highs = np.full(nb_tracklets, nb_tracklets)
+        else:
+            highs = np.searchsorted(starts, last_frames + max_gap, side="right")
+        counts = highs - lows
+        old = np.repeat(np.arange(nb_tracklets), counts)
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        new = by_start[np.repeat(lows, counts) + positions]
+
+        # the old tracklets are projected to the first frame of the new ones, as in
+        # Track.get_latest_detection, and the averages of scores are computed once per tracklet
+        average_scores = np.array([tracklet.get_average_scores() for tracklet in tracklets])
+        first_boxes = np.array([tracklet.get_first_np_box() for tracklet in tracklets])
+        projected_boxes = np.array([tracklet.get_latest_np_box() for tracklet in tracklets])[old]
+        moving = np.array([tracklet.speed is not None for tracklet in tracklets])[old]
+        speeds = np.array([
+            tracklet.speed if tracklet.speed is not None else np.zeros(4) for tracklet in tracklets
+        ])[old]
+        frame_offsets = (first_frames[new] - last_frames[old])[moving, None]
+        projected_boxes[moving] = np.clip(projected_boxes[moving] + speeds[moving] * frame_offsets, 0.0, 1.0)
+
+        values = similarities(
+            average_scores[new], first_boxes[new], first_frames[new],
+            average_scores[old], projected_boxes, last_frames[old],
+        )
+        return coo_matrix((values, (old, new)), shape=(nb_tracklets, nb_tracklets))
 
     def build_similarity_matrix(self, new_scores: List, new_boxes: List, idx: int, potential_matching_tracklets:List):
         """Builds a similarity matrix between new scores and boxes and existing tracklets
@@ -218,16 +478,7 @@ class ObjectTracking():
         - a similarity matrix (numpy array) of shape (N, M)
 
         """
-        nb_new = len(new_boxes)
-        nb_old = len(potential_matching_tracklets)
-        if nb_old == 0 or nb_new == 0:
-            return None
-        m = np.zeros((nb_new, nb_old))
-        for i in range(nb_new):
-            new_detection = [np.array(new_scores[i]), np.array(new_boxes[i]), idx]
-            for j in range(nb_old):
-                m[i,j] = similarity(new_detection, potential_matching_tracklets[j].get_latest_detection(apply_speed=True, new_frame_id=idx))
-        return m
+        return detections_similarity_matrix(new_scores, new_boxes, idx, potential_matching_tracklets)
 
     def average_move_speed(self, tracklets):
         """Computes the average displacement of tracklets
@@ -238,20 +489,35 @@ class ObjectTracking():
     def compute_tracks(self):
         """Main function which computes tracks from detection on successive frames
         """
-        tracklets = self.build_tracklets(self.list_inference_output, 2, 0.5)
+        tracklets = self.build_tracklets(self.list_inference_output, 2, 0.5, self.tracklet_solver)
         print("build tracks length tracklets:", len(tracklets))
+        return self.link_tracklets(tracklets)
+
+    def link_tracklets(self, tracklets, matching_threshold=0.5, min_length=2):
+        """Links the tracklets of a whole video into tracks
+
+        Arguments:
+
+        - tracklets: list of tracklets, by order of creation
+        - matching_threshold: float threshold for linking two tracklets
+        - min_length: the min number of frames of the tracks kept
+
+        Returns:
+
+        - the list of tracks
+        """
         average_speed = self.average_move_speed(tracklets)
         filtered_tracklets = tracklets
         # Filter tracklets with wrong speed
-        if np.linalg.norm(average_speed) > 0.05:
+        if np.linalg.norm(average_speed) > SPEED_FILTER_THRESHOLD:
             filtered_tracklets = list(filter(lambda t:t.has_valid_speed(average_speed), filtered_tracklets))
         # Match tracklets
-        matched_tracks = self.match_tracklets(filtered_tracklets, average_speed)
+        matched_tracks = self.match_tracklets(filtered_tracklets, average_speed, matching_threshold, solver=self.track_solver, max_gap=self.max_link_gap)
         # Filter tracklets that are too small
-        matched_tracks = list(filter(lambda t:t.is_valid(2), matched_tracks))
+        matched_tracks = list(filter(lambda t:t.is_valid(min_length), matched_tracks))
         return matched_tracks
 
-    def build_tracklets(self, input_detections, time_window = 2, matching_threshold = 0.5):
+    def build_tracklets(self, input_detections, time_window = 2, matching_threshold = 0.5, solver = "greedy"):
         """Builds tracklets, i.e. confident matching between successive frames
         using a greedy algorithm (considers the best matching previous box)
 
@@ -260,80 +526,48 @@ class ObjectTracking():
         - input_detections: list of successive frames and their corresponding boxes and classes
         - time_window: integer corresponding to the number of previous frames considered
         - matching_threshold: float threshold for accepting a match
+        - solver: the assignment solver, see `mot.tracker.assignment.assign`
 
         Returns:
 
         - a list of Track objects, mainly defined by [frame_ids, boxes and classes]
 
         """
+        builder = TrackletBuilder(time_window, matching_threshold, solver)
         tracklets = []
-
         for frame_idx, json_object in enumerate(input_detections):
-            new_scores = json_object.get("output/scores:0", [])
-            new_boxes = json_object.get("output/boxes:0", [])
-            # Expects boxes with Non maximum suppression ?
-
-            # Build the list of previous trash that could be matched and similarity with the new
-            potential_matching_tracklets = list(filter(lambda t:t.is_in_range(frame_idx, time_window), tracklets))
-            sim_matrix = self.build_similarity_matrix(new_scores, new_boxes, frame_idx, potential_matching_tracklets)
-
-            # greedily match the new boxes:
-            new_tracklets_idxs = list(range(len(new_boxes)))
-            if sim_matrix is not None:
-                for i in range(len(new_boxes)):
-                    max_values = np.max(sim_matrix, axis=1)
-                    if np.max(max_values) < matching_threshold:
-                        break
-                    new_idx = np.argmax(max_values)
-                    matching_idx = np.argmax(sim_matrix[new_idx])
+            tracklets.extend(builder.add_frame(frame_idx, json_object))
+        tracklets.extend(builder.close())
+        # by order of creation
+        return sorted(tracklets, key=lambda tracklet: tracklet.id)
 
-                    # append to the corresponding tracklet
-                    potential_matching_tracklets[matching_idx].add_matching_detection(new_scores[new_idx], new_boxes[new_idx], frame_idx)
+    def match_tracklets(self, tracklets, average_speed, matching_threshold=0.5, solver="greedy", max_gap=None):
+        """Match tracklets: each tracklet is continued by at most one later tracklet
 
-                    # remove from similarity matrix
-                    sim_matrix[new_idx,:] = -1.0
-                    sim_matrix[:,matching_idx] = -1.0
-                    new_tracklets_idxs.remove(new_idx)
-
-            #remaining boxes become new tracklets
-            for i in new_tracklets_idxs:
-                tracklets.append(Track(len(tracklets), new_scores[i], new_boxes[i], frame_idx))
+        Arguments:
 
-        return tracklets
+        - tracklets: list of tracklets, by order of creation
+        - average_speed: the average displacement of the tracklets
+        - matching_threshold: float threshold for accepting a match
+        - solver: the assignment solver, see `mot.tracker.assignment.assign`
+        - max_gap: the max number of frames between the end of a tracklet and the start of the
+        tracklet continuing it, or None for no limit
 
-    def match_tracklets(self, tracklets, average_speed, matching_threshold=0.5):
-        """Match tracklets
+        Returns:
 
+        - the list of tracks, where the matched tracklets are appended to the tracklet they continue
         """
-        # greedily match the tracklets
-        # may be improved using :
-        # scipy.optimize.linear_sum_assignment(matrix)
-        sim_matrix = self.build_tracklet_similarity_matrix(tracklets)
-        matches = []
-        nb_tracklets = len(tracklets)
-        list_outbound = list(range(nb_tracklets))
-        list_inbound = list(range(nb_tracklets))
-        if nb_tracklets == 0:
+        sim_matrix = self.build_tracklet_similarity_matrix(tracklets, max_gap)
+        if sim_matrix is None:
             return []
+        matches = assign(sim_matrix, matching_threshold, solver)
 
-        if sim_matrix is not None:
-            for i in range(nb_tracklets):
-                max_values = np.max(sim_matrix, axis=1)
-                if np.max(max_values) < matching_threshold:
-                    break
-                new_idx = np.argmax(max_values)
-                matching_idx = np.argmax(sim_matrix[new_idx])
-
-                # remove from similarity matrix
-                sim_matrix[new_idx,:] = -1.0
-                sim_matrix[:,matching_idx] = -1.0
-                matches.append([new_idx, matching_idx])
-
-
-        for match in matches[::-1]:
-            tracklets[match[1]].append_tracklet(tracklets[match[0]])
+        # a later tracklet is appended to the tracklet it continues once it is complete, so that
+        # the chains of matches end up in their first tracklet
+        for old_idx, new_idx in sorted(matches, key=lambda match: tracklets[match[0]].first_frame, reverse=True):
+            tracklets[old_idx].append_track(tracklets[new_idx])
 
-        tracklet_idxes_to_remove = [m[0] for m in matches]
+        tracklet_idxes_to_remove = {new_idx for _, new_idx in matches}
         return [tracklet for i,tracklet in enumerate(tracklets) if i not in tracklet_idxes_to_remove]
 
 
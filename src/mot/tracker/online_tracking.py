@@ -0,0 +1,196 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from mot.tracker.object_tracking import (
+    MAX_LINK_GAP, SPEED_FILTER_THRESHOLD, ObjectTracking, Track, TrackletBuilder
+)
+
+
+class _Chain():
+    '''A track made of tracklets linked one after the other, which may still be continued.
+    '''
+
+    def __init__(self, tracklet: Track):
+        self.track = tracklet  # the first tracklet, to which the next ones are appended
+        self.tail = tracklet  # the last tracklet, which the next one must be compatible with
+
+    def append(self, tracklet: Track):
+        self.track.append_track(tracklet)
+        self.tail = tracklet
+
+
+class OnlineTracking():
+    '''Tracks the objects of a video frame by frame, with a memory bounded by the number of objects
+    seen in the last frames rather than by the length of the video.
+
+    The tracklets are built as in `ObjectTracking.build_tracklets`. Once a tracklet can't be
+    extended anymore, it is filtered on its speed and linked to the track it continues, among the
+    tracks ended at most max_link_gap frames before it starts. A track is final once no tracklet
+    can continue it, and is then emitted if it is long enough.
+
+    `ObjectTracking.compute_tracks` filters the speeds of the tracklets with the average speed of
+    the whole video, and links the tracklets with a global assignment. Here the average speed is
+    the one of the tracklets seen so far, and each tracklet is linked to the best track when it
+    ends. The tracks are the same on simple videos, and may differ on crowded ones.
+
+    In batch mode, the tracklets are kept until `flush`, and then linked by
+    `ObjectTracking.link_tracklets` as in `ObjectTracking.compute_tracks`, which gives the same
+    tracks. The memory then grows with the length of the video.
+    '''
+
+    def __init__(
+        self,
+        time_window: int = 2,
+        matching_threshold: float = 0.5,
+        link_threshold: float = 0.5,
+        max_link_gap: int = MAX_LINK_GAP,
+        min_length: int = 2,
+        solver: str = "greedy",
+        on_track: Optional[Callable[[Track], None]] = None,
+        batch: bool = False,
+        track_solver: str = "greedy",
+    ):
+        """
+        Arguments:
+
+        - time_window: integer corresponding to the number of previous frames considered
+        - matching_threshold: float threshold for matching a detection to a tracklet
+        - link_threshold: float threshold for linking a tracklet to the track it continues
+        - max_link_gap: the max number of frames between the end of a track and the start of the
+        tracklet continuing it. It can be None for no limit in batch mode only, since no track
+        would ever be final
+        - min_length: the min number of frames of the emitted tracks
+        - solver: the assignment solver matching the detections to the tracklets, see
+        `mot.tracker.assignment.assign`
+        - on_track: a function called with each final track, as it is returned by `update`
+        - batch: whether to link the tracklets of the whole video at the end, see above
+        - track_solver: the assignment solver linking the tracklets in batch mode
+
+        Raises:
+
+        - ValueError: if max_link_gap is None outside of batch mode
+        """
+        if max_link_gap is None and not batch:
+            raise ValueError("The tracks can't be emitted online without a max_link_gap.")
+        self.link_threshold = link_threshold
+        self.max_link_gap = max_link_gap
+        self.min_length = min_length
+        self.on_track = on_track
+        self.batch = batch
+        self.track_solver = track_solver
+        self._builder = TrackletBuilder(time_window, matching_threshold, solver)
+        self._chains = []  # the tracks which may still be continued, by order of creation
+        self._tracklets = []  # the ended tracklets, kept until the end in batch mode
+        self._speed_sum = np.zeros(2)
+        self._speed_count = 0
+
+    def update(self, frame_idx: int, json_object: Dict) -> List[Track]:
+        """Adds the detections of a frame. The frames must be added by increasing index, the
+        frames without detection can be skipped.
+
+        Arguments:
+
+        - frame_idx: integer frame idx
+        - json_object: the inference output of the frame, with its boxes and scores
+
+        Returns:
+
+        - the list of tracks which became final with this frame
+        """
+        self._link(self._builder.add_frame(frame_idx, json_object))
+        return self._emit(frame_idx)
+
+    def flush(self) -> List[Track]:
+        """Ends the video.
+
+        Returns:
+
+        - the list of tracks which weren't final yet
+        """
+        self._link(self._builder.close())
+        return self._emit(None)
+
+    def track(self, inference_outputs: Iterable[Dict]) -> Iterator[Track]:
+        """Tracks the objects of a whole video, see `update`.
+
+        Arguments:
+
+        - inference_outputs: the inference output of each frame
+
+        Returns:
+
+        - an iterator of the tracks, as soon as they are final
+        """
+        for frame_idx, json_object in enumerate(inference_outputs):
+            yield from self.update(frame_idx, json_object)
+        yield from self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of tracklets and tracks held in memory.
+        """
+        return {
+            "live_tracklets": len(self._builder.live_tracklets),
+            "pending_tracks": len(self._chains) + len(self._tracklets),
+        }
+
+    def _link(self, tracklets: List[Track]):
+        if self.batch:
+            self._tracklets.extend(tracklets)
+            return
+        for tracklet in tracklets:
+            if tracklet.speed is not None:
+                self._speed_sum += tracklet.speed[0:2]
+                self._speed_count += 1
+            average_speed = self._speed_sum / max(1, self._speed_count)
+            if np.linalg.norm(average_speed) > SPEED_FILTER_THRESHOLD and \
+                    not tracklet.has_valid_speed(average_speed):
+                continue
+            best_chain, best_compatibility = None, None
+            for chain in self._chains:
+                gap = tracklet.first_frame - chain.tail.last_frame
+                if gap <= 0 or gap > self.max_link_gap:
+                    continue
+                compatibility = chain.tail.compatibility(tracklet)
+                if compatibility >= self.link_threshold and \
+                        (best_chain is None or compatibility > best_compatibility):
+                    best_chain, best_compatibility = chain, compatibility
+            if best_chain is None:
+                self._chains.append(_Chain(tracklet))
+            else:
+                best_chain.append(tracklet)
+
+    def _emit(self, frame_idx: Optional[int]) -> List[Track]:
+        tracks = self._batch_tracks(frame_idx) if self.batch else self._final_tracks(frame_idx)
+        if self.on_track is not None:
+            for track in tracks:
+                self.on_track(track)
+        return tracks
+
+    def _final_tracks(self, frame_idx: Optional[int]) -> List[Track]:
+        if frame_idx is None:
+            final, self._chains = self._chains, []
+        else:
+            live_starts = [tracklet.first_frame for tracklet in self._builder.live_tracklets]
+            is_final = [self._is_final(chain, frame_idx, live_starts) for chain in self._chains]
+            final = [chain for chain, done in zip(self._chains, is_final) if done]
+            self._chains = [chain for chain, done in zip(self._chains, is_final) if not done]
+        return [chain.track for chain in final if chain.track.is_valid(self.min_length)]
+
+    def _batch_tracks(self, frame_idx: Optional[int]) -> List[Track]:
+        if frame_idx is not None:
+            return []
+        # by order of creation, as in `ObjectTracking.build_tracklets`
+        tracklets = sorted(self._tracklets, key=lambda tracklet: tracklet.id)
+        self._tracklets = []
+        tracker = ObjectTracking(
+            None, [], track_solver=self.track_solver, max_link_gap=self.max_link_gap
+        )
+        return tracker.link_tracklets(tracklets, self.link_threshold, self.min_length)
+
+    def _is_final(self, chain: _Chain, frame_idx: int, live_starts: List[int]) -> bool:
+        # a track can only be continued by a tracklet starting at most max_link_gap frames after it
+        end = chain.tail.last_frame
+        if frame_idx < end + self.max_link_gap:
+            return False
+        return not any(end < start <= end + self.max_link_gap for start in live_starts)
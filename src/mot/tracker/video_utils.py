@@ -1,6 +1,8 @@
 import os
 
+import cv2
 import ffmpeg
+import numpy as np
 
 
 def split_video(input_path, output_folder, fps=1.5, resolution=(1024, 768)):
@@ -26,6 +28,77 @@ def split_video(input_path, output_folder, fps=1.5, resolution=(1024, 768)):
     )
 
 
+def stream_video(input_path, fps=1.5, resolution=(1024, 768)):
+    """Decodes a video into frames without writing them to disk.
+
+    ffmpeg outputs raw BGR frames on its stdout, which are read one by one. The frames are the same
+    as the ones written by `split_video`, without the JPEG encoding and decoding.
+
+    Arguments:
+
+    - *input_path*: string of video full path
+    - *fps*: float for number of frames per second
+    - *resolution*: integer tuple for resolution
+
+    Returns:
+
+    - A generator of np.array of shape [height, width, 3] in BGR and uint8
+
+    Raises:
+
+    - *ffmpeg.Error*: If ffmpeg failed to decode the video
+    """
+    width, height = int(resolution[0]), int(resolution[1])
+    frame_size = width * height * 3
+    process = (
+        ffmpeg.input(input_path).filter(
+            "scale", width="{}".format(width), height="{}".format(height)
+        ).filter("fps", fps=fps, round="up").trim(
+            start_frame=0
+        ).output("pipe:", format="rawvideo", pix_fmt="bgr24").run_async(pipe_stdout=True)
+    )
+    finished = False
+    try:
+        while True:
+            buffer = process.stdout.read(frame_size)
+            if len(buffer) < frame_size:
+                finished = True
+                break
+            yield np.frombuffer(buffer, np.uint8).reshape((height, width, 3))
+    finally:
+        if not finished:
+            # the consumer stopped before the end of the video
+            process.kill()
+        process.stdout.close()
+        process.wait()
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffmpeg", None, None)
+
+
+def estimate_frame_count(input_path, fps=1.5):
+    """Estimates the number of frames extracted from a video by `split_video` or `stream_video`,
+    from the metadata of the video, without decoding it.
+
+    Arguments:
+
+    - *input_path*: string of video full path
+    - *fps*: float for number of frames per second
+
+    Returns:
+
+    - The estimated number of frames, or None if the metadata of the video don't tell its duration
+    """
+    capture = cv2.VideoCapture(input_path)
+    try:
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        video_fps = capture.get(cv2.CAP_PROP_FPS)
+    finally:
+        capture.release()
+    if frame_count <= 0 or video_fps <= 0:
+        return None
+    return int(np.ceil(frame_count / video_fps * float(fps)))
+
+
 def read_folder(input_path):
     # for now, read directly from images in folder ; later from json outputs
     return [os.path.join(input_path, file) for file in sorted(os.listdir(input_path))]
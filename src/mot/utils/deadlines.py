@@ -0,0 +1,105 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Tuple, Union
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline of a request has passed, or when the request was cancelled.
+    """
+
+
+class Deadline():
+    '''The time after which the work of a request is abandoned, shared by the threads working on it.
+
+    A deadline can also be cancelled before it expires, when the client has disconnected for
+    instance. Only the expiry time is kept when a deadline is sent to another process.
+    '''
+
+    def __init__(self, seconds: Optional[float] = None, expires_at: Optional[float] = None):
+        """
+        Arguments:
+
+        - *seconds*: The time left from now, or None for no time limit
+        - *expires_at*: Or the expiry time, as given by `time.time`
+        """
+        if seconds is not None:
+            expires_at = time.time() + seconds
+        self.expires_at = expires_at
+        self._cancelled = threading.Event()
+
+    def __reduce__(self):
+        return (Deadline, (None, self.expires_at))
+
+    def remaining(self) -> Optional[float]:
+        """Returns the time left in seconds, 0 if the deadline is cancelled, or None if there is no
+        time limit.
+        """
+        if self._cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0
+
+    def cancel(self):
+        """Expire the deadline now.
+        """
+        self._cancelled.set()
+
+    def check(self):
+        """Raises DeadlineExceeded if the deadline has expired.
+        """
+        if self.expired():
+            raise DeadlineExceeded("The deadline of the request has passed.")
+
+    def timeout(
+        self, timeout: Union[float, Tuple[float, float]]
+    ) -> Union[float, Tuple[float, float]]:
+        """Returns the timeout of a call, reduced to the time left.
+
+        Arguments:
+
+        - *timeout*: A float or a (connect, read) tuple, in seconds
+
+        Raises:
+
+        - *DeadlineExceeded*: If there is no time left
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if isinstance(timeout, tuple):
+            return tuple(min(value, remaining) for value in timeout)
+        return min(timeout, remaining)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Returns the deadline of the request handled by this thread, or None if it has none.
+    """
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Make a deadline the one of the current thread for the duration of a with block.
+    """
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def call_with_deadline(deadline: Optional[Deadline], function: Callable, *args, **kwargs):
+    """Call a function with a deadline for the current thread. Partial applications of it can be
+    sent to the workers of a pool, threads or processes.
+    """
+    with use_deadline(deadline):
+        return function(*args, **kwargs)
@@ -0,0 +1,246 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# in seconds, from the decoding of a frame to the analysis of a whole video
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900
+)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], **extra) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric():
+    '''The values of a metric for each combination of its labels, shared by the threads.
+    '''
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # tuple of label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "{} expects the labels {}, got {}.".format(self.name, self.labelnames, list(labels))
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.extend(self._render_value(labelvalues, value))
+        return lines
+
+    def _render_value(self, labelvalues: Tuple[str, ...], value) -> List[str]:
+        return [
+            "{}{} {}".format(
+                self.name, _format_labels(self.labelnames, labelvalues), _format_value(value)
+            )
+        ]
+
+
+class Counter(_Metric):
+    '''A value which only increases, such as a number of frames processed.
+    '''
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    '''A value which goes up and down, such as a number of requests in flight.
+    '''
+    kind = "gauge"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Increment the gauge for the duration of a with block.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    '''The distribution of observed values, such as durations, in cumulative buckets.
+
+    An observation is a binary search in the buckets and an increment, so that timing each frame
+    costs much less than processing it.
+    '''
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                # the count of each bucket, the last one being +Inf, and the sum of the values
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts_and_sum = self._values[key]
+            counts_and_sum[0][index] += 1
+            counts_and_sum[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, labelvalues: Tuple[str, ...], value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative_count = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative_count += count
+            lines.append(
+                "{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(self.labelnames, labelvalues, le=_format_value(float(bound))),
+                    cumulative_count,
+                )
+            )
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append("{}_sum{} {}".format(self.name, labels, repr(total)))
+        lines.append("{}_count{} {}".format(self.name, labels, cumulative_count))
+        return lines
+
+
+class MetricsRegistry():
+    '''The metrics of the serving, rendered together in the Prometheus text format.
+    '''
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterator[str]]):
+        """Add a function returning lines in the Prometheus text format, for the values which are
+        already counted elsewhere.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "mot_stage_duration_seconds",
+    "Time spent in each stage of the serving pipeline.",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = registry.histogram(
+    "mot_request_duration_seconds",
+    "Time spent handling the requests of each endpoint of the app.",
+    labelnames=("endpoint",),
+)
+FRAMES_PROCESSED = registry.counter(
+    "mot_frames_processed_total", "Number of images and frames of videos analyzed."
+)
+BACKEND_ERRORS = registry.counter(
+    "mot_backend_errors_total",
+    "Number of failed requests to tensorflow serving, retried or not.",
+    labelnames=("reason",),
+)
+IN_FLIGHT = registry.gauge(
+    "mot_requests_in_flight",
+    "Number of requests being handled by the app, or waiting for tensorflow serving.",
+    labelnames=("kind",),
+)
+
+
+def time_stage(stage: str):
+    """Returns a context manager observing the duration of a stage of the pipeline.
+
+    ```python
+    with time_stage("split_video"):
+        split_video(path, folder)
+    ```
+    """
+    return STAGE_SECONDS.time(stage=stage)
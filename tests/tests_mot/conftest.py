@@ -0,0 +1,115 @@
+import base64
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import cv2
+import numpy as np
+import pytest
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServing():
+    '''A fake tensorflow serving answering predict requests on a local port.
+
+    For each image, it returns two boxes, and the first channel of the top left pixel as the label
+    of the first box, which lets the tests check which answer corresponds to which image. Batched
+    inputs get batched outputs, and base64 encoded images are decoded.
+    '''
+
+    def __init__(self, delay=0.0, status_code=200):
+        """
+        Arguments:
+
+        - *delay*: The time in seconds to wait before answering, or a function of the label
+            returning this time
+        - *status_code*: The status code of the answers
+        """
+        self.delay = delay
+        self.status_code = status_code
+        self.requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                status_code, response = stub.answer(json.loads(body.decode("utf-8")))
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def answer(self, signature):
+        with self._lock:
+            self.requests += 1
+        inputs = signature["inputs"]
+        if isinstance(inputs, dict):
+            encoded_image = np.frombuffer(base64.b64decode(inputs["b64"]), np.uint8)
+            inputs = cv2.imdecode(encoded_image, cv2.IMREAD_COLOR).tolist()
+        batched = isinstance(inputs[0][0][0], list)
+        labels = [int(image[0][0][0]) for image in (inputs if batched else [inputs])]
+        time.sleep(self.delay(labels[0]) if callable(self.delay) else self.delay)
+        if self.status_code != 200:
+            return self.status_code, {"error": "stub error"}
+        outputs = [
+            {
+                "output/boxes:0": [[0, 0, 120, 40], [0, 0, 120, 80]],
+                "output/scores:0": [[0.71, 0.1, 0.1], [0.2, 0.05, 0.71]],
+                "output/labels:0": [label, 3],
+            } for label in labels
+        ]
+        if not batched:
+            return 200, {"outputs": outputs[0]}
+        # a batched model pads the detections of each image with background detections
+        padding = {
+            "output/boxes:0": [0, 0, 0, 0],
+            "output/scores:0": [0, 0, 0],
+            "output/labels:0": 0
+        }
+        return 200, {
+            "outputs":
+                {
+                    name: [output[name] + [padding[name]] for output in outputs]
+                    for name in padding
+                }
+        }
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_serving():
+    """Returns a function starting StubServing instances, which are stopped after the test.
+    """
+    stubs = []
+
+    def start(**kwargs):
+        stubs.append(StubServing(**kwargs))
+        return stubs[-1]
+
+    yield start
+    for stub in stubs:
+        stub.shutdown()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from unittest import mock
+
+import aiohttp
+import numpy as np
+import pytest
+
+from mot.object_detection.async_query_server import (
+    localizer_tensorflow_serving_inferences, query_tensorflow_server_async
+)
+from mot.object_detection.concurrency import AIMDLimiter
+from mot.object_detection.query_server import get_client_stats
+from mot.object_detection.replicas import get_replica_set
+from mot.utils.deadlines import Deadline, DeadlineExceeded
+
+
+def test_localizer_tensorflow_serving_inferences(stub_serving):
+    # the first frames are the slowest to answer, but the predictions must stay in order
+    stub = stub_serving(delay=lambda label: 0.05 * (10 - label))
+    images = (np.full((300, 200, 3), i) for i in range(10))
+    stats_before = get_client_stats()
+
+    outputs = list(
+        localizer_tensorflow_serving_inferences(
+            images, stub.url, return_all_scores=True, max_in_flight=4
+        )
+    )
+
+    assert [output["output/labels:0"][0] for output in outputs] == list(range(10))
+    assert outputs[0]["output/boxes:0"] == [[0, 0, 0.1, 0.05], [0, 0, 0.1, 0.1]]
+    assert outputs[0]["output/scores:0"] == [[0.71, 0.1, 0.1], [0.2, 0.05, 0.71]]
+    stats_after = get_client_stats()
+    assert stats_after["requests"] - stats_before["requests"] == 10
+    assert stats_after["new_connections"] - stats_before["new_connections"] <= 4
+
+
+def test_localizer_tensorflow_serving_inferences_error(stub_serving):
+    stub = stub_serving(status_code=400)
+    images = [np.zeros((300, 200, 3))]
+    with pytest.raises(ValueError):
+        list(localizer_tensorflow_serving_inferences(images, stub.url))
+
+
+def test_localizer_tensorflow_serving_inferences_limiter(stub_serving):
+    stub = stub_serving(delay=0.1)
+    limiter = AIMDLimiter(initial_limit=1, max_limit=1)
+    images = (np.full((300, 200, 3), i) for i in range(4))
+    start = time.perf_counter()
+    with mock.patch(
+        "mot.object_detection.async_query_server.get_limiter", return_value=limiter
+    ), mock.patch.object(limiter, "release", wraps=limiter.release) as mock_release:
+        outputs = list(localizer_tensorflow_serving_inferences(images, stub.url, max_in_flight=4))
+    assert [output["output/labels:0"][0] for output in outputs] == list(range(4))
+    # the requests were sent one at a time
+    assert time.perf_counter() - start >= 0.4
+    assert mock_release.call_count == 4
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_query_tensorflow_server_async_deadline(stub_serving):
+    stub = stub_serving(delay=2)
+
+    async def query():
+        async with aiohttp.ClientSession() as session:
+            return await query_tensorflow_server_async(
+                session, {"inputs": [[[0, 0, 0]]]}, stub.url, deadline=Deadline(0.3)
+            )
+
+    loop = asyncio.new_event_loop()
+    start = time.time()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            loop.run_until_complete(query())
+    finally:
+        loop.close()
+    # the request timed out at the deadline, and wasn't retried
+    assert time.time() - start < 1
+    assert stub.requests == 1
+
+
+def test_query_tensorflow_server_async_deadline_healthy_backend(stub_serving):
+    stub = stub_serving(delay=0.2)
+    limiter = AIMDLimiter(initial_limit=8)
+
+    async def query():
+        async with aiohttp.ClientSession() as session:
+            for _ in range(3):
+                with pytest.raises(DeadlineExceeded):
+                    await query_tensorflow_server_async(
+                        session, {"inputs": [[[0, 0, 0]]]}, stub.url, deadline=Deadline(0.05)
+                    )
+
+    loop = asyncio.new_event_loop()
+    try:
+        with mock.patch(
+            "mot.object_detection.async_query_server.get_limiter", return_value=limiter
+        ):
+            loop.run_until_complete(query())
+    finally:
+        loop.close()
+    # the requests cut by their deadline don't count against the replica nor the limit
+    replica = get_replica_set(stub.url).stats()[0]
+    assert replica["failures"] == 0
+    assert not replica["ejected"]
+    assert replica["outstanding"] == 0
+    assert limiter.limit == 8
+    assert limiter.stats()["decreases"] == 0
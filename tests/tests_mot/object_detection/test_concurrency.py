@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from mot.object_detection.concurrency import AIMDLimiter
+from mot.utils.deadlines import Deadline, DeadlineExceeded
+
+
+def test_aimd_limiter_increase_decrease():
+    limiter = AIMDLimiter(initial_limit=2, max_limit=5)
+    for _ in range(20):
+        limiter.release(limiter.acquire(), latency=0.1, failed=False)
+    assert limiter.limit == 5  # additive increase, up to max_limit
+
+    epochs = [limiter.acquire() for _ in range(3)]
+    limiter.release(epochs[0], latency=0.5, failed=False)  # over twice the latency without load
+    assert limiter.limit == 2
+    # the requests sent before the decrease don't decrease it again
+    limiter.release(epochs[1], latency=None, failed=True)
+    assert limiter.limit == 2
+    # the ones sent after do
+    limiter.release(limiter.acquire(), latency=None, failed=True)
+    assert limiter.limit == 1
+    limiter.release(epochs[2], latency=0.1, failed=False)
+
+    stats = limiter.stats()
+    assert stats["in_flight"] == 0
+    assert stats["decreases"] == 2
+    assert stats["baseline_latency_seconds"] == 0.1
+
+
+def test_aimd_limiter_wait():
+    limiter = AIMDLimiter(initial_limit=1)
+    epoch = limiter.acquire()
+    acquired = threading.Event()
+    waiting = threading.Thread(target=lambda: acquired.set() if limiter.acquire() == 0 else None)
+    waiting.start()
+    assert not acquired.wait(0.1)
+    limiter.release(epoch, latency=0.1, failed=False)
+    assert acquired.wait(1)
+    waiting.join()
+
+
+def test_aimd_limiter_wait_async():
+    limiter = AIMDLimiter(initial_limit=1)
+    epoch = limiter.acquire()
+    loop = asyncio.new_event_loop()
+    waiting = loop.create_task(limiter.acquire_async())
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert not waiting.done()
+    # released from another thread, while the loop waits
+    threading.Timer(0.1, lambda: limiter.release(epoch, latency=0.1, failed=False)).start()
+    assert loop.run_until_complete(asyncio.wait_for(waiting, 1)) == 0
+    assert limiter.stats()["in_flight"] == 1
+    loop.close()
+
+
+def test_aimd_limiter_deadline():
+    limiter = AIMDLimiter(initial_limit=1)
+    limiter.acquire()
+    start = time.time()
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(Deadline(0.2))
+    loop = asyncio.new_event_loop()
+    with pytest.raises(DeadlineExceeded):
+        loop.run_until_complete(limiter.acquire_async(Deadline(0.2)))
+    loop.close()
+    assert time.time() - start < 1
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_aimd_limiter_neutral_release():
+    limiter = AIMDLimiter(initial_limit=2)
+    limiter.release(limiter.acquire(), latency=None, failed=None)
+    assert limiter.limit == 2
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.stats()["decreases"] == limiter.stats()["increases"] == 0
+
+
+def test_aimd_limiter_capacity():
+    # a backend answering in 10ms up to 8 requests at a time, and queuing the others
+    capacity, service_time = 8, 0.01
+    limiter = AIMDLimiter(initial_limit=1, max_limit=64)
+    in_flight = [0]
+    lock = threading.Lock()
+    limits = []
+    stop = time.monotonic() + 2
+
+    def client():
+        while time.monotonic() < stop:
+            epoch = limiter.acquire()
+            with lock:
+                in_flight[0] += 1
+                latency = service_time * max(1, in_flight[0] / capacity)
+            time.sleep(latency)
+            with lock:
+                in_flight[0] -= 1
+            limiter.release(epoch, latency=latency, failed=False)
+            limits.append(limiter.limit)
+
+    clients = [threading.Thread(target=client) for _ in range(32)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    # the limit grows from 1 and settles around the capacity instead of the 32 clients
+    steady_limits = limits[len(limits) // 2:]
+    assert capacity / 2 <= sum(steady_limits) / len(steady_limits) <= 2 * capacity
+    assert limiter.stats()["decreases"] > 0
@@ -0,0 +1,107 @@
+import threading
+import time
+from unittest import mock
+
+from mot.object_detection.hedging import Hedger
+from mot.object_detection.query_server import query_tensorflow_server
+
+
+def make_hedger(**kwargs):
+    hedger = Hedger(percentile=50, min_samples=5, **kwargs)
+    for _ in range(5):
+        hedger.observe(0.05)
+    return hedger
+
+
+def slow_then_fast():
+    calls = []
+    lock = threading.Lock()
+
+    def function(avoid):
+        with lock:
+            calls.append(set(avoid))
+            avoid.add("replica_{}".format(len(calls)))
+            slow = len(calls) % 2 == 1
+        time.sleep(0.5 if slow else 0.01)
+        return "slow" if slow else "fast"
+
+    return function, calls
+
+
+def test_hedger():
+    hedger = make_hedger(budget=0.5)
+    function, calls = slow_then_fast()
+    start = time.perf_counter()
+    assert hedger.call(function) == "fast"
+    assert time.perf_counter() - start < 0.3
+    # the duplicate knows the replica of the first call
+    assert calls == [set(), {"replica_1"}]
+    stats = hedger.stats()
+    assert stats["requests"] == stats["hedges"] == stats["wins"] == 1
+    assert stats["delay_seconds"] == 0.05
+
+
+def test_hedger_budget():
+    hedger = make_hedger(budget=0)
+    function, _ = slow_then_fast()
+    assert hedger.call(function) == "fast"
+    # the budget is spent, the next slow request isn't hedged
+    assert hedger.call(function) == "slow"
+    stats = hedger.stats()
+    assert stats["hedges"] == 1
+    assert stats["skipped"] == 1
+    assert stats["hedge_rate"] == 0.5
+
+
+def test_hedger_caller_thread():
+    hedger = make_hedger(budget=0)
+    slow, _ = slow_then_fast()
+    threads = []
+
+    def function(avoid):
+        threads.append(threading.current_thread())
+        return "fast"
+
+    assert hedger.call(function) == "fast"
+    # the budget is spent by the hedged request, the next one can't be hedged
+    assert hedger.call(slow) == "fast"
+    assert hedger.call(function) == "fast"
+    assert threads[0] is not threading.current_thread()
+    assert threads[1] is threading.current_thread()
+    assert hedger.stats()["skipped"] == 0
+
+
+def test_hedger_refresh():
+    hedger = Hedger(percentile=50, min_samples=5, refresh=10)
+    for _ in range(5):
+        hedger.observe(0.05)
+    assert hedger.delay() == 0.05
+    for _ in range(4):
+        hedger.observe(1)
+    # the percentile is computed again on the 10th latency only
+    assert hedger.delay() == 0.05
+    hedger.observe(1)
+    assert hedger.delay() == 0.525
+
+
+def test_hedger_min_samples():
+    hedger = Hedger(percentile=50, min_samples=5)
+    function, calls = slow_then_fast()
+    assert hedger.call(function) == "slow"
+    assert len(calls) == 1
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_query_tensorflow_server_hedged(stub_serving):
+    slow, fast = stub_serving(delay=1), stub_serving()
+    hedger = make_hedger(budget=1)
+    urls = [slow.url, fast.url]
+    with mock.patch("mot.object_detection.query_server.get_hedger", return_value=hedger):
+        for _ in range(4):
+            start = time.perf_counter()
+            outputs = query_tensorflow_server({"inputs": [[[7, 0, 0]]]}, urls)
+            assert time.perf_counter() - start < 0.5
+            assert outputs["output/labels:0"] == [7, 3]
+    # each request sent to the slow replica was hedged to the fast one
+    assert fast.requests == 4
+    assert hedger.stats()["wins"] == slow.requests
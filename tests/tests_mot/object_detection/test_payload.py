@@ -0,0 +1,68 @@
+import gzip
+import json
+
+import numpy as np
+
+from mot.object_detection.payload import (
+    encode_array, encode_signature, fits_int64, lossless_decimals
+)
+
+
+def test_encode_array():
+    array = np.array([[[0.04, 12.36, -3.06]], [[255.0, -0.04, 7.0]]], np.float32)
+    assert json.loads(encode_array(array, decimals=1)) == [[[0.0, 12.4, -3.1]], [[255.0, 0.0, 7.0]]]
+    assert json.loads(encode_array(array, decimals=0)) == [[[0, 12, -3]], [[255, 0, 7]]]
+
+    image = np.random.randint(0, 256, (7, 5, 3)).astype(np.float32)
+    assert json.loads(encode_array(image)) == image.tolist()
+    image = np.random.randint(0, 256, (7, 5, 3), dtype=np.uint8)
+    assert json.loads(encode_array(image, decimals=2)) == image.tolist()
+
+    image = np.random.uniform(-300, 300, (2, 4, 6, 3))
+    np.testing.assert_allclose(json.loads(encode_array(image, decimals=2)), image, atol=0.0051)
+
+    for array in [np.zeros((0, 3)), np.array(2.5), np.array([1.0, np.nan])]:
+        assert json.dumps(json.loads(encode_array(array))) == json.dumps(array.tolist())
+
+
+def test_encode_array_lossless():
+    # a resized image, whose pixels are interpolated
+    image = np.random.uniform(0, 255, (9, 7, 3)).astype(np.float32)
+    assert lossless_decimals(image) == 6
+    decoded = np.array(json.loads(encode_array(image)), np.float32)
+    assert np.allclose(decoded, image, rtol=0, atol=np.finfo(np.float32).eps * 255)
+    # the large values are read back exactly
+    assert np.array_equal(decoded[image >= 128], image[image >= 128])
+    # the values close to 0 are kept with the precision of the largest ones
+    image = np.random.uniform(-1, 1, (9, 7, 3)).astype(np.float32) * [[[1e-3, 1, 100]]]
+    decoded = np.array(json.loads(encode_array(image)), np.float32)
+    assert np.allclose(decoded, image, rtol=0, atol=np.finfo(np.float32).eps * 100)
+    assert lossless_decimals(np.arange(5)) == 0
+
+
+def test_encode_array_large_values():
+    arrays = [
+        np.array([1e300, 1.5]),
+        np.array([3.4e38, -1.0], np.float32),
+        np.array([2**64 - 1, 1], np.uint64),
+        np.array([np.iinfo(np.int64).min, 1]),
+    ]
+    for array in arrays:
+        assert not fits_int64(array)
+        assert json.loads(encode_array(array)) == array.tolist()
+    # too large once scaled by the decimals kept
+    array = np.array([1e15, 0.5])
+    assert fits_int64(array, decimals=2) and not fits_int64(array, decimals=4)
+    assert json.loads(encode_array(array, decimals=4)) == array.tolist()
+    assert fits_int64(np.array([2**63 - 1, 1], np.uint64))
+
+
+def test_encode_signature():
+    signature = {"inputs": np.ones((2, 2, 3), np.float32), "name": "serving"}
+    body, headers = encode_signature(signature)
+    assert headers == {"content-type": "application/json"}
+    assert json.loads(body) == {"inputs": np.ones((2, 2, 3)).tolist(), "name": "serving"}
+
+    compressed_body, headers = encode_signature(signature, compress=True)
+    assert headers == {"content-type": "application/json", "content-encoding": "gzip"}
+    assert gzip.decompress(compressed_body) == body
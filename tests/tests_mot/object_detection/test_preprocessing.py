@@ -1,6 +1,15 @@
+import base64
+import struct
+import zlib
+
+import cv2
 import numpy as np
+import pytest
 
 from mot.object_detection.preprocessing import (resize_to_min_dimension,
+                                                encode_for_serving,
+                                                exif_orientation,
+                                                preprocess_batch_for_serving,
                                                 preprocess_for_serving)
 
 
@@ -34,3 +43,89 @@ def test_preprocess_for_serving():
     assert np.sum(signature['inputs'][:, :, 0]) == 0
     assert np.sum(signature['inputs'][:, :, 1]) == 800**2
     assert np.sum(signature['inputs'][:, :, 2]) == 2 * 800**2
+
+
+def test_preprocess_batch_for_serving():
+    images = [np.full((100, 100, 3), i) for i in range(3)]
+
+    signature, ratios = preprocess_batch_for_serving(images)
+    signature['inputs'] = np.array(signature['inputs'])
+
+    assert ratios == [8, 8, 8]
+    assert signature['inputs'].shape == (3, 800, 800, 3)
+    for i, image in enumerate(images):
+        single_signature, _ = preprocess_for_serving(image)
+        np.testing.assert_array_equal(signature['inputs'][i], single_signature['inputs'])
+
+    with pytest.raises(ValueError):
+        preprocess_batch_for_serving([np.zeros((100, 100, 3)), np.zeros((100, 50, 3))])
+
+
+def test_encode_for_serving():
+    image = np.zeros((100, 50, 3))
+    image[:, :, 1] = 100
+    image[:, :, 2] = 200
+
+    signature, ratio = encode_for_serving(image)
+    encoded_image = np.frombuffer(base64.b64decode(signature["inputs"]["b64"]), np.uint8)
+    decoded_image = cv2.imdecode(encoded_image, cv2.IMREAD_COLOR)
+
+    assert ratio == 1.0
+    assert decoded_image.shape == (100, 50, 3)
+    np.testing.assert_allclose(decoded_image, image, atol=2)
+
+
+def test_encode_for_serving_encoded_image():
+    image = np.full((100, 50, 3), 100, np.uint8)
+    for extension in [".jpg", ".png"]:
+        encoded_image = cv2.imencode(extension, image)[1].tobytes()
+        signature, _ = encode_for_serving(image, encoded_image=encoded_image)
+        # sent as it is
+        assert base64.b64decode(signature["inputs"]["b64"]) == encoded_image
+
+    # the other formats are encoded again as JPEG
+    encoded_image = cv2.imencode(".bmp", image)[1].tobytes()
+    signature, _ = encode_for_serving(image, encoded_image=encoded_image)
+    assert base64.b64decode(signature["inputs"]["b64"]) == cv2.imencode(
+        ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+def exif_tiff(orientation):
+    # a single directory entry: the orientation, as a SHORT
+    return b"MM\x00\x2a" + struct.pack(">IH", 8, 1) + \
+        struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack(">I", 0)
+
+
+def with_exif_orientation(jpeg, orientation):
+    segment = b"Exif\x00\x00" + exif_tiff(orientation)
+    return jpeg[:2] + b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + jpeg[2:]
+
+
+def test_encode_for_serving_exif_orientation():
+    image = np.full((100, 50, 3), 100, np.uint8)
+    jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+    assert exif_orientation(jpeg) is None
+    assert exif_orientation(cv2.imencode(".png", image)[1].tobytes()) is None
+
+    upright = with_exif_orientation(jpeg, 1)
+    signature, _ = encode_for_serving(image, encoded_image=upright)
+    assert base64.b64decode(signature["inputs"]["b64"]) == upright
+
+    # a photo taken rotated is rotated by OpenCV, but wouldn't be by the graph
+    rotated = with_exif_orientation(jpeg, 6)
+    assert exif_orientation(rotated) == 6
+    decoded = cv2.imdecode(np.frombuffer(rotated, np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == (50, 100, 3)
+    signature, _ = encode_for_serving(decoded, encoded_image=rotated)
+    sent = base64.b64decode(signature["inputs"]["b64"])
+    assert sent != rotated
+    sent_image = cv2.imdecode(np.frombuffer(sent, np.uint8), cv2.IMREAD_COLOR)
+    assert sent_image.shape == decoded.shape
+    assert exif_orientation(sent) is None
+
+    # the eXIf chunk of a PNG, after its IHDR chunk
+    png = cv2.imencode(".png", image)[1].tobytes()
+    chunk = b"eXIf" + exif_tiff(8)
+    png = png[:33] + struct.pack(">I", len(chunk) - 4) + chunk + \
+        struct.pack(">I", zlib.crc32(chunk)) + png[33:]
+    assert exif_orientation(png) == 8
@@ -1,11 +1,18 @@
 import json
+import threading
+import time
 from unittest import mock
 
 import numpy as np
 import pytest
 
-from mot.object_detection.query_server import \
-    localizer_tensorflow_serving_inference
+from mot.object_detection.concurrency import AIMDLimiter
+from mot.object_detection.query_server import (
+    MAX_RETRIES, TIMEOUT, get_client_stats, get_session, localizer_tensorflow_serving_inference,
+    localizer_tensorflow_serving_inference_batch, query_tensorflow_server
+)
+from mot.object_detection.replicas import get_replica_set
+from mot.utils.deadlines import Deadline, DeadlineExceeded, use_deadline
 
 
 def mock_post_tensorpack_localizer_prediction_score(*args, **kwargs):
@@ -34,7 +41,7 @@ def mock_post_tensorpack_localizer_prediction_score(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer_prediction_score)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer_prediction_score)
 def test_localizer_tensorflow_serving_inference_prediction_score(mock_server_result):
     image = np.zeros((300, 200, 3))
 
@@ -89,7 +96,7 @@ def mock_post_tensorpack_localizer_all_scores(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer_all_scores)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer_all_scores)
 def test_localizer_tensorflow_serving_inference_all_scores(mock_server_result):
     image = np.zeros((300, 200, 3))
 
@@ -146,7 +153,7 @@ def mock_post_tensorpack_localizer_no_pred(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer_no_pred)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer_no_pred)
 def test_localizer_tensorflow_serving_inference_no_pred(mock_server_result):
     image = np.zeros((300, 200, 3))
 
@@ -173,3 +180,152 @@ def test_localizer_tensorflow_serving_inference_no_pred(mock_server_result):
         return_all_scores=False,
     )
     assert output == expected_output
+
+
+def test_query_tensorflow_server_retries():
+    class Response(mock.Mock):
+
+        def __init__(self, status_code, json_text, **kwargs):
+            super().__init__(**kwargs)
+            self.status_code = status_code
+            self.json_text = json_text
+
+        def json(self):
+            return self.json_text
+
+    outputs = {'output/boxes:0': [], 'output/scores:0': [], 'output/labels:0': []}
+    responses = [
+        Response(503, {"error": "overloaded"}),
+        Response(503, {"error": "overloaded"}),
+        Response(200, {"outputs": outputs}),
+    ]
+    stats_before = get_client_stats()
+    with mock.patch('requests.Session.post', side_effect=responses) as mock_post, \
+            mock.patch('mot.object_detection.query_server.time.sleep') as mock_sleep:
+        assert query_tensorflow_server({"inputs": [[[0, 0, 0]]]}, 'http:localhost:8899') == outputs
+        assert mock_post.call_count == 3
+        assert mock_sleep.call_count == 2
+        assert mock_post.call_args[1]["timeout"] == TIMEOUT
+    stats_after = get_client_stats()
+    assert stats_after["requests"] - stats_before["requests"] == 3
+    assert stats_after["retries"] - stats_before["retries"] == 2
+    assert stats_after["failures"] == stats_before["failures"]
+
+    responses = [Response(503, {"error": "overloaded"}) for _ in range(MAX_RETRIES + 1)]
+    with mock.patch('requests.Session.post', side_effect=responses), \
+            mock.patch('mot.object_detection.query_server.time.sleep'):
+        with pytest.raises(ValueError):
+            query_tensorflow_server({"inputs": [[[0, 0, 0]]]}, 'http:localhost:8899')
+    assert get_client_stats()["failures"] - stats_after["failures"] == 1
+
+
+def test_get_session():
+    session = get_session()
+    assert get_session() is session
+
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(get_session()))
+    thread.start()
+    thread.join()
+    assert sessions[0] is not session
+
+
+def test_localizer_tensorflow_serving_inference_batch(stub_serving):
+    stub = stub_serving()
+    # two shapes, so two groups of frames sent in batches of at most 2
+    images = [np.full((300, 200, 3), i) for i in range(1, 4)]
+    images += [np.full((200, 300, 3), i) for i in range(4, 6)]
+
+    outputs = localizer_tensorflow_serving_inference_batch(
+        images, stub.url, return_all_scores=True, batch_size=2
+    )
+
+    assert stub.requests == 3
+    assert [output["output/labels:0"] for output in outputs] == [[i, 3] for i in range(1, 6)]
+    for image, output in zip(images, outputs):
+        assert output == localizer_tensorflow_serving_inference(
+            image, stub.url, return_all_scores=True
+        )
+
+
+def test_localizer_tensorflow_serving_inference_compressed(stub_serving):
+    stub = stub_serving()
+    image = np.full((300, 200, 3), 7)
+
+    output = localizer_tensorflow_serving_inference(image, stub.url)
+    with mock.patch('mot.object_detection.query_server.COMPRESS_REQUESTS', True):
+        assert localizer_tensorflow_serving_inference(image, stub.url) == output
+    assert output["output/labels:0"] == [7, 3]
+    assert stub.requests == 2
+
+
+def test_localizer_tensorflow_serving_inference_encoded(stub_serving):
+    stub = stub_serving()
+    images = [np.full((300, 200, 3), i, np.uint8) for i in [20, 40]]
+
+    with mock.patch('mot.object_detection.query_server.ENCODED_INPUTS', True), \
+        mock.patch('mot.object_detection.query_server.preprocess_for_serving') as mock_preprocess:
+        output = localizer_tensorflow_serving_inference(images[0], stub.url)
+        outputs = localizer_tensorflow_serving_inference_batch(images, stub.url, batch_size=2)
+    mock_preprocess.assert_not_called()
+
+    # the boxes answered by the SavedModel are already in the coordinates of the image
+    assert output == {
+        'output/boxes:0': [[0, 0, 0.4, 0.2], [0, 0, 0.4, 0.4]],
+        'output/scores:0': [0.71, 0.71],
+        'output/labels:0': [20, 3],
+    }
+    assert [output["output/labels:0"] for output in outputs] == [[20, 3], [40, 3]]
+    assert stub.requests == 3
+
+
+def test_query_tensorflow_server_deadline(stub_serving):
+    stub = stub_serving(delay=2)
+    start = time.time()
+    with use_deadline(Deadline(0.3)), pytest.raises(DeadlineExceeded):
+        query_tensorflow_server({"inputs": [[[0, 0, 0]]]}, stub.url)
+    # the request timed out at the deadline, and wasn't retried
+    assert time.time() - start < 1
+    assert stub.requests == 1
+
+
+def test_query_tensorflow_server_limiter(stub_serving):
+    stub = stub_serving()
+    url = stub.url
+    limiter = AIMDLimiter(initial_limit=1, max_limit=1)
+    epoch = limiter.acquire()
+    outputs = []
+    with mock.patch("mot.object_detection.query_server.get_limiter", return_value=limiter):
+        waiting = threading.Thread(
+            target=lambda: outputs.append(query_tensorflow_server({"inputs": [[[1, 0, 0]]]}, url))
+        )
+        waiting.start()
+        time.sleep(0.2)
+        # the request waiting for the limiter isn't outstanding on the replica yet
+        assert get_replica_set(url).stats()[0]["outstanding"] == 0
+        assert stub.requests == 0
+        limiter.release(epoch, latency=0.1, failed=False)
+        waiting.join()
+    assert outputs[0]["output/labels:0"] == [1, 3]
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_query_tensorflow_server_deadline_healthy_backend(stub_serving):
+    stub = stub_serving(delay=0.2)
+    url = stub.url
+    limiter = AIMDLimiter(initial_limit=8)
+    with mock.patch("mot.object_detection.query_server.get_limiter", return_value=limiter):
+        for _ in range(3):
+            with use_deadline(Deadline(0.05)), pytest.raises(DeadlineExceeded):
+                query_tensorflow_server({"inputs": [[[0, 0, 0]]]}, url)
+        # the deadline passed before the attempt
+        with use_deadline(Deadline(0)), pytest.raises(DeadlineExceeded):
+            query_tensorflow_server({"inputs": [[[0, 0, 0]]]}, url)
+    # the requests cut by their deadline don't count against the replica nor the limit
+    replica = get_replica_set(url).stats()[0]
+    assert replica["failures"] == 0
+    assert not replica["ejected"]
+    assert replica["outstanding"] == 0
+    assert limiter.limit == 8
+    assert limiter.stats()["decreases"] == 0
+    assert limiter.stats()["in_flight"] == 0
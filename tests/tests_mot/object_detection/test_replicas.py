@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from mot.object_detection.query_server import query_tensorflow_server
+from mot.object_detection.replicas import ReplicaSet, get_replica_set, parse_urls
+
+
+def test_parse_urls():
+    assert parse_urls("http://a:8501") == ["http://a:8501"]
+    assert parse_urls("http://a:8501, http://b:8501,") == ["http://a:8501", "http://b:8501"]
+    assert parse_urls(["http://a:8501", "http://b:8501"]) == ["http://a:8501", "http://b:8501"]
+    with pytest.raises(ValueError):
+        ReplicaSet([])
+    with pytest.raises(ValueError):
+        ReplicaSet(["http://a:8501"], policy="round_robin")
+
+
+@pytest.mark.parametrize("policy", ["least_outstanding", "power_of_two"])
+def test_replica_set_least_outstanding(policy):
+    replica_set = ReplicaSet(["a", "b", "c"], policy=policy)
+    replicas = [replica_set.acquire() for _ in range(3)]
+    if policy == "least_outstanding":
+        assert sorted(replica.url for replica in replicas) == ["a", "b", "c"]
+    replica_set.release(replicas[0], failed=False, duration=0.1)
+    for _ in range(10):
+        replica = replica_set.acquire()
+        if policy == "least_outstanding":
+            # the only replica with no request outstanding
+            assert replica is replicas[0]
+        replica_set.release(replica, failed=False, duration=0.1)
+    stats = {replica["url"]: replica for replica in replica_set.stats()}
+    assert sum(replica["outstanding"] for replica in stats.values()) == 2
+    assert sum(replica["requests"] for replica in stats.values()) == 13
+
+
+def test_replica_set_ejection():
+    replica_set = ReplicaSet(["a", "b"], eject_after=2, eject_seconds=0.2)
+    failing = replica_set.replicas[0]
+    for _ in range(2):
+        failing.outstanding += 1
+        replica_set.release(failing, failed=True)
+    assert replica_set.stats()[0]["ejected"]
+    assert all(replica_set.acquire().url == "b" for _ in range(5))
+
+    # when all the replicas are ejected, the first one coming back is used anyway
+    healthy = replica_set.replicas[1]
+    healthy.ejected_until = time.monotonic() + 10
+    assert replica_set.acquire() is failing
+
+    time.sleep(0.2)
+    assert not replica_set.stats()[0]["ejected"]
+    # back in rotation, but ejected again at its next failure until it answers
+    replica_set.release(failing, failed=True)
+    assert replica_set.stats()[0]["ejected"]
+    assert replica_set.stats()[0]["ejections"] == 2
+
+
+def test_query_tensorflow_server_replicas(stub_serving):
+    stubs = [stub_serving(delay=0.05) for _ in range(2)]
+    failing = stub_serving(status_code=503)
+    urls = ",".join([stubs[0].url, failing.url, stubs[1].url])
+    signature = {"inputs": [[[7, 0, 0]]]}
+
+    with mock.patch('mot.object_detection.query_server.RETRY_BACKOFF', 0), \
+            ThreadPoolExecutor(4) as executor:
+        outputs = list(
+            executor.map(lambda _: query_tensorflow_server(signature, urls), range(20))
+        )
+
+    assert all(output["output/labels:0"] == [7, 3] for output in outputs)
+    # the failing replica is ejected after 3 failures, plus the requests already sent to it by
+    # the other threads, and the others share the load
+    assert 3 <= failing.requests < 3 + 4
+    assert stubs[0].requests + stubs[1].requests == 20
+    assert min(stub.requests for stub in stubs) >= 5
+    stats = {replica["url"]: replica for replica in get_replica_set(urls).stats()}
+    assert stats[failing.url]["ejected"]
+    assert stats[failing.url]["failures"] == failing.requests
+    assert stats[stubs[0].url]["mean_latency_seconds"] >= 0.05
+    assert all(replica["outstanding"] == 0 for replica in stats.values())
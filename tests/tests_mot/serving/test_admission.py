@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from mot.serving.admission import AdmissionController, AdmissionRejected
+
+
+def test_admission_budgets():
+    controller = AdmissionController(max_requests=2, max_frames=10, max_queued=0)
+    with controller.admit(frames=6):
+        with controller.admit(frames=4):
+            assert controller.stats()["requests"] == 2
+            assert controller.stats()["frames"] == 10
+            with pytest.raises(AdmissionRejected):
+                controller.acquire(frames=1)  # over the budget of requests
+        with pytest.raises(AdmissionRejected) as error:
+            controller.acquire(frames=5)  # over the budget of frames
+        assert error.value.retry_after >= 1
+    # a request costing more than the budget runs alone
+    with controller.admit(frames=100):
+        assert controller.stats()["frames"] == 10
+    stats = controller.stats()
+    assert stats["requests"] == stats["frames"] == stats["queued"] == 0
+    assert stats["admitted"] == 3
+    assert stats["rejected_queue_full"] == 2
+
+
+def test_admission_queue():
+    controller = AdmissionController(max_requests=1, max_queued=1, queue_timeout=5)
+    frames = controller.acquire()
+    admitted = []
+
+    def wait_for_admission():
+        with controller.admit():
+            admitted.append(time.monotonic())
+
+    waiting = threading.Thread(target=wait_for_admission)
+    waiting.start()
+    while controller.stats()["queued"] == 0:
+        time.sleep(0.01)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire()  # the queue is full
+    assert admitted == []
+    released_at = time.monotonic()
+    controller.release(frames, 0.5)
+    waiting.join()
+    assert admitted[0] >= released_at
+
+
+def test_admission_queue_timeout():
+    controller = AdmissionController(max_requests=1, max_queued=1, queue_timeout=0.05)
+    with controller.admit():
+        with pytest.raises(AdmissionRejected):
+            controller.acquire()
+    stats = controller.stats()
+    assert stats["rejected_timeout"] == 1
+    assert stats["queued"] == 0
@@ -1,11 +1,17 @@
+import io
 import json
+import os
+import time
 from unittest import mock
 
 import numpy as np
 import pytest
 
+from mot.serving.admission import AdmissionController
 from mot.serving.app import app
 
+PATH_TO_TEST_VIDEO = os.path.join(os.path.expanduser("~"), ".mot/tests/test_video.mp4")
+
 
 def mock_post_tensorpack_localizer(*args, **kwargs):
     boxes = [[0, 0, 120, 40], [0, 0, 120, 80]]
@@ -32,7 +38,7 @@ def mock_post_tensorpack_localizer(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_app_post(mock_server_result):
     image = np.ones((300, 200, 3))
     with app.test_client() as c:
@@ -65,3 +71,145 @@ def test_app_get():
         assert response.status_code == 404
         response = c.get("/")
         assert response.status_code == 200
+
+
+def test_app_jobs(stub_serving):
+    stub = stub_serving()
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference._job_queue", None), \
+            app.test_client() as c:
+        with open(PATH_TO_TEST_VIDEO, "rb") as f:
+            response = c.post(
+                "/jobs", data={"file": (f, "video.mp4", "video/mp4"), "fps": "2"}
+            )
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+        assert response.headers["Location"].endswith("/jobs/{}".format(job_id))
+
+        start = time.time()
+        while c.get("/jobs/{}".format(job_id)).get_json()["status"] in ["queued", "running"]:
+            assert time.time() - start < 60
+            time.sleep(0.1)
+        status = c.get("/jobs/{}".format(job_id)).get_json()
+        response = c.get("/jobs/{}/result".format(job_id))
+
+        assert c.get("/jobs/unknown").status_code == 404
+        assert c.post("/jobs", data={}).status_code == 400
+
+    assert status["status"] == "done"
+    assert status["frames_done"] == status["frames_total"] == stub.requests
+    assert response.status_code == 200
+    output = response.get_json()
+    assert output["video_id"] == "video.mp4"
+    assert output["video_length"] == stub.requests
+
+
+def test_app_post_profile(stub_serving):
+    stub = stub_serving()
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), app.test_client() as c:
+        with open(PATH_TO_TEST_VIDEO, "rb") as f:
+            response = c.post(
+                "/?profile=1", data={"file": (f, "video.mp4", "video/mp4"), "fps": "2"}
+            )
+    assert response.status_code == 200
+    output = response.get_json()
+    assert output["video_length"] == stub.requests
+    functions = {function["function"]: function for function in output["profile"]["functions"]}
+    # the request thread and the tasks of the workers are both profiled
+    assert any(name.endswith("(handle_file)") for name in functions)
+    assert any(name.endswith("(process_frame)") for name in functions)
+
+
+def test_app_post_overloaded(stub_serving):
+    stub = stub_serving()
+    controller = AdmissionController(max_requests=1, max_queued=0)
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference._admission_controller", controller), \
+            app.test_client() as c:
+        image = {"image": np.zeros((2, 2, 3), dtype=np.uint8).tolist()}
+        with controller.admit():
+            response = c.post("/", json=image)
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+        assert c.post("/", json=image).status_code == 200
+        stats = c.get("/stats/admission").get_json()
+    assert stats["rejected_queue_full"] == 1
+    assert stats["requests"] == 0
+
+
+def test_app_post_stream(stub_serving):
+    stub = stub_serving()
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), app.test_client() as c:
+        with open(PATH_TO_TEST_VIDEO, "rb") as f:
+            response = c.post(
+                "/?stream=1", data={"file": (f, "video.mp4", "video/mp4"), "fps": "2"}
+            )
+        assert response.mimetype == "application/x-ndjson"
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        response.close()
+        # the request is admitted until the end of the stream
+        assert c.get("/stats/admission").get_json()["requests"] == 0
+
+    frames = [event for event in events if event["type"] == "frame"]
+    tracks = [event for event in events if event["type"] == "track"]
+    assert [event["frame"] for event in frames] == list(range(stub.requests))
+    assert set(frames[0]["detected_trash"][0]) == {"box", "label", "score"}
+    assert len(tracks) > 0
+    assert events.index(tracks[0]) > events.index(frames[-1])
+    assert events[-1] == {
+        "type": "result", "video_length": stub.requests, "fps": 2, "video_id": "video.mp4"
+    }
+
+
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
+def test_app_metrics(mock_server_result):
+    with app.test_client() as c:
+        c.post("/", json={"image": np.ones((300, 200, 3)).tolist()})
+        response = c.get("/metrics")
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    for stage in ["preprocess", "encode", "backend", "decode", "serialization"]:
+        assert any(
+            line.startswith('mot_stage_duration_seconds_count{{stage="{}"}}'.format(stage))
+            for line in lines
+        )
+    assert any(
+        line.startswith('mot_request_duration_seconds_count{endpoint="index"}') for line in lines
+    )
+    assert 'mot_requests_in_flight{kind="http"} 1' in lines  # the request to /metrics
+    assert any(line.startswith("mot_frames_processed_total ") for line in lines)
+    assert any(line.startswith("mot_serving_client_requests_total ") for line in lines)
+
+
+def test_app_jobs_unreadable_file():
+    with mock.patch("mot.serving.inference._job_queue", None), app.test_client() as c:
+        response = c.post(
+            "/jobs", data={"file": (io.BytesIO(b"not an image"), "image.jpg", "image/jpeg")}
+        )
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+
+        start = time.time()
+        while c.get("/jobs/{}".format(job_id)).get_json()["status"] in ["queued", "running"]:
+            assert time.time() - start < 10
+            time.sleep(0.1)
+        status = c.get("/jobs/{}".format(job_id)).get_json()
+        response = c.get("/jobs/{}/result".format(job_id))
+
+    assert status["status"] == "failed"
+    assert status["error"] == "Could not decode the image image.jpg."
+    assert response.status_code == 500
+    assert response.get_json()["status"] == "failed"
+
+
+def test_app_jobs_form():
+    with mock.patch("mot.serving.inference._job_queue", None), app.test_client() as c:
+        response = c.post("/jobs", data={
+            "file": (io.BytesIO(b"not an image"), "image.jpg", "image/jpeg"), "profile": "1"
+        })
+        assert response.status_code == 202
+        response = c.post("/jobs", data={
+            "file": (io.BytesIO(b"not an image"), "image.jpg", "image/jpeg"), "stream_frames": "no"
+        })
+        assert response.status_code == 400
+        assert response.get_json()["error"] == "stream_frames isn't a boolean, send 0 or 1."
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mot.serving.coalescing import RequestCoalescer
+from mot.utils.deadlines import (
+    Deadline, DeadlineExceeded, call_with_deadline, current_deadline, use_deadline
+)
+
+
+def test_coalescing():
+    batches = []
+
+    def batch_function(items):
+        batches.append(items)
+        return [item * item for item in items]
+
+    coalescer = RequestCoalescer(batch_function, max_batch_size=4, max_wait=0.2)
+    with ThreadPoolExecutor(10) as executor:
+        results = list(executor.map(coalescer, range(10)))
+
+    assert results == [x * x for x in range(10)]
+    assert sorted(item for batch in batches for item in batch) == list(range(10))
+    assert all(len(batch) <= 4 for batch in batches)
+    assert len(batches) < 10
+
+
+def test_coalescing_max_wait():
+    coalescer = RequestCoalescer(lambda items: items, max_batch_size=4, max_wait=0.05)
+    start = time.time()
+    assert coalescer("alone") == "alone"
+    assert time.time() - start < 1
+
+
+def test_coalescing_error():
+
+    def batch_function(items):
+        raise ValueError("backend error")
+
+    coalescer = RequestCoalescer(batch_function, max_batch_size=2, max_wait=0.01)
+    with pytest.raises(ValueError, match="backend error"):
+        coalescer(1)
+
+
+def test_coalescing_missing_results():
+    coalescer = RequestCoalescer(lambda items: items[:1], max_batch_size=2, max_wait=0.2)
+    futures = [coalescer.submit(1), coalescer.submit(2)]
+    # every caller of the batch gets the error, none waits forever
+    for future in futures:
+        with pytest.raises(ValueError, match="returned 1 results for 2 items"):
+            future.result(timeout=2)
+
+
+def test_coalescing_deadline():
+    expiries = []
+
+    def batch_function(items):
+        expiries.append(current_deadline().expires_at)
+        return items
+
+    coalescer = RequestCoalescer(batch_function, max_batch_size=2, max_wait=1)
+    deadlines = [Deadline(5), Deadline(2)]
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(call_with_deadline, deadlines, [coalescer] * 2, [1, 2]))
+    assert results == [1, 2]
+    # the batch runs under the earliest deadline of its items
+    assert expiries == [deadlines[1].expires_at]
+
+
+def test_coalescing_deadline_wait():
+    processed = []
+
+    def batch_function(items):
+        time.sleep(0.5)
+        processed.extend(items)
+        return items
+
+    coalescer = RequestCoalescer(
+        batch_function, max_batch_size=1, max_wait=0.01, max_concurrent_batches=1
+    )
+    start = time.time()
+    with use_deadline(Deadline(0.2)), pytest.raises(DeadlineExceeded):
+        coalescer(1)
+    # the caller doesn't wait for the backend once its deadline has passed
+    assert time.time() - start < 0.4
+    # the items whose deadline has passed before their batch is processed are dropped
+    with use_deadline(Deadline(0.1)):
+        future = coalescer.submit(2)
+    with pytest.raises(DeadlineExceeded):
+        future.result(2)
+    assert coalescer(3) == 3
+    assert processed == [1, 3]
@@ -0,0 +1,42 @@
+import os
+import time
+from unittest import mock
+
+import numpy as np
+
+from mot.serving.frame_store import FrameStore
+
+
+def test_frame_store(tmpdir):
+    path = os.path.join(str(tmpdir), "store", "frames.sqlite")
+    store = FrameStore(path)
+    assert store.get("video") == {}
+    output = {"output/boxes:0": np.array([[0, 0, 1, 1]]), "output/labels:0": np.array([1])}
+    store.put("video", 0, output)
+    store.put("video", 2, {})
+    store.put("other video", 0, {})
+
+    stored = store.get("video")
+    assert sorted(stored) == [0, 2]
+    np.testing.assert_array_equal(stored[0]["output/boxes:0"], output["output/boxes:0"])
+    assert store.stats() == {"hits": 1, "misses": 1, "writes": 3, "videos": 2, "frames": 3}
+    store.close()
+
+    # the inferences survive a restart
+    store = FrameStore(path)
+    assert sorted(store.get("video")) == [0, 2]
+
+
+def test_frame_store_prune(tmpdir):
+    path = os.path.join(str(tmpdir), "frames.sqlite")
+    store = FrameStore(path)
+    with mock.patch("time.time", return_value=time.time() - 100):
+        store.put("video", 0, {})
+    store.put("video", 1, {})
+    assert store.prune(ttl=50) == 1
+    assert list(store.get("video")) == [1]
+    store.close()
+
+    with mock.patch("time.time", return_value=time.time() + 100):
+        store = FrameStore(path, ttl=50)  # removed when the store is opened
+    assert store.get("video") == {}
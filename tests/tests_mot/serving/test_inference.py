@@ -1,13 +1,23 @@
+import itertools
 import json
 import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import cv2
 import numpy as np
 import pytest
 from werkzeug import FileStorage
+from werkzeug.utils import secure_filename
 
-from mot.serving.inference import handle_post_request, predict_and_format_image, process_image
+from mot.serving import inference
+from mot.serving.inference import (
+    get_frame_store_stats, get_result_cache_stats, handle_post_request, parse_form,
+    predict_and_format_image, process_image
+)
+from mot.serving.result_cache import hash_stream
 
 HOME = os.path.expanduser("~")
 PATH_TO_TEST_VIDEO = os.path.join(HOME, ".mot/tests/test_video.mp4")
@@ -39,7 +49,7 @@ def mock_post_tensorpack_localizer(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_handle_post_request_image(mock_server_result):
     image = np.ones((300, 200, 3))
     data = "{}".format(json.dumps({"image": image.tolist()}))
@@ -86,7 +96,7 @@ def test_handle_post_request_video():
             output = handle_post_request()
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_handle_post_request_file_image(mock_server_result, tmpdir):
     data = np.ones((300, 200, 3))
     filename = "test.jpg"
@@ -107,6 +117,9 @@ def test_handle_post_request_file_image(mock_server_result, tmpdir):
     with mock.patch("mot.serving.inference.request", m):
         output = handle_post_request(upload_folder=upload_folder)
 
+    # the image is decoded in memory and the other files of the folder aren't touched
+    assert os.listdir(upload_folder) == [filename]
+
     expected_output = {
         "image":
             output["image"],
@@ -126,7 +139,7 @@ def test_handle_post_request_file_image(mock_server_result, tmpdir):
     assert output == expected_output
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_handle_post_request_file_video(mock_server_result, tmpdir):
     m = mock.MagicMock()
     files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
@@ -150,7 +163,103 @@ def test_handle_post_request_file_video(mock_server_result, tmpdir):
     assert output["fps"] == 2
     assert "video_id" in output
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+def test_parse_form():
+    form = {"fps": "2", "stream_frames": "0", "deadline": "2.5", "resolution": "", "other": "1"}
+    parameters = parse_form(form)
+    assert parameters == {"fps": 2, "stream_frames": False, "deadline": 2.5}
+    assert isinstance(parameters["fps"], int)
+    assert parse_form({"fps": "0.5", "stream_frames": "True"}) == {
+        "fps": 0.5, "stream_frames": True
+    }
+    with pytest.raises(ValueError):
+        parse_form({"stream_frames": "no"})
+
+
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
+def test_handle_post_request_file_video_split(mock_server_result, tmpdir):
+    m = mock.MagicMock()
+    files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
+    m.files = files
+    m.form = {"fps": "2", "stream_frames": "false"}
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch.object(inference, "split_video", wraps=inference.split_video) as split:
+        output = handle_post_request(upload_folder=str(tmpdir))
+
+    split.assert_called_once()
+    assert len(output["detected_trash"]) == 2
+    assert output["video_length"] == 6 or output["video_length"] == 7
+    assert output["fps"] == 2
+    # the temporary folder of the request, with the video and its frames, is removed
+    assert os.listdir(str(tmpdir)) == []
+
+def test_handle_post_request_file_video_async(stub_serving, tmpdir):
+    stub = stub_serving()
+    m = mock.MagicMock()
+    files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
+    m.files = files
+    m.form = {"fps": 2}
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.ASYNC_MAX_IN_FLIGHT", 4):
+        output = handle_post_request(upload_folder=str(tmpdir))
+
+    assert output["video_length"] == 6 or output["video_length"] == 7
+    assert stub.requests == output["video_length"]
+    assert len(output["detected_trash"]) > 0
+
+def test_handle_post_request_file_video_batch(stub_serving, tmpdir):
+    stub = stub_serving()
+    m = mock.MagicMock()
+    files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
+    m.files = files
+    m.form = {"fps": 2}
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.BATCH_SIZE", 4):
+        output = handle_post_request(upload_folder=str(tmpdir))
+
+    assert output["video_length"] == 6 or output["video_length"] == 7
+    assert stub.requests == 2
+    assert len(output["detected_trash"]) > 0
+
+@pytest.mark.parametrize("async_max_in_flight", [0, 1])
+def test_handle_post_request_file_video_deadline(stub_serving, tmpdir, async_max_in_flight):
+    answers = itertools.count()
+    # tensorflow serving hangs after 3 answers
+    stub = stub_serving(delay=lambda label: 20 if next(answers) >= 3 else 0)
+    m = mock.MagicMock()
+    m.files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
+    m.form = {"fps": 2, "deadline": "5"}
+    start = time.time()
+    # the frames are sent one at a time so that the stub answers them in order, and as JPEG,
+    # which the stub decodes faster
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.FRAMES_IN_FLIGHT", 1), \
+            mock.patch("mot.serving.inference.ASYNC_MAX_IN_FLIGHT", async_max_in_flight), \
+            mock.patch("mot.object_detection.query_server.ENCODED_INPUTS", True):
+        output = handle_post_request(upload_folder=str(tmpdir))
+
+    assert time.time() - start < 7
+    # the frames analyzed before the deadline are tracked
+    assert output["partial"]
+    assert output["video_length"] == 3
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_handle_post_request_file_video_deadline_no_frame(stub_serving, tmpdir):
+    stub = stub_serving(delay=20)
+    m = mock.MagicMock()
+    m.files = {"file": FileStorage(open(PATH_TO_TEST_VIDEO, "rb"), content_type='video/mkv')}
+    m.form = {"fps": 2, "deadline": "1"}
+    start = time.time()
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch("mot.serving.inference.SERVING_URL", stub.url):
+        output = handle_post_request(upload_folder=str(tmpdir))
+    assert time.time() - start < 3
+    assert output == {"error": "The deadline of the request has passed."}
+
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_handle_post_request_file_zip(mock_server_result, tmpdir):
     m = mock.MagicMock()
     files = {"file": FileStorage(open(PATH_TO_TEST_ZIP, "rb"), content_type='application/zip')}
@@ -171,6 +280,37 @@ def test_handle_post_request_file_zip(mock_server_result, tmpdir):
     assert "video_id" in output
 
 
+def test_handle_post_request_file_image_encoded(stub_serving, tmpdir):
+    stub = stub_serving()
+    filepath = os.path.join(tmpdir, "test.png")
+    cv2.imwrite(filepath, np.full((300, 200, 3), 1, np.uint8))
+    m = mock.MagicMock()
+    m.files = {"file": FileStorage(open(filepath, "rb"), content_type='image/png')}
+    # the uploaded PNG is sent as it is, even when the images are coalesced
+    with mock.patch("mot.serving.inference.request", m), \
+            mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.COALESCE_MAX_BATCH_SIZE", 4), \
+            mock.patch("mot.object_detection.query_server.ENCODED_INPUTS", True), \
+            mock.patch("cv2.imencode", side_effect=AssertionError("encoded again")):
+        output = handle_post_request(upload_folder=str(tmpdir))
+    assert stub.requests == 1
+    assert len(output["detected_trash"]) == 2
+
+
+def test_handle_post_request_file_image_invalid(tmpdir):
+    filename = "test.jpg"
+    filepath = os.path.join(tmpdir, filename)
+    with open(filepath, "w") as f:
+        f.write("not an image")
+    m = mock.MagicMock()
+    m.files = {"file": FileStorage(open(filepath, "rb"), content_type='image/jpg')}
+    with mock.patch("mot.serving.inference.request", m):
+        output = handle_post_request(upload_folder=str(tmpdir))
+    assert output == {
+        "error": "Could not decode the image {}.".format(secure_filename(filepath))
+    }
+
+
 def test_handle_post_request_file_other(tmpdir):
     filename = "test.pdf"
     filepath = os.path.join(tmpdir, filename)
@@ -188,7 +328,7 @@ def test_handle_post_request_file_other(tmpdir):
     )  # the upload_folder should be created by handle post request
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_process_image(mock_server_result, tmpdir):
     image = np.ones((300, 200, 3))
     image_path = os.path.join(tmpdir, "image.jpg")
@@ -201,7 +341,7 @@ def test_process_image(mock_server_result, tmpdir):
     }
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer)
 def test_predict_and_format_image(mock_server_result, tmpdir):
     image = np.ones((300, 200, 3))
     predictions = predict_and_format_image(image)
@@ -243,6 +383,108 @@ def test_predict_and_format_image(mock_server_result, tmpdir):
     assert predictions == []
 
 
+def test_predict_and_format_image_coalesced(stub_serving):
+    stub = stub_serving(delay=0.1)
+    images = [np.full((300, 200, 3), 1) for _ in range(6)]
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.COALESCE_MAX_BATCH_SIZE", 3), \
+            mock.patch("mot.serving.inference.COALESCE_MAX_WAIT", 0.5), \
+            mock.patch("mot.serving.inference._coalescer", None):
+        with ThreadPoolExecutor(6) as executor:
+            predictions = list(executor.map(predict_and_format_image, images))
+
+    assert stub.requests == 2
+    for image_predictions in predictions:
+        assert image_predictions == [
+            {
+                "box": [0, 0, 0.1, 0.05],
+                "label": "bottles",
+                "score": 0.71
+            }, {
+                "box": [0, 0, 0.1, 0.1],
+                "label": "fragments",
+                "score": 0.71
+            }
+        ]
+
+
+def test_handle_post_request_file_cached(stub_serving, tmpdir):
+    stub = stub_serving()
+    outputs = []
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.RESULT_CACHE_SIZE", 4), \
+            mock.patch("mot.serving.inference._result_cache", None):
+        for filename, fps in [("a.mp4", 2), ("b.mp4", 2), ("a.mp4", 1)]:
+            m = mock.MagicMock()
+            stream = open(PATH_TO_TEST_VIDEO, "rb")
+            m.files = {"file": FileStorage(stream, filename, content_type='video/mp4')}
+            m.form = {"fps": fps}
+            with mock.patch("mot.serving.inference.request", m):
+                outputs.append(handle_post_request(upload_folder=str(tmpdir)))
+            if len(outputs) == 2:
+                # the same video uploaded under another name is answered from the cache
+                assert stub.requests == outputs[0]["video_length"]
+        stats = get_result_cache_stats()
+
+    assert outputs[1] == dict(outputs[0], video_id="b.mp4")
+    assert outputs[2]["fps"] == 1  # another fps isn't answered from the cache
+    assert stub.requests == outputs[0]["video_length"] + outputs[2]["video_length"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_handle_post_request_file_frame_store(stub_serving, tmpdir):
+    stub = stub_serving()
+    path = os.path.join(str(tmpdir), "frames.sqlite")
+    upload_folder = os.path.join(str(tmpdir), "uploads")
+    outputs = []
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.FRAME_STORE_PATH", path), \
+            mock.patch("mot.serving.inference._frame_store", None):
+        for i in range(3):
+            m = mock.MagicMock()
+            stream = open(PATH_TO_TEST_VIDEO, "rb")
+            m.files = {"file": FileStorage(stream, "video.mp4", content_type='video/mp4')}
+            m.form = {"fps": 2}
+            with mock.patch("mot.serving.inference.request", m):
+                outputs.append(handle_post_request(upload_folder=upload_folder))
+            if i == 0:
+                video_length = outputs[0]["video_length"]
+                assert stub.requests == video_length
+                # as if the analysis had failed on the odd frames
+                with sqlite3.connect(path) as connection:
+                    connection.execute("DELETE FROM frames WHERE frame % 2 = 1")
+                connection.close()
+        stats = get_frame_store_stats()
+
+    # only the missing frames are sent again, and not at all the third time
+    assert stub.requests == video_length + video_length // 2
+    assert outputs[1] == outputs[0]
+    assert outputs[2] == outputs[0]
+    assert stats["frames"] == video_length
+    assert stats["writes"] == video_length + video_length // 2
+
+
+def test_handle_post_request_file_hashed_once(stub_serving, tmpdir):
+    stub = stub_serving()
+    m = mock.MagicMock()
+    stream = open(PATH_TO_TEST_VIDEO, "rb")
+    m.files = {"file": FileStorage(stream, "video.mp4", content_type='video/mp4')}
+    m.form = {"fps": 2}
+    frame_store_path = os.path.join(str(tmpdir), "frames.sqlite")
+    # the result cache and the store of frames share the hash of the video
+    with mock.patch("mot.serving.inference.SERVING_URL", stub.url), \
+            mock.patch("mot.serving.inference.RESULT_CACHE_SIZE", 4), \
+            mock.patch("mot.serving.inference._result_cache", None), \
+            mock.patch("mot.serving.inference.FRAME_STORE_PATH", frame_store_path), \
+            mock.patch("mot.serving.inference._frame_store", None), \
+            mock.patch("mot.serving.inference.hash_stream", wraps=hash_stream) as mock_hash, \
+            mock.patch("mot.serving.inference.request", m):
+        output = handle_post_request(upload_folder=os.path.join(str(tmpdir), "uploads"))
+    assert stub.requests == output["video_length"]
+    assert mock_hash.call_count == 1
+
+
 def mock_post_tensorpack_localizer_error(*args, **kwargs):
     class Response(mock.Mock):
         json_text = {'error':  "¯\(°_o)/¯"}
@@ -258,7 +500,7 @@ def mock_post_tensorpack_localizer_error(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer_error)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer_error)
 def test_handle_post_request_file_error(mock_server_result, tmpdir):
     # videos
     m = mock.MagicMock()
@@ -302,7 +544,7 @@ def mock_post_tensorpack_localizer_unknown(*args, **kwargs):
     return response
 
 
-@mock.patch('requests.post', side_effect=mock_post_tensorpack_localizer_unknown)
+@mock.patch('requests.Session.post', side_effect=mock_post_tensorpack_localizer_unknown)
 def test_handle_post_request_file_unknwon(mock_server_result, tmpdir):
     # videos
     m = mock.MagicMock()
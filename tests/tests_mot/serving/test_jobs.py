@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from mot.serving.jobs import JobQueue, JobQueueFull
+
+
+def wait_for(job, timeout=5):
+    start = time.time()
+    while job.status in ["queued", "running"]:
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+def test_job_queue():
+    release = threading.Event()
+    progresses = []
+
+    def function(frames, progress=None):
+        for i in range(frames):
+            progress(i + 1, frames)
+            progresses.append(i + 1)
+        release.wait()
+        return {"frames": frames}
+
+    queue = JobQueue(workers=1, max_pending=2)
+    running_job = queue.submit(function, 3)
+    queued_job = queue.submit(function, 2)
+    with pytest.raises(JobQueueFull):
+        queue.submit(function, 1)
+
+    while len(progresses) < 3:
+        time.sleep(0.01)
+    assert running_job.as_dict() == {
+        "job_id": running_job.id,
+        "status": "running",
+        "frames_done": 3,
+        "frames_total": 3,
+    }
+    assert queued_job.status == "queued"
+
+    release.set()
+    wait_for(queued_job)
+    assert queue.get(running_job.id).result == {"frames": 3}
+    assert queue.get(queued_job.id).status == "done"
+    assert queue.get("unknown") is None
+    queue.submit(function, 1)  # the finished jobs aren't pending anymore
+
+
+def test_job_queue_failure_and_ttl():
+
+    def function(progress=None):
+        raise ValueError("No output image")
+
+    queue = JobQueue(workers=1, ttl=0.1)
+    job = queue.submit(function)
+    wait_for(job)
+    assert job.as_dict()["status"] == "failed"
+    assert job.as_dict()["error"] == "ValueError: No output image"
+    assert queue.get(job.id) is job
+
+    time.sleep(0.2)
+    assert queue.get(job.id) is None
+
+
+def test_job_queue_error_result():
+
+    def function(progress=None):
+        return {"error": "Could not decode the image test.jpg."}
+
+    queue = JobQueue(workers=1)
+    job = queue.submit(function)
+    wait_for(job)
+    assert job.as_dict()["status"] == "failed"
+    assert job.as_dict()["error"] == "Could not decode the image test.jpg."
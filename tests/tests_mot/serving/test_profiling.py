@@ -0,0 +1,52 @@
+import threading
+import time
+
+from mot.serving.profiling import current_session, profile_request
+
+
+def slow_task(duration):
+    time.sleep(duration)
+    return duration
+
+
+def test_profile_request():
+    assert current_session() is None
+    with profile_request() as session:
+        assert current_session() is session
+        slow_task(0.05)
+        task = threading.Thread(target=session.wrap(slow_task), args=(0.1,))
+        task.start()
+        task.join()
+    assert current_session() is None
+
+    report = session.report(top=5)
+    assert report["duration_seconds"] >= 0.15
+    assert len(report["functions"]) == 5
+    cumulative_times = [function["cumulative_seconds"] for function in report["functions"]]
+    assert cumulative_times == sorted(cumulative_times, reverse=True)
+    slow_task_report = [
+        function for function in session.report(top=1000)["functions"]
+        if function["function"].endswith("(slow_task)")
+    ]
+    # the calls of the request thread and of the wrapped task are merged
+    assert len(slow_task_report) == 1
+    assert slow_task_report[0]["calls"] == 2
+    assert slow_task_report[0]["cumulative_seconds"] >= 0.15
+
+
+def test_profile_request_threads():
+    # each request thread has its own session, the other threads aren't profiled
+    sessions = {}
+
+    def handle_request(name):
+        with profile_request() as session:
+            slow_task(0.01)
+        sessions[name] = session
+
+    threads = [threading.Thread(target=handle_request, args=(name,)) for name in ["a", "b"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sessions["a"] is not sessions["b"]
+    assert current_session() is None
@@ -0,0 +1,72 @@
+import io
+import os
+from unittest import mock
+
+from mot.serving.result_cache import ResultCache, cache_key, hash_stream
+
+
+def test_hash_stream():
+    stream = io.BytesIO(b"some video")
+    content_hash = hash_stream(stream)
+    assert stream.read() == b"some video"
+    assert content_hash == hash_stream(io.BytesIO(b"some video"))
+    assert content_hash != hash_stream(io.BytesIO(b"another video"))
+
+
+def test_cache_key():
+    assert cache_key("hash", fps=2, resolution=(10, 10)) == cache_key(
+        "hash", resolution=(10, 10), fps=2
+    )
+    assert cache_key("hash", fps=2) != cache_key("hash", fps=4)
+    assert cache_key("hash", fps=2) != cache_key("other hash", fps=2)
+
+
+def test_result_cache_memory():
+    cache = ResultCache(max_items=2)
+    cache.put("a", {"frame_to_box": {1: [0, 0, 1, 1]}})
+    cache.put("b", {})
+    assert cache.get("a") == {"frame_to_box": {1: [0, 0, 1, 1]}}
+    cache.put("c", {})  # "b" is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == {}
+    assert cache.stats() == {
+        "hits": 2,
+        "memory_hits": 2,
+        "disk_hits": 0,
+        "misses": 1,
+        "memory_evictions": 1,
+        "disk_evictions": 0,
+        "memory_items": 2,
+    }
+
+
+def test_result_cache_disk(tmpdir):
+    folder = os.path.join(str(tmpdir), "cache")
+    cache = ResultCache(max_items=1, folder=folder, max_disk_bytes=10**6)
+    cache.put("a", {"frame_to_box": {1: [0, 0, 1, 1]}})
+    cache.put("b", {})
+    # evicted from memory, but still on disk, with the same types
+    assert cache.get("a") == {"frame_to_box": {1: [0, 0, 1, 1]}}
+    assert cache.stats()["disk_hits"] == 1
+
+    # a new process reads the results of the previous ones
+    assert ResultCache(max_items=0, folder=folder).get("b") == {}
+
+    cache = ResultCache(max_items=0, folder=folder, max_disk_bytes=1500)
+    cache.put("a", {"data": "a" * 1000})
+    cache.put("c", {"data": "c" * 1000})
+    assert sorted(os.listdir(folder)) == ["c.pkl"]
+    assert cache.stats()["disk_evictions"] == 2  # "b" first as the least recently used, then "a"
+
+
+def test_result_cache_disk_size(tmpdir):
+    folder = os.path.join(str(tmpdir), "cache")
+    ResultCache(max_items=0, folder=folder).put("a", {"data": "a" * 1000})
+    cache = ResultCache(max_items=0, folder=folder, max_disk_bytes=2500)
+    # the files found at startup are counted without listing the folder again
+    with mock.patch("os.scandir", side_effect=AssertionError("folder listed")):
+        cache.put("b", {"data": "b" * 1000})
+        assert cache.get("a") is not None  # "b" is now the least recently used
+        cache.put("c", {"data": "c" * 1000})
+    assert sorted(os.listdir(folder)) == ["a.pkl", "c.pkl"]
+    assert cache.stats()["disk_evictions"] == 1
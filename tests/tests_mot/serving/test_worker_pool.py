@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from mot.serving.worker_pool import WorkerPool
+
+
+def square(x):
+    return x * x
+
+
+def test_imap():
+    for kind in ["thread", "process"]:
+        pool = WorkerPool(2, kind)
+        assert list(pool.imap(square, iter(range(10)), max_in_flight=3)) == [
+            x * x for x in range(10)
+        ]
+        pool.shutdown()
+
+
+def test_wrong_kind():
+    with pytest.raises(ValueError):
+        WorkerPool(2, "fiber")
+
+
+def test_imap_error():
+    def fail(x):
+        if x == 3:
+            raise ValueError("frame {}".format(x))
+        return x
+
+    pool = WorkerPool(2)
+    with pytest.raises(ValueError, match="frame 3"):
+        list(pool.imap(fail, range(10)))
+    pool.shutdown()
+
+
+def test_round_robin_between_requests():
+    pool = WorkerPool(1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    blocking_future = pool.submit("other", block)
+    started.wait()  # the only worker is busy, next tasks are queued
+
+    order = []
+    futures = [pool.submit("video_a", order.append, "a{}".format(i)) for i in range(3)]
+    futures += [pool.submit("video_b", order.append, "b{}".format(i)) for i in range(3)]
+    release.set()
+    for future in [blocking_future] + futures:
+        future.result()
+    assert order == ["a0", "b0", "a1", "b1", "a2", "b2"]
+    pool.shutdown()
+
+
+def test_cancel_waiting_tasks():
+    pool = WorkerPool(1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    pool.submit("other", block)
+    started.wait()
+    calls = []
+    future = pool.submit("video", calls.append, 0)
+    assert future.cancel()
+    release.set()
+    pool.submit("video", calls.append, 1).result()
+    assert calls == [1]
+    pool.shutdown()
+
+
+def test_imap_deadline():
+    pool = WorkerPool(1)
+    release = threading.Event()
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        if x == 1:
+            release.wait()
+        return x
+
+    outputs = pool.imap(slow, range(10), max_in_flight=3, deadline=time.time() + 0.1)
+    assert next(outputs) == 0
+    with pytest.raises(TimeoutError):
+        next(outputs)
+    release.set()
+    pool.submit("other", calls.append, "other").result()
+    # the tasks waiting for a worker were cancelled
+    assert calls == [0, 1, "other"]
+    pool.shutdown()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from mot.tracker.assignment import assign, greedy_assignment, hungarian_assignment
+
+
+def loop_greedy_assignment(sim_matrix, threshold):
+    # the greedy matching formerly done by ObjectTracking
+    sim_matrix = sim_matrix.copy()
+    matches = []
+    for _ in range(sim_matrix.shape[0]):
+        max_values = np.max(sim_matrix, axis=1)
+        if np.max(max_values) < threshold:
+            break
+        new_idx = np.argmax(max_values)
+        matching_idx = np.argmax(sim_matrix[new_idx])
+        sim_matrix[new_idx, :] = -1.0
+        sim_matrix[:, matching_idx] = -1.0
+        matches.append((new_idx, matching_idx))
+    return matches
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 8), (8, 3), (20, 20)])
+def test_greedy_assignment(shape):
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        # rounded so that there are equal similarities
+        sim_matrix = np.round(rng.uniform(-1, 1, shape), 1)
+        assert greedy_assignment(sim_matrix, 0.5) == loop_greedy_assignment(sim_matrix, 0.5)
+
+
+def test_hungarian_assignment():
+    sim_matrix = np.array([
+        [0.9, 0.8],
+        [0.8, 0.2],
+    ])
+    assert greedy_assignment(sim_matrix, 0.5) == [(0, 0)]
+    assert hungarian_assignment(sim_matrix, 0.5) == [(0, 1), (1, 0)]
+    # the pairs under the threshold aren't matched
+    assert hungarian_assignment(np.array([[0.4, 0.6], [0.1, 0.3]]), 0.5) == [(0, 1)]
+    assert hungarian_assignment(np.zeros((0, 3)), 0.5) == []
+
+
+@pytest.mark.parametrize("solver", [greedy_assignment, hungarian_assignment])
+def test_assignment_sparse(solver):
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        sim_matrix = rng.uniform(-1, 1, (12, 10))
+        # the missing pairs can't be matched, as the pairs under the threshold
+        sparse_matrix = sparse.coo_matrix(np.where(sim_matrix > 0, sim_matrix, 0))
+        assert solver(sparse_matrix, 0.5) == solver(sim_matrix, 0.5)
+
+
+def test_hungarian_assignment_components():
+    # two independent blocks, solved separately
+    sim_matrix = sparse.block_diag([[[0.9, 0.8], [0.8, 0.2]], [[0.6]]]).tocoo()
+    assert hungarian_assignment(sim_matrix, 0.5) == [(0, 1), (1, 0), (2, 2)]
+
+
+def test_assign():
+    sim_matrix = np.array([[0.9, 0.8], [0.8, 0.2]])
+    assert assign(sim_matrix, 0.5) == [(0, 0)]
+    assert assign(sim_matrix, 0.5, "hungarian") == [(0, 1), (1, 0)]
+    assert assign(sim_matrix, 0.5, lambda sim_matrix, threshold: [(1, 1)]) == [(1, 1)]
+    with pytest.raises(ValueError):
+        assign(sim_matrix, 0.5, "auction")
@@ -1,3 +1,4 @@
+import copy
 import os
 
 import numpy as np
@@ -20,6 +21,51 @@ def test_similarity():
     detection2 = [np.array([0., 0.,1.,0.]), np.array([0.0, 0.34, 1.0, 0.36]), 3]
     assert abs(object_tracking.similarity(detection1, detection2) - 0.8) < 0.0001
 
+def test_similarity_matrix():
+    rng = np.random.RandomState(0)
+    new_scores = rng.dirichlet(np.ones(3), size=7)
+    new_boxes = np.sort(rng.uniform(size=(7, 2, 2)), axis=1).reshape(7, 4)
+    old_scores = rng.dirichlet(np.ones(3), size=5)
+    old_boxes = np.sort(rng.uniform(size=(5, 2, 2)), axis=1).reshape(5, 4)
+    old_boxes[0] = [0.2, 0.3, 0.2, 0.3]  # an empty box gives nan, as with similarity
+    old_idxs = np.array([3, 4, 4, 2, 1])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matrix = object_tracking.similarity_matrix(
+            new_scores, new_boxes, 5, old_scores, old_boxes, old_idxs
+        )
+        expected = np.array([
+            [
+                object_tracking.similarity(
+                    [new_scores[i], new_boxes[i], 5], [old_scores[j], old_boxes[j], old_idxs[j]]
+                ) for j in range(5)
+            ] for i in range(7)
+        ])
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_build_similarity_matrix():
+    object_tracker = object_tracking.ObjectTracking("test_video", [], [], fps=1)
+    tracklet = object_tracking.Track(0, [0.8, 0.1, 0.1], [0.5, 0.4, 0.6, 0.5], 0)
+    tracklet.add_matching_detection([0.7, 0.2, 0.1], [0.52, 0.4, 0.62, 0.5], 1)
+    tracklet.add_matching_detection([0.7, 0.2, 0.1], [0.54, 0.41, 0.64, 0.51], 2)
+    tracklets = [tracklet, object_tracking.Track(1, [0.1, 0.1, 0.8], [0.1, 0.1, 0.2, 0.3], 1)]
+    new_scores = [[0.7, 0.2, 0.1], [0.2, 0.1, 0.7], [0.3, 0.3, 0.4]]
+    new_boxes = [[0.56, 0.42, 0.66, 0.52], [0.1, 0.12, 0.2, 0.31], [0.8, 0.8, 0.9, 0.85]]
+
+    matrix = object_tracker.build_similarity_matrix(new_scores, new_boxes, 3, tracklets)
+    expected = [
+        [
+            object_tracking.similarity(
+                [np.array(scores), np.array(box), 3],
+                t.get_latest_detection(apply_speed=True, new_frame_id=3)
+            ) for t in tracklets
+        ] for scores, box in zip(new_scores, new_boxes)
+    ]
+    np.testing.assert_array_equal(matrix, expected)
+    assert object_tracker.build_similarity_matrix([], [], 3, tracklets) is None
+
+
 def test_build_tracklets():
     object_tracker = object_tracking.ObjectTracking("test_video", [], [], fps=1)
     test_input_detections = [
@@ -59,6 +105,97 @@ def test_build_tracklets():
     assert len(tracklets[0].boxes) == 1
 
 
+def list_speed(boxes, frames):
+    # the speed formerly recomputed from the lists of boxes and frames of a Track
+    boxes_array = np.array(boxes)
+    time_differences = np.array([float(y-x) for x,y in zip(frames[1:], frames[0:-1])])
+    speed = np.mean((boxes_array[1:, :] - boxes_array[0:-1, :]).T / time_differences, axis=-1)
+    vx = (speed[0]+speed[2])/2
+    vy = (speed[1]+speed[3])/2
+    return np.array([vx, vy, vx, vy])
+
+
+def test_track_statistics():
+    rng = np.random.RandomState(0)
+    frames = np.cumsum(rng.randint(1, 4, 30)).tolist()
+    boxes = np.sort(rng.uniform(size=(30, 2, 2)), axis=1).reshape(-1, 4).tolist()
+    scores = rng.dirichlet(np.ones(3), size=30).tolist()
+
+    track = object_tracking.Track(0, scores[0], boxes[0], frames[0])
+    assert track.speed is None
+    # over the initial capacity of the buffers
+    for i in range(1, 30):
+        track.add_matching_detection(scores[i], boxes[i], frames[i])
+        assert (track.speed is None) == (i < 2)
+    assert track.frames == frames and track.boxes == boxes and track.scores == scores
+    assert track.first_frame == frames[0] and track.last_frame == frames[-1]
+    np.testing.assert_array_equal(track.speed, list_speed(boxes, frames))
+    np.testing.assert_array_equal(track.get_average_scores(), np.mean(np.array(scores), axis=0))
+    assert track.track_score == np.max(np.mean(np.array(scores), axis=0))
+    assert track.get_label() == np.argmax(np.array(scores).sum(axis=0)) + 1
+
+    # appending tracks gives the same statistics as adding their detections one by one
+    appended = object_tracking.Track(0, scores[0], boxes[0], frames[0])
+    for start, end in [(1, 2), (2, 13), (13, 30)]:
+        tracklet = object_tracking.Track(1, scores[start], boxes[start], frames[start])
+        for i in range(start + 1, end):
+            tracklet.add_matching_detection(scores[i], boxes[i], frames[i])
+        appended.append_track(tracklet)
+    assert appended.frames == frames and appended.boxes == boxes
+    np.testing.assert_array_equal(appended.speed, track.speed)
+    np.testing.assert_array_equal(appended.get_average_scores(), track.get_average_scores())
+    assert appended.json_result() == track.json_result()
+
+
+def test_build_tracklet_similarity_matrix():
+    object_tracker = object_tracking.ObjectTracking("test_video", [], [], fps=1)
+    rng = np.random.RandomState(0)
+    tracklets = []
+    for start in sorted(rng.randint(0, 60, 40)):
+        frames = start + np.cumsum(rng.randint(1, 3, rng.randint(1, 5)))
+        boxes = np.sort(rng.uniform(size=(len(frames), 2, 2)), axis=1).reshape(-1, 4).tolist()
+        scores = rng.dirichlet(np.ones(3), size=len(frames)).tolist()
+        tracklet = object_tracking.Track(len(tracklets), scores[0], boxes[0], int(frames[0]))
+        for frame_scores, box, frame in zip(scores[1:], boxes[1:], frames[1:]):
+            tracklet.add_matching_detection(frame_scores, box, int(frame))
+        tracklets.append(tracklet)
+
+    # the boxes projected out of the frame are clipped to empty boxes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for max_gap in [None, 5]:
+            matrix = object_tracker.build_tracklet_similarity_matrix(tracklets, max_gap).toarray()
+            expected = np.zeros((len(tracklets), len(tracklets)))
+            for i, old in enumerate(tracklets):
+                for j, new in enumerate(tracklets):
+                    gap = new.frames[0] - old.frames[-1]
+                    if gap > 0 and (max_gap is None or gap <= max_gap):
+                        expected[i, j] = old.compatibility(new)
+            np.testing.assert_array_equal(matrix, expected)
+    assert object_tracker.build_tracklet_similarity_matrix([]) is None
+
+
+def test_match_tracklets():
+    object_tracker = object_tracking.ObjectTracking("test_video", [], [], fps=1)
+    tracklets = []
+    # a bottle drifting right, whose detection is lost on frames 2 and 5
+    for frames in [[0, 1], [3, 4], [6, 7]]:
+        tracklet = None
+        for frame in frames:
+            box = [0.1 + 0.02 * frame, 0.4, 0.15 + 0.02 * frame, 0.45]
+            if tracklet is None:
+                tracklet = object_tracking.Track(len(tracklets), [0.8, 0.1, 0.1], box, frame)
+            else:
+                tracklet.add_matching_detection([0.8, 0.1, 0.1], box, frame)
+        tracklets.append(tracklet)
+    tracklets.append(object_tracking.Track(3, [0.1, 0.1, 0.8], [0.8, 0.8, 0.9, 0.9], 3))
+
+    for solver in ["greedy", "hungarian"]:
+        tracks = object_tracker.match_tracklets(
+            [copy.deepcopy(tracklet) for tracklet in tracklets], None, solver=solver
+        )
+        assert [track.frames for track in tracks] == [[0, 1, 3, 4, 6, 7], [3]]
+
+
 def test_track_objects():
     test_image_list = ["mock_frame_1", "mock_frame_2", "mock_frame_3"]
     test_inference_data = [
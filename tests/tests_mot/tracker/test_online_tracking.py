@@ -0,0 +1,88 @@
+import copy
+
+import pytest
+
+from mot.tracker import object_tracking
+from mot.tracker.online_tracking import OnlineTracking
+
+
+def detections(frame_idx, objects):
+    # objects drifting right, each lost on some frames
+    boxes = [
+        [x + 0.01 * frame_idx, y, x + 0.05 + 0.01 * frame_idx, y + 0.04]
+        for x, y, frames in objects if frame_idx in frames
+    ]
+    return {"output/boxes:0": boxes, "output/scores:0": [[0.8, 0.1, 0.1]] * len(boxes)}
+
+
+def test_online_tracking():
+    objects = [
+        (0.1, 0.2, set(range(0, 12)) - {5, 6, 7}),
+        (0.2, 0.6, set(range(3, 30)) - {15, 16, 17}),
+    ]
+    inference_outputs = [detections(frame_idx, objects) for frame_idx in range(30)]
+    batch_tracks = object_tracking.ObjectTracking(
+        "test_video", list(range(30)), copy.deepcopy(inference_outputs), max_link_gap=5
+    ).compute_tracks()
+
+    emitted = []
+    online = OnlineTracking(max_link_gap=5, on_track=emitted.append)
+    first_tracks = []
+    for frame_idx, output in enumerate(copy.deepcopy(inference_outputs)):
+        tracks = online.update(frame_idx, output)
+        if tracks:
+            first_tracks.append((frame_idx, tracks))
+    tracks = [track for _, frame_tracks in first_tracks for track in frame_tracks]
+    tracks += online.flush()
+
+    assert sorted(track.frames for track in tracks) == \
+        sorted(track.frames for track in batch_tracks)
+    assert len(tracks) == 2
+    # the first object is emitted once no tracklet can continue it, before the end of the video
+    frame_idx, frame_tracks = first_tracks[0]
+    assert frame_idx < 29
+    assert frame_tracks[0].frames == sorted(objects[0][2])
+    assert emitted == tracks
+
+
+def test_online_tracking_batch():
+    # objects seen at the same time, whose tracklets are linked differently online
+    objects = [
+        (0.05, 0.1, set(range(27, 47)) - {42}),
+        (0.25, 0.3, set(range(8, 32)) - {25, 26, 27, 28}),
+        (0.45, 0.5, set(range(29, 46)) - {38, 39, 40}),
+        (0.65, 0.7, set(range(18, 32)) - {28, 29}),
+    ]
+    inference_outputs = [detections(frame_idx, objects) for frame_idx in range(60)]
+    for max_link_gap in [5, None]:
+        batch_tracks = object_tracking.ObjectTracking(
+            "test_video", list(range(60)), copy.deepcopy(inference_outputs),
+            max_link_gap=max_link_gap,
+        ).compute_tracks()
+        online = OnlineTracking(max_link_gap=max_link_gap, batch=True)
+        tracks = list(online.track(copy.deepcopy(inference_outputs)))
+        assert [(track.frames, track.boxes) for track in tracks] == \
+            [(track.frames, track.boxes) for track in batch_tracks]
+
+
+def test_online_tracking_max_link_gap():
+    with pytest.raises(ValueError):
+        OnlineTracking(max_link_gap=None)
+
+
+def test_online_tracking_bounded_memory():
+    online = OnlineTracking()
+    held = []
+
+    def outputs():
+        # an object appears every 50 frames for 20 frames
+        for frame_idx in range(5000):
+            if frame_idx % 50 < 20:
+                yield detections(frame_idx % 50, [(0.1, 0.5, {frame_idx % 50})])
+            else:
+                yield {}
+            held.append(sum(online.stats().values()))
+
+    tracks = list(online.track(outputs()))
+    assert len(tracks) == 100
+    assert max(held) <= 2
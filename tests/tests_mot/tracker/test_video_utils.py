@@ -16,3 +16,19 @@ def test_split_video(tmpdir):
     assert os.path.isdir(output_folder)
     # Different versions of FFMPEG yield different results when splitting the video
     assert len(os.listdir(output_folder)) == 6 or len(os.listdir(output_folder)) == 7
+
+
+def test_stream_video():
+    frames = list(video_utils.stream_video(PATH_TO_TEST_VIDEO, fps=2, resolution=(64, 48)))
+
+    # Different versions of FFMPEG yield different results when splitting the video
+    assert len(frames) == 6 or len(frames) == 7
+    for frame in frames:
+        assert frame.shape == (48, 64, 3)
+        assert frame.dtype == np.uint8
+
+
+def test_stream_video_early_stop():
+    frames = video_utils.stream_video(PATH_TO_TEST_VIDEO, fps=2)
+    assert next(frames).shape == (768, 1024, 3)
+    frames.close()  # ffmpeg should be killed without raising
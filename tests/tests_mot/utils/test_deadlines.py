@@ -0,0 +1,50 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+from mot.utils.deadlines import (
+    Deadline, DeadlineExceeded, call_with_deadline, current_deadline, use_deadline
+)
+
+
+def test_deadline():
+    assert Deadline().remaining() is None
+    assert Deadline().timeout((10, 60)) == (10, 60)
+
+    deadline = Deadline(5)
+    assert 4 < deadline.remaining() <= 5
+    connect_timeout, read_timeout = deadline.timeout((1, 60))
+    assert connect_timeout == 1
+    assert 4 < read_timeout <= 5
+    assert not deadline.expired()
+
+    # only the expiry time is sent to another process
+    copy = pickle.loads(pickle.dumps(deadline))
+    assert copy.expires_at == deadline.expires_at
+
+    deadline.cancel()
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(60)
+    assert Deadline(0.01).remaining() < 0.02
+    expired = Deadline(0)
+    time.sleep(0.01)
+    with pytest.raises(DeadlineExceeded):
+        expired.check()
+
+
+def test_use_deadline():
+    deadline = Deadline(5)
+    assert current_deadline() is None
+    with use_deadline(deadline):
+        assert current_deadline() is deadline
+        # the other threads don't see it, unless their function is called with it
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(current_deadline()))
+        thread.start()
+        thread.join()
+        assert seen == [None]
+    assert call_with_deadline(deadline, current_deadline) is deadline
+    assert current_deadline() is None
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from mot.utils.metrics import MetricsRegistry
+
+
+def test_metrics_registry():
+    registry = MetricsRegistry()
+    counter = registry.counter("frames_total", "Frames.")
+    gauge = registry.gauge("in_flight", "In flight.", labelnames=("kind",))
+    histogram = registry.histogram("duration_seconds", "Durations.", ("stage",), buckets=(0.1, 1))
+    registry.add_collector(lambda: ["# TYPE other_total counter", "other_total 3"])
+
+    counter.inc()
+    counter.inc(2)
+    with gauge.track_inprogress(kind="http"):
+        gauge.inc(kind="backend")
+    gauge.set(4, kind="limit")
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, stage="tracking")
+    with pytest.raises(ValueError):
+        histogram.observe(1, step="tracking")
+
+    assert registry.render().splitlines() == [
+        "# HELP frames_total Frames.",
+        "# TYPE frames_total counter",
+        "frames_total 3",
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        'in_flight{kind="backend"} 1',
+        'in_flight{kind="http"} 0',
+        'in_flight{kind="limit"} 4',
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{stage="tracking",le="0.1"} 2',
+        'duration_seconds_bucket{stage="tracking",le="1.0"} 3',
+        'duration_seconds_bucket{stage="tracking",le="+Inf"} 4',
+        'duration_seconds_sum{stage="tracking"} 2.65',
+        'duration_seconds_count{stage="tracking"} 4',
+        "# TYPE other_total counter",
+        "other_total 3",
+    ]
+
+
+def test_histogram_time():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("duration_seconds", "Durations.", buckets=(0.1, 1))
+    with histogram.time():
+        time.sleep(0.2)
+    lines = registry.render().splitlines()
+    assert 'duration_seconds_bucket{le="0.1"} 0' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 1' in lines
+    assert 0.2 <= float(lines[-2].split()[-1]) < 1